@@ -0,0 +1,170 @@
+"""
+Offline benchmark of the FieldAligner optimizers on a simulated magnet and resonator.
+
+The resonator frequency drops quadratically with the field perpendicular to the (slightly tilted) film,
+and the magnet lags behind its setpoint by a hysteresis that depends on the direction of the last ramp.
+Compares the number of objective evaluations and ramps, and the remaining perpendicular field.
+
+Run with: python benchmarks/bench_field_aligner.py
+"""
+
+import contextlib
+import io
+import numpy as np
+from cqed.utils.field_aligner import FieldAligner
+
+
+class SimulatedMagnet:
+    """
+    Vector magnet with the x/y/z_target, x/y/z_measured and ramp interface of the mercuryIPS. The field at the
+    sample lags `hysteresis` (T) behind the setpoint in the direction of the last ramp of every axis.
+    """
+
+    def __init__(self, hysteresis=5e-6):
+        self.hysteresis = hysteresis
+        self.setpoint = np.zeros(3)
+        self.target = np.zeros(3)
+        self.last_direction = np.zeros(3)
+        self.nramps = 0
+        for i, axis in enumerate("xyz"):
+            setattr(self, f"{axis}_target", self._target_accessor(i))
+            setattr(self, f"{axis}_measured", lambda i=i: self.setpoint[i])
+
+    def _target_accessor(self, i):
+        def accessor(value=None):
+            if value is None:
+                return self.target[i]
+            self.target[i] = value
+        return accessor
+
+    def ramp(self, mode="safe"):
+        moved = self.target != self.setpoint
+        self.last_direction[moved] = np.sign(self.target - self.setpoint)[moved]
+        self.setpoint = self.target.copy()
+        self.nramps += 1
+
+    @property
+    def field_at_sample(self):
+        return self.setpoint - self.hysteresis * self.last_direction
+
+
+class SimulatedResonator:
+    """
+    Resonator whose frequency decreases as curvature * B_perp^2, with B_perp the field perpendicular to
+    the film normal `normal`, plus Gaussian noise. Counts its evaluations.
+    """
+
+    def __init__(self, magnet, normal, f0=6e9, curvature=1e12, noise=5e3, seed=0):
+        self.magnet = magnet
+        self.normal = np.asarray(normal) / np.linalg.norm(normal)
+        self.f0 = f0
+        self.curvature = curvature
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.nevaluations = 0
+
+    def perpendicular_field(self):
+        field = self.magnet.field_at_sample
+        return np.linalg.norm(field - np.dot(field, self.normal) * self.normal)
+
+    def __call__(self):
+        self.nevaluations += 1
+        return self.f0 - self.curvature * self.perpendicular_field() ** 2 + self.noise * self.rng.standard_normal()
+
+
+def run(optimizer, tilt, r=0.3, seed=0, **kwargs):
+    magnet = SimulatedMagnet()
+    normal = [np.cos(np.radians(tilt)), np.sin(np.radians(tilt)), 0]
+    resonator = SimulatedResonator(magnet, normal, seed=seed)
+    magnet.x_target(r)
+    magnet.ramp()
+    magnet.nramps = 0
+
+    aligner = FieldAligner(magnet, resonator)
+    with contextlib.redirect_stdout(io.StringIO()):
+        getattr(aligner, optimizer)(axis="y", waiting_time=0, **kwargs)
+    return resonator.nevaluations, magnet.nramps, resonator.perpendicular_field()
+
+
+def run_2d(optimizer, tilt_y, tilt_z, r=0.3, seed=0, **kwargs):
+    """ Aligns a film tilted in two directions, alternating the axes y and z for the single-axis optimizers. """
+    magnet = SimulatedMagnet()
+    normal = [1, np.tan(np.radians(tilt_y)), np.tan(np.radians(tilt_z))]
+    resonator = SimulatedResonator(magnet, normal, seed=seed)
+    magnet.x_target(r)
+    magnet.ramp()
+    magnet.nramps = 0
+
+    aligner = FieldAligner(magnet, resonator)
+    aligner.theta, aligner.phi = 90, 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        if optimizer == "optimize_angles":
+            aligner.optimize_angles(waiting_time=0, **kwargs)
+        else:
+            for axis in ["y", "z", "y", "z"]:
+                getattr(aligner, optimizer)(axis=axis, waiting_time=0, **kwargs)
+    return resonator.nevaluations, magnet.nramps, resonator.perpendicular_field()
+
+
+class OffsetMagnet(SimulatedMagnet):
+    """ Simulated magnet with a constant stray field, such that the optimal direction changes with the magnitude. """
+
+    def __init__(self, offset, **kwargs):
+        super().__init__(**kwargs)
+        self.offset = np.asarray(offset)
+
+    @property
+    def field_at_sample(self):
+        return super().field_at_sample + self.offset
+
+
+def run_sweep(optimize_strategy, rs, offset=(0, 100e-6, 50e-6), **kwargs):
+    """
+    Ramps through the magnitudes rs along x, aligning the field with optimize_angles according to the strategy.
+    Returns the number of objective evaluations and ramps, and the mean perpendicular field left after every step.
+    """
+    magnet = OffsetMagnet(offset)
+    resonator = SimulatedResonator(magnet, [1, 0, 0])
+    aligner = FieldAligner(magnet, resonator)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, extra = aligner.optimize_and_ramp_r(rs, 90, 0, axis=None, optimize_first=True,
+                                               optimize_strategy=optimize_strategy, optimizer="paraboloid",
+                                               waiting_time=0, verbose=False, **kwargs)
+
+    # the history holds the angles before and after every step
+    thetas, phis = np.radians(np.array(extra["history"]["optima"][1::2])).T
+    fields = rs[:, None] * np.column_stack([np.sin(thetas) * np.cos(phis), np.sin(thetas) * np.sin(phis),
+                                            np.cos(thetas)]) + magnet.offset
+    perpendicular = np.linalg.norm(fields[:, 1:], axis=1)
+    return resonator.nevaluations, magnet.nramps, perpendicular.mean()
+
+
+def main(ntrials=20):
+    rng = np.random.default_rng(1)
+    tilts = rng.uniform(-0.1, 0.1, ntrials)  # degrees, i.e. up to about 0.5 mT perpendicular at 0.3 T
+
+    for optimizer in ["optimize_axis", "optimize_axis_parabola"]:
+        results = np.array([run(optimizer, tilt, seed=i) for i, tilt in enumerate(tilts)])
+        print(f"{optimizer:24s} evaluations {results[:, 0].mean():5.1f}, ramps {results[:, 1].mean():5.1f}, "
+              f"remaining B_perp {results[:, 2].mean() * 1e6:5.1f} uT (max {results[:, 2].max() * 1e6:5.1f} uT)")
+
+    print("two axes:")
+    tilts_z = rng.uniform(-0.1, 0.1, ntrials)
+    for optimizer in ["optimize_axis", "optimize_axis_parabola", "optimize_angles"]:
+        results = np.array([run_2d(optimizer, tilt_y, tilt_z, seed=i)
+                            for i, (tilt_y, tilt_z) in enumerate(zip(tilts, tilts_z))])
+        print(f"{optimizer:24s} evaluations {results[:, 0].mean():5.1f}, ramps {results[:, 1].mean():5.1f}, "
+              f"remaining B_perp {results[:, 2].mean() * 1e6:5.1f} uT (max {results[:, 2].max() * 1e6:5.1f} uT)")
+
+
+    print("magnitude sweep with a stray field:")
+    rs = np.linspace(0.1, 0.5, 41)
+    for strategy, kwargs in [("always", {}), ("predictive", {"prediction_tolerance": 0.01})]:
+        nevaluations, nramps, residual = run_sweep(strategy, rs, **kwargs)
+        print(f"{strategy:24s} evaluations {nevaluations:5d}, ramps {nramps:5d}, "
+              f"mean B_perp after every step {residual * 1e6:5.1f} uT")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the import time of the cqed modules.
+
+Every module is imported in a fresh interpreter with `python -X importtime`, such that nothing is cached.
+Reported are the total import time and the packages that take longest, to spot heavy imports that should be
+deferred to first use.
+
+Run with: python benchmarks/bench_imports.py [module ...]
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+MODULES = [
+    "cqed.custom_pysweep_functions.vna",
+    "cqed.custom_pysweep_functions.alazar",
+    "cqed.custom_pysweep_functions.magnet",
+    "cqed.utils.datahandling",
+    "cqed.utils.peak_finding",
+    "cqed.utils.field_aligner",
+    "cqed.utils.station_loader",
+    "cqed.analysis.resonator_analysis",
+]
+
+
+def import_times(module, repeats=3):
+    """
+    Imports module in fresh interpreters and returns the smallest total import time (s), and the time (s) per package
+    of that run, including the imports it causes. Raises an Exception with the error of the import if it fails.
+    """
+    best = None
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(REPO), os.environ.get("PYTHONPATH", "")]))
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, env=env, cwd=REPO)
+        lines = [line for line in result.stderr.splitlines() if line.startswith("import time:")]
+        if result.returncode != 0:
+            raise Exception([line for line in result.stderr.splitlines() if not line.startswith("import time:")][-1])
+
+        # the lines list every import after the imports it caused, indented by its depth. Time is attributed to
+        # a package at its outermost import that is not made by the same package.
+        packages, total, parents = {}, 0, []
+        for line in reversed(lines[1:]):
+            _, cumulative, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            package, cumulative = name.strip().split(".")[0], int(cumulative) * 1e-6
+            parents = parents[:depth]
+            if depth == 0:
+                total += cumulative
+            if package not in parents:
+                packages[package] = packages.get(package, 0) + cumulative
+            parents.append(package)
+        if best is None or total < best[0]:
+            best = (total, packages)
+    return best
+
+
+def main(modules):
+    for module in modules:
+        try:
+            total, packages = import_times(module)
+        except Exception as e:
+            print(f"{module:40s} failed: {e}")
+            continue
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:5]
+        print(f"{module:40s} {total:6.3f} s: " + ", ".join(f"{name} {time:.3f} s" for name, time in heaviest))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or MODULES)
@@ -0,0 +1,112 @@
+"""
+Benchmark of the peak finders on a synthetic map of resonator traces versus field.
+
+Run with: python benchmarks/bench_peak_finding.py
+"""
+
+import time
+import numpy as np
+from cqed.utils.peak_finding import (find_peak_filtered, find_peaks_filtered_batch, find_peak_literal,
+                                     FilteredPeakFinder, find_multiple_peaks_filtered)
+from cqed.utils.peak_linking import PeakLinker
+
+
+def synthetic_map(ntraces, npoints, f0=6e9, span=20e6, linewidth=1e6, depth=20, noise=1, seed=0):
+    """
+    Traces (in dB) of a resonance that moves across the frequency window with the trace index, with Gaussian noise.
+    Returns the frequencies, the traces and the true resonance frequencies.
+    """
+    rng = np.random.default_rng(seed)
+    fs = np.linspace(f0 - span / 2, f0 + span / 2, npoints)
+    fres = f0 + 0.3 * span * np.sin(np.linspace(0, 2 * np.pi, ntraces))
+    ys = depth / (1 + (2 * (fs - fres[:, None]) / linewidth) ** 2) + noise * rng.standard_normal((ntraces, npoints))
+    return fs, ys, fres
+
+
+def refinement_precision(npoints, refine, ntrials=500, linewidth=1e6, noise=0.01, seed=0):
+    """
+    Rms error of find_peak_literal on a linear Lorentzian peak sampled with npoints over 20 MHz.
+    """
+    rng = np.random.default_rng(seed)
+    fs = np.linspace(6e9 - 10e6, 6e9 + 10e6, npoints)
+    errors = []
+    for _ in range(ntrials):
+        f0 = 6e9 + rng.uniform(-3e6, 3e6)
+        ys = 0.1 + 1 / (1 + (2 * (fs - f0) / linewidth) ** 2) + noise * rng.standard_normal(npoints)
+        errors.append(find_peak_literal(fs, ys, refine=refine) - f0)
+    return np.sqrt(np.mean(np.square(errors)))
+
+
+def filter_plan(ntraces=2000, npoints=2001):
+    """
+    Time per trace of find_peak_filtered and of a FilteredPeakFinder planned once for the grid, as in a tracking loop.
+    """
+    fs, ys, _ = synthetic_map(ntraces, npoints)
+    peak_finder = FilteredPeakFinder(fs)
+
+    start = time.perf_counter()
+    direct = [find_peak_filtered(fs, y) for y in ys]
+    duration_direct = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planned = [peak_finder(fs, y) for y in ys]
+    duration_planned = time.perf_counter() - start
+
+    print(f"{npoints}-point traces: find_peak_filtered {duration_direct / ntraces * 1e6:.0f} us, "
+          f"FilteredPeakFinder {duration_planned / ntraces * 1e6:.0f} us per trace "
+          f"({duration_direct / duration_planned:.1f}x), identical results: {direct == planned}")
+
+
+def multiplexed_tracking(nsteps=60, npoints=4001, nresonances=8, seed=0):
+    """
+    Tracks the dips of nresonances resonators in one wide trace per step, two of which cross halfway.
+    Counts the wrongly labelled frequencies (more than 1 MHz off) when labelling by frequency order and with a PeakLinker.
+    """
+    rng = np.random.default_rng(seed)
+    fs = np.linspace(5.9e9, 6.1e9, npoints)
+    steps = np.linspace(0, 1, nsteps)[:, None]
+    fres = np.linspace(5.92e9, 6.08e9, nresonances) + steps * np.linspace(-5e6, 5e6, nresonances)
+    fres[:, 3:5] = fres[0, 3:5] + steps * np.array([30e6, -30e6])
+
+    linker = PeakLinker(nresonances=nresonances, max_shift=5e6)
+    wrong_sorted, wrong_linked = 0, 0
+    for fstep in fres:
+        ys = -np.sum(20 / (1 + (2 * (fs - fstep[:, None]) / 1e6) ** 2), axis=0) + rng.standard_normal(npoints)
+        found = find_multiple_peaks_filtered(fs, ys, npeaks=nresonances, dip=True)
+        linked = linker(found)
+        if len(found) == nresonances:
+            wrong_sorted += np.sum(np.abs(found - fstep) > 1e6)
+        wrong_linked += np.sum(~(np.abs(linked - fstep) <= 1e6))
+
+    print(f"{nresonances} resonators in {nsteps} wide traces, two crossing: wrongly labelled frequencies "
+          f"{wrong_sorted} by frequency order, {wrong_linked} with PeakLinker")
+
+
+def main(ntraces=10000, npoints=401):
+    fs, ys, fres = synthetic_map(ntraces, npoints)
+
+    start = time.perf_counter()
+    looped = np.array([np.nan if f is None else f for f in (find_peak_filtered(fs, y) for y in ys)])
+    duration_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = find_peaks_filtered_batch(fs, ys)
+    duration_batch = time.perf_counter() - start
+
+    print(f"{ntraces} traces of {npoints} points: loop {duration_loop:.3f} s, batch {duration_batch:.3f} s "
+          f"({duration_loop / duration_batch:.0f}x)")
+    print(f"identical results: {np.array_equal(looped, batched, equal_nan=True)}, "
+          f"rms error {np.sqrt(np.nanmean((batched - fres) ** 2)) / 1e3:.1f} kHz")
+
+    print("rms error of find_peak_literal for a 1 MHz wide resonance in a 20 MHz window:")
+    for npoints in [401, 81, 41]:
+        errors = [refinement_precision(npoints, refine) for refine in [None, "parabolic", "lorentzian"]]
+        print(f"{npoints:4d} points: no refinement {errors[0] / 1e3:6.1f} kHz, parabolic {errors[1] / 1e3:6.1f} kHz, "
+              f"lorentzian {errors[2] / 1e3:6.1f} kHz")
+
+    filter_plan()
+    multiplexed_tracking()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+End-to-end benchmarks of typical experiments on the simulated station (station_init/simulated.station.yaml).
+
+For every experiment the throughput in points per second is reported, with the wall time split into instrument I/O
+(calls to the simulated instruments, acquisitions and magnet ramps), storage (writing to the QCoDeS database)
+and the rest (compute in the measurement functions and analysis, and pysweep overhead).
+With --phases, the time per phase of the measurement functions (see cqed.utils.timing) is reported as well,
+and with --visa the commands sent per function (see cqed.utils.visa_profiler).
+The instruments take the latencies set in the station configuration, such that the I/O is representative.
+
+Run with: python benchmarks/bench_sweeps.py [--phases] [--visa]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+import qcodes as qc
+from qcodes.dataset.measurements import DataSaver, Measurement
+import pysweep
+import pysweep.databackends.qcodes
+import cqed.custom_pysweep_functions.vna as cvna
+import cqed.custom_pysweep_functions.alazar as calazar
+from cqed.custom_pysweep_functions.magnet import Magnet
+from cqed.utils.simulated_instruments import SimulatedInstrument, SimulatedAlazarController, SimulatedMercuryIPS
+from cqed.utils.peak_finding import find_peak_literal
+from cqed.utils.datahandling import db_to_xarray
+from cqed.analysis.resonator_analysis import fit_resonator
+from cqed.utils import timing
+from cqed.utils.visa_profiler import VisaProfiler
+
+STATION_CONFIG = Path(__file__).resolve().parents[1] / "station_init" / "simulated.station.yaml"
+
+
+class PhaseTimer:
+    """
+    Accumulates the time spent in wrapped methods per phase. Calls made from within a wrapped method
+    count for the phase of the outermost one only.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self._active = False
+        self._patches = []
+
+    def wrap(self, owner, attribute, phase):
+        original = getattr(owner, attribute)
+
+        def wrapper(*args, **kwargs):
+            if self._active:
+                return original(*args, **kwargs)
+            self._active = True
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.totals[phase] = self.totals.get(phase, 0) + time.perf_counter() - start
+                self._active = False
+
+        setattr(owner, attribute, wrapper)
+        self._patches.append((owner, attribute, original))
+
+    def restore(self):
+        for owner, attribute, original in reversed(self._patches):
+            setattr(owner, attribute, original)
+        self._patches = []
+
+
+def load_station():
+    station = qc.Station(config_file=str(STATION_CONFIG))
+    station.load_all_instruments()
+    pysweep.STATION = station
+    return station
+
+
+def run_sweep(station, name, measurement, *sweep_objects):
+    """ Runs a pysweep measurement into the database and returns its captured run id. """
+    experiment = qc.load_or_create_experiment(experiment_name=name, sample_name="simulated")
+    pysweep.sweep(lambda d: None, lambda d: None, measurement, *sweep_objects,
+                  databackend=pysweep.databackends.qcodes.DataBackend(Measurement(experiment, station)))
+    return experiment.last_data_set().captured_run_id
+
+
+def vna_power_sweep(station, npts=2001, powers=np.arange(-50, -15, 0.5)):
+    station.vna.S21.npts(npts)
+    run_id = run_sweep(station, "vna_power_sweep", cvna.measure_linear_sweep(center=6e9, span=20e6),
+                       pysweep.sweep_object(station.vna.S21.power, powers))
+    return len(powers), run_id
+
+
+def resonance_tracking(station, points=np.linspace(0, 2e-3, 41)):
+    """ Follows the resonance while the perpendicular field shifts it, with a coarse and a fine sweep per point. """
+    station.vna.S21.npts(401)
+    find_resonator = cvna.measure_resonance_frequency(lambda f, y: find_peak_literal(f, y, dip=True),
+                                                      suffix="_coarse", center=6e9, span=20e6)
+    measure_resonator = cvna.measure_adaptive_linear_sweep(suffix="_fine", span=4e6)
+    run_sweep(station, "resonance_tracking", find_resonator + measure_resonator,
+              Magnet(station.mgnt).sweep_z(points))
+    return len(points)
+
+
+def two_tone(station, powers=np.arange(-40, -20, 2), frequencies=np.linspace(4e9, 5e9, 101)):
+    station.vna.S21.npts(401)
+    find_resonator = cvna.measure_resonance_frequency(lambda f, y: find_peak_literal(f, y, dip=True),
+                                                      suffix="_res", center=6e9, span=20e6)
+    find_qubit = cvna.measure_qubit_frequency(frequencies, suffix="_qub", peak_finder=find_peak_literal,
+                                              bw=1e3, npts=10)
+    run_sweep(station, "two_tone", find_resonator + find_qubit,
+              pysweep.sweep_object(station.qubsrc.power, powers))
+    return len(powers)
+
+
+def time_rabi(station, frequencies=np.linspace(4.4e9, 4.6e9, 11), pulse_times=np.linspace(0, 200e-9, 41)):
+    station.alazar_ctl.record_response = lambda records: 1 - 0.5 * np.sin(np.pi * pulse_times / 100e-9) ** 2
+    measurement = calazar.measure_time_rabi(station.alazar_ctl, pulse_times, setup_awg=True, readout_time=2e-6,
+                                            navgs=500)
+    run_sweep(station, "time_rabi", measurement, pysweep.sweep_object(station.qubsrc.frequency, frequencies))
+    return len(frequencies)
+
+
+def T1(station, powers=np.arange(-30, -20, 1), delays=np.linspace(0, 50e-6, 51)):
+    station.alazar_ctl.record_response = lambda records: 1 - 0.5 * np.exp(-delays / 10e-6)
+    measurement = calazar.measure_T1(station.alazar_ctl, delays, pulse_time=50e-9, readout_time=2e-6, navgs=500)
+    run_sweep(station, "T1", measurement, pysweep.sweep_object(station.qubsrc.power, powers))
+    return len(powers)
+
+
+def magnet_angle_sweep(station, points=np.arange(0, 360, 10)):
+    """ Also checks that the field is read back from the magnet at most once per point (see FieldCache). """
+    station.vna.S21.npts(401)
+    magnet = Magnet(station.mgnt)
+    run_id = run_sweep(station, "magnet_angle_sweep",
+                       magnet.measure_magnet_components() + cvna.measure_linear_sweep()
+                       + magnet.measure_readback_count(),
+                       magnet.sweep_phi(r=3e-3, theta=90, points=points))
+    readbacks = db_to_xarray(run_id)["field_readbacks"].values
+    if np.nanmax(readbacks) > 1:
+        raise Exception(f"Up to {np.nanmax(readbacks):.0f} field readbacks per point, expected at most 1.")
+    return len(points)
+
+
+def analysis(run_id, fit_axis="vna_S21_power"):
+    dataset = db_to_xarray(run_id)
+    fit_resonator(dataset, fit_axis)
+    return dataset.sizes[fit_axis]
+
+
+def main(phases=False, visa=False):
+    if phases:
+        timing.enable()
+    with tempfile.TemporaryDirectory() as folder:
+        qc.initialise_or_create_database_at(str(Path(folder) / "bench_sweeps.db"))
+        station = load_station()
+
+        timer = PhaseTimer()
+        for method in ["write_raw", "ask_raw"]:
+            timer.wrap(SimulatedInstrument, method, "I/O")
+        timer.wrap(SimulatedAlazarController, "acquisition", "I/O")
+        timer.wrap(SimulatedMercuryIPS, "ramp", "I/O")
+        timer.wrap(DataSaver, "add_result", "storage")
+        timer.wrap(DataSaver, "flush_data_to_database", "storage")
+        profiler = VisaProfiler(station) if visa else None
+
+        run_ids = {}
+
+        def power_sweep():
+            npoints, run_ids["power_sweep"] = vna_power_sweep(station)
+            return npoints
+
+        experiments = [
+            ("VNA power sweep", power_sweep),
+            ("resonance tracking", lambda: resonance_tracking(station)),
+            ("two-tone", lambda: two_tone(station)),
+            ("time Rabi", lambda: time_rabi(station)),
+            ("T1", lambda: T1(station)),
+            ("magnet angle sweep", lambda: magnet_angle_sweep(station)),
+            ("db_to_xarray + fit_resonator", lambda: analysis(run_ids["power_sweep"])),
+        ]
+
+        try:
+            for name, experiment in experiments:
+                timer.totals = {}
+                timing.timings.reset()
+                if visa:
+                    profiler.reset()
+                start = time.perf_counter()
+                npoints = experiment()
+                wall = time.perf_counter() - start
+                io, storage = timer.totals.get("I/O", 0), timer.totals.get("storage", 0)
+                print(f"{name:30s} {npoints:4d} points in {wall:6.2f} s ({npoints / wall:6.1f} points/s): "
+                      f"I/O {io:6.2f} s, storage {storage:6.2f} s, compute and other {wall - io - storage:6.2f} s")
+                if phases and timing.timings.durations:
+                    print(timing.timings.report() + "\n")
+                if visa and profiler.commands:
+                    print(profiler.report() + "\n")
+        finally:
+            timer.restore()
+            if visa:
+                profiler.detach()
+            qc.Instrument.close_all()
+            timing.disable()
+
+
+if __name__ == '__main__':
+    main(phases="--phases" in sys.argv[1:], visa="--visa" in sys.argv[1:])
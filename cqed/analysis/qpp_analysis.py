@@ -0,0 +1,179 @@
+"""
+Analysis of quasiparticle poisoning (QPP) time traces that can be done on the fly, chunk by chunk,
+such that only compact results (histogram, switching rates, SNR) have to be stored instead of the full traces.
+
+The IQ points are described by a mixture of two Gaussians with equal width, one per parity state.
+The traces are projected on the axis connecting the two Gaussians, and the switching rate is obtained
+from the averaged power spectral density of the projected signal, which for a random telegraph signal
+is a Lorentzian with a corner frequency set by the sum of the two switching rates.
+"""
+
+import numpy as np
+from scipy.optimize import curve_fit
+from scipy.special import expit
+
+
+def fit_two_gaussians(z, means=None, n_iter=100, tol=1e-4):
+    """
+    Fits a mixture of two 2D Gaussians with equal widths to complex IQ points using
+    expectation maximization.
+
+    z (array, complex): IQ points
+    means (array, complex): initial guess for the two means, e.g. from a previous fit.
+        If None, the points are split at the median of their principal axis.
+    n_iter (int): maximum number of iterations
+    tol (float): the fit stops when the means move less than tol times the width
+
+    returns:
+    dict with the complex 'means', the width 'sigma' and the 'weights' of the two Gaussians
+    """
+    z = np.ravel(z)
+
+    if means is None:
+        _, eigvecs = np.linalg.eigh(np.cov(z.real, z.imag))
+        axis = eigvecs[0, 1] + 1j * eigvecs[1, 1]
+        projection = np.real((z - z.mean()) * np.conj(axis))
+        upper = projection > np.median(projection)
+        means = np.array([z[~upper].mean(), z[upper].mean()])
+    means = np.array(means, dtype=complex)
+
+    weight = 0.5
+    sigma2 = np.var(z) / 2
+    for _ in range(n_iter):
+        d0 = np.abs(z - means[0]) ** 2
+        d1 = np.abs(z - means[1]) ** 2
+        # responsibility of the second Gaussian
+        r1 = expit(np.log(weight / (1 - weight)) + (d0 - d1) / (2 * sigma2))
+        r0 = 1 - r1
+
+        weight = np.clip(r1.mean(), 1e-9, 1 - 1e-9)
+        new_means = np.array([np.sum(r0 * z) / np.sum(r0), np.sum(r1 * z) / np.sum(r1)])
+        sigma2 = np.sum(r0 * d0 + r1 * d1) / (2 * z.size)
+
+        converged = np.max(np.abs(new_means - means)) < tol * np.sqrt(sigma2)
+        means = new_means
+        if converged:
+            break
+
+    return {'means': means, 'sigma': np.sqrt(sigma2), 'weights': np.array([1 - weight, weight])}
+
+
+def _lorentzian(f, amplitude, rate, offset):
+    return amplitude / (1 + (2 * np.pi * f / rate) ** 2) + offset
+
+
+class QPPAnalyzer:
+    """
+    Accumulates the statistics of QPP traces chunk by chunk. Call `update` with every chunk of traces
+    as it is acquired, and `result` at the end.
+
+    The projection axis and the histogram bins are fixed by the first chunk; the Gaussian mixture is
+    refined with every chunk, starting from the previous fit. Like the histogram and the PSD, the weights
+    of the Gaussians are accumulated over all chunks, weighted by their number of points.
+
+    args:
+    dt (s): time between two points of a trace
+    nbins (int): number of bins of the histogram of the projected signal
+    nperseg (int): length of the segments the traces are cut into for the PSD. Determines the
+        frequency resolution; by default a whole trace is one segment.
+    max_fit_points (int): maximum number of IQ points of a chunk used for the Gaussian mixture fit
+    """
+
+    def __init__(self, dt, nbins=101, nperseg=None, max_fit_points=100000):
+        self.dt = dt
+        self.nbins = nbins
+        self.nperseg = nperseg
+        self.max_fit_points = max_fit_points
+
+        self.gaussians = None
+        self.center = None
+        self.axis = None
+        self.bin_edges = None
+        self.counts = np.zeros(nbins)
+        self.psd = None
+        self.nsegments = 0
+        self.segment_length = None  # number of points of the segments of the PSD
+        self.npoints = 0
+        self._weighted_sum = np.zeros(2)  # sum of the weights of every chunk times its number of points
+
+    def update(self, traces):
+        """
+        Adds a chunk of traces (traces x points, complex) to the statistics.
+        """
+        traces = np.atleast_2d(traces)
+
+        fit_points = traces.ravel()
+        if fit_points.size > self.max_fit_points:
+            fit_points = fit_points[::int(np.ceil(fit_points.size / self.max_fit_points))]
+        means = None if self.gaussians is None else self.gaussians['means']
+        self.gaussians = fit_two_gaussians(fit_points, means=means)
+        self._weighted_sum += self.gaussians['weights'] * traces.size
+        self.npoints += traces.size
+
+        if self.axis is None:
+            means = self.gaussians['means']
+            self.center = means.mean()
+            self.axis = (means[1] - means[0]) / np.abs(means[1] - means[0])
+
+        projected = np.real((traces - self.center) * np.conj(self.axis))
+
+        if self.bin_edges is None:
+            low, high = np.percentile(projected, [0.1, 99.9])
+            margin = 0.25 * (high - low)
+            self.bin_edges = np.linspace(low - margin, high + margin, self.nbins + 1)
+        self.counts += np.histogram(np.clip(projected, self.bin_edges[0], self.bin_edges[-1]),
+                                    bins=self.bin_edges)[0]
+
+        nperseg = projected.shape[1] if self.nperseg is None else self.nperseg
+        self.segment_length = nperseg
+        nsegments = projected.shape[1] // nperseg
+        segments = projected[:, :nsegments * nperseg].reshape(-1, nperseg)
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        psd = np.mean(np.abs(np.fft.rfft(segments, axis=1)) ** 2, axis=0) * 2 * self.dt / nperseg
+
+        if self.psd is None:
+            self.psd = psd
+        else:
+            self.psd = (self.psd * self.nsegments + psd * len(segments)) / (self.nsegments + len(segments))
+        self.nsegments += len(segments)
+
+    @property
+    def frequencies(self):
+        return np.fft.rfftfreq(self.segment_length, d=self.dt)
+
+    def result(self):
+        """
+        Returns a dict with the histogram ('bin_centers', 'counts'), the PSD ('frequencies', 'psd'), the
+        Gaussian mixture ('means', 'sigma', and the 'weights' averaged over all chunks), the 'snr' (separation
+        of the Gaussians over twice their width), the total 'switching_rate' and the rates 'rate_01' and
+        'rate_10' out of either state.
+        Rates are NaN if the Lorentzian fit of the PSD fails.
+        """
+        freqs, psd = self.frequencies[1:], self.psd[1:]
+
+        offset_guess = np.median(psd[-max(1, psd.size // 10):])
+        above_half = np.nonzero(psd - offset_guess > (psd[0] - offset_guess) / 2)[0]
+        corner_guess = freqs[above_half[-1]] if above_half.size else freqs[psd.size // 2]
+        try:
+            popt, _ = curve_fit(_lorentzian, freqs, psd,
+                                p0=[psd[0] - offset_guess, 2 * np.pi * corner_guess, offset_guess])
+            switching_rate = np.abs(popt[1])
+        except (RuntimeError, ValueError):
+            switching_rate = np.nan
+
+        means, sigma = self.gaussians['means'], self.gaussians['sigma']
+        weights = self._weighted_sum / self.npoints
+        # for a random telegraph signal, the occupation of a state is the rate into it over the total rate
+        return {
+            'bin_centers': (self.bin_edges[1:] + self.bin_edges[:-1]) / 2,
+            'counts': self.counts,
+            'frequencies': self.frequencies,
+            'psd': self.psd,
+            'means': means,
+            'sigma': sigma,
+            'weights': weights,
+            'snr': np.abs(means[1] - means[0]) / (2 * sigma),
+            'switching_rate': switching_rate,
+            'rate_01': switching_rate * weights[1],
+            'rate_10': switching_rate * weights[0],
+        }
@@ -1,7 +1,4 @@
-from xarray import DataArray, merge
-from resonator_tools.circuit import notch_port
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 def fit_resonator(array, fit_axis, plot_fit=False):
@@ -17,6 +14,11 @@ def fit_resonator(array, fit_axis, plot_fit=False):
     @return: xarray consisting of the raw input data plus the complex data, the complex data produced by the fit,
         and all fit parameters with fit_axis as coordinate.
     """
+    # xarray, resonator_tools and matplotlib take long to import, and are only imported when fitting
+    from xarray import DataArray, merge
+    from resonator_tools.circuit import notch_port
+    if plot_fit:
+        import matplotlib.pyplot as plt
 
     _z = array.amplitude.values * np.exp(1j * array.phase.values)
     z = DataArray(_z, name='complex', coords={fit_axis: getattr(array, fit_axis), 'frequency': array.frequency},
@@ -0,0 +1,102 @@
+"""
+Discrimination of qubit states from single-shot IQ points.
+
+The classifier is a linear discriminant trained on calibration shots of the ground and excited state.
+Classification is vectorized and done in chunks, such that millions of shots can be classified with
+bounded memory.
+"""
+
+import numpy as np
+
+
+class LinearDiscriminator:
+    """
+    Linear discriminant for single-shot IQ points. A shot z = I + iQ is classified as excited if
+    w_I * I + w_Q * Q > threshold, with the weights given by the inverse of the pooled covariance of the
+    calibration shots times the difference of their means (Fisher's linear discriminant).
+
+    args:
+    chunk_size (int): maximum number of shots classified at once
+    """
+
+    def __init__(self, chunk_size=2**20):
+        self.chunk_size = chunk_size
+        self.weight = None
+        self.threshold = None
+        self.error_ge = None
+        self.error_eg = None
+
+    def fit(self, shots_g, shots_e):
+        """
+        Trains the discriminator on calibration shots.
+
+        shots_g (array, complex): shots with the qubit prepared in the ground state
+        shots_e (array, complex): shots with the qubit prepared in the excited state
+
+        returns:
+        the assignment fidelity on the calibration shots
+        """
+        shots_g, shots_e = np.ravel(shots_g), np.ravel(shots_e)
+
+        cov = (np.cov(shots_g.real, shots_g.imag) + np.cov(shots_e.real, shots_e.imag)) / 2
+        mean_g, mean_e = shots_g.mean(), shots_e.mean()
+        w = np.linalg.solve(cov, [mean_e.real - mean_g.real, mean_e.imag - mean_g.imag])
+        self.weight = w[0] + 1j * w[1]
+        self.threshold = self._project((mean_g + mean_e) / 2)
+
+        # P(e|g) and P(g|e)
+        self.error_ge = self.excited_fraction(shots_g)
+        self.error_eg = 1 - self.excited_fraction(shots_e)
+
+        return self.assignment_fidelity
+
+    @property
+    def assignment_fidelity(self):
+        """
+        1 - (P(e|g) + P(g|e)) / 2 on the calibration shots.
+        """
+        return 1 - (self.error_ge + self.error_eg) / 2
+
+    def _project(self, shots):
+        return shots.real * self.weight.real + shots.imag * self.weight.imag
+
+    def predict(self, shots):
+        """
+        Classifies shots; returns a boolean array of the same shape that is True for the excited state.
+        """
+        shots = np.asarray(shots)
+        flat = shots.ravel()
+        excited = np.empty(flat.shape, dtype=bool)
+        for start in range(0, flat.size, self.chunk_size):
+            stop = start + self.chunk_size
+            np.greater(self._project(flat[start:stop]), self.threshold, out=excited[start:stop])
+        return excited.reshape(shots.shape)
+
+    def excited_fraction(self, shots):
+        """
+        Fraction of all shots that is classified as excited.
+        """
+        return np.mean(self.excited_population(np.ravel(shots)[:, None]))
+
+    def excited_population(self, shots, correct=False):
+        """
+        Excited state population per record.
+
+        shots (array, complex): shots x records array of IQ points, e.g. one record per Rabi pulse time
+        correct (boolean): correct the populations for the readout errors of the calibration
+
+        returns:
+        array with the excited state population of every record
+        """
+        shots = np.asarray(shots)
+        shots = shots.reshape(shots.shape[0], -1)
+        rows = max(1, self.chunk_size // shots.shape[1])
+
+        counts = np.zeros(shots.shape[1])
+        for start in range(0, shots.shape[0], rows):
+            counts += np.count_nonzero(self._project(shots[start:start + rows]) > self.threshold, axis=0)
+        population = counts / shots.shape[0]
+
+        if correct:
+            population = (population - self.error_ge) / (1 - self.error_ge - self.error_eg)
+        return population
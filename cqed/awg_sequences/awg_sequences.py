@@ -19,7 +19,10 @@ class RabiSequence(BroadBeanSequence):
     """
     name = 'rabi_sequence'
 
-    def sequence(self, pulse_times=None, amplitudes=None, pulse_time=20e-9, amplitude=0.5, readout_time=2.6e-9, cycle_time=10e-6,
+    def sequence(self, **kwargs):
+        return bbtools.elements2sequence(self.elements(**kwargs), self.name)
+
+    def elements(self, pulse_times=None, amplitudes=None, pulse_time=20e-9, amplitude=0.5, readout_time=2.6e-9, cycle_time=10e-6,
                  pre_pulse_time=1e-6, after_pulse_time=0.02e-6,
                  alazar_trigger_time=100e-9, marker_buffer=20e-9, cavity_lifetime=0.3e-6):
         ii = 0
@@ -57,7 +60,7 @@ class RabiSequence(BroadBeanSequence):
 
             elements.append(bbtools.blueprints2element(bps))
 
-        return bbtools.elements2sequence(elements, self.name)
+        return elements
 
 
 class RamseySequence(BroadBeanSequence):
@@ -72,7 +75,10 @@ class RamseySequence(BroadBeanSequence):
     """
     name = 'ramsey_sequence'
 
-    def sequence(self, delays, pulse_time, readout_time, amplitude=0.5, cycle_time=10e-6,
+    def sequence(self, **kwargs):
+        return bbtools.elements2sequence(self.elements(**kwargs), self.name)
+
+    def elements(self, delays, pulse_time, readout_time, amplitude=0.5, cycle_time=10e-6,
                  pre_pulse_time=1e-6, after_pulse_time=0.02e-6,
                  alazar_trigger_time=100e-9, marker_buffer=20e-9, cavity_lifetime=0.3e-6):
 
@@ -101,7 +107,7 @@ class RamseySequence(BroadBeanSequence):
 
             elements.append(bbtools.blueprints2element(bps))
 
-        return bbtools.elements2sequence(elements, self.name)
+        return elements
 
 
 class T1Sequence(BroadBeanSequence):
@@ -116,7 +122,10 @@ class T1Sequence(BroadBeanSequence):
     """
     name = 'T1_sequence'
 
-    def sequence(self, delays, pulse_time, readout_time, amplitude=0.5, cycle_time=10e-6,
+    def sequence(self, **kwargs):
+        return bbtools.elements2sequence(self.elements(**kwargs), self.name)
+
+    def elements(self, delays, pulse_time, readout_time, amplitude=0.5, cycle_time=10e-6,
                  pre_pulse_time=1e-6, after_pulse_time=0.02e-6,
                  alazar_trigger_time=100e-9, marker_buffer=20e-9, cavity_lifetime=0.3e-6):
 
@@ -142,7 +151,7 @@ class T1Sequence(BroadBeanSequence):
 
             elements.append(bbtools.blueprints2element(bps))
 
-        return bbtools.elements2sequence(elements, self.name)
+        return elements
 
 
 class EchoSequence(BroadBeanSequence):
@@ -157,7 +166,10 @@ class EchoSequence(BroadBeanSequence):
     """
     name = 'echo_sequence'
 
-    def sequence(self, delays, pulse_time, readout_time, amplitude=0.5, cycle_time=10e-6,
+    def sequence(self, **kwargs):
+        return bbtools.elements2sequence(self.elements(**kwargs), self.name)
+
+    def elements(self, delays, pulse_time, readout_time, amplitude=0.5, cycle_time=10e-6,
                  pre_pulse_time=1e-6, after_pulse_time=0.02e-6,
                  alazar_trigger_time=100e-9, marker_buffer=20e-9, cavity_lifetime=0.3e-6):
 
@@ -191,6 +203,29 @@ class EchoSequence(BroadBeanSequence):
 
             elements.append(bbtools.blueprints2element(bps))
 
+        return elements
+
+
+class InterleavedSequence(BroadBeanSequence):
+    """
+    A sequence that concatenates the elements of several of the sequences above
+    (e.g. Rabi, Ramsey, T1 and echo), such that they can all be played after a single
+    upload and acquired with a single Alazar acquisition.
+
+    required channels:
+        the channels required by each of the interleaved sequences
+    """
+    name = 'interleaved_sequence'
+
+    def sequence(self, experiments):
+        """
+        experiments (list): list of (sequence class, kwargs) tuples. The elements of every
+        sequence class are generated with its kwargs and appended in the given order.
+        """
+        elements = []
+        for sequence_class, kwargs in experiments:
+            elements += sequence_class.elements(self, **kwargs)
+
         return bbtools.elements2sequence(elements, self.name)
 
 
@@ -5,20 +5,120 @@ A set of functions to conveniently use for Alazar measurements with pysweep.
 from pysweep.core.measurementfunctions import MakeMeasurementFunction, MeasurementFunction
 from pysweep.databackends.base import DataParameter
 import numpy as np
-from pytopo.rf.alazar.softsweep import setup_triggered_softsweep
-from pytopo.rf.alazar.awg_sequences import TriggerSequence
-import cqed.awg_sequences
+import importlib
 import qcodes
-from cqed.awg_sequences.awg_sequences import RabiSequence, RamseySequence, T1Sequence, EchoSequence, QPTriggerSequence
 import time
-from pathlib import Path
-import lmfit
+import weakref
+from warnings import warn
 import cqed.utils.data_processing as dp
-from scipy.signal import savgol_filter
+from cqed.utils.trace_storage import TraceWriter, data_folder, trace_path
+from cqed.utils import timing
+
+# pytopo, broadbean (through the AWG sequences), lmfit and the analysis modules take long to import, and are imported
+# by the functions that use them. They remain available as attributes of this module through __getattr__.
+_LAZY_IMPORTS = {
+    "setup_triggered_softsweep": "pytopo.rf.alazar.softsweep",
+    "TriggerSequence": "pytopo.rf.alazar.awg_sequences",
+    "RabiSequence": "cqed.awg_sequences.awg_sequences",
+    "RamseySequence": "cqed.awg_sequences.awg_sequences",
+    "T1Sequence": "cqed.awg_sequences.awg_sequences",
+    "EchoSequence": "cqed.awg_sequences.awg_sequences",
+    "QPTriggerSequence": "cqed.awg_sequences.awg_sequences",
+    "InterleavedSequence": "cqed.awg_sequences.awg_sequences",
+    "QPPAnalyzer": "cqed.analysis.qpp_analysis",
+    "LinearDiscriminator": "cqed.analysis.state_discrimination",
+    "savgol_filter": "scipy.signal",
+}
+
+
+def __getattr__(name):
+    if name == "lmfit":
+        return importlib.import_module("lmfit")
+    if name in _LAZY_IMPORTS:
+        return getattr(importlib.import_module(_LAZY_IMPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# fingerprint of the last acquisition configuration and number of setups, per controller
+_controller_setups = weakref.WeakKeyDictionary()
+
+
+@timing.timed("setup")
+def setup_controller(controller, average_buffers=False, average_buffers_postdemod=True, force=False,
+                     verbose=False, **kwargs):
+    """Configures the Alazar controller for an acquisition, unless the last configuration of this controller
+    was identical. In that case reconfiguring and reallocating the buffers is skipped, which saves a lot of time
+    when a setup_* function is called at every point of a sweep.
 
+    Args:
+        controller (QCoDeS instrument): alazar controller for handling acquisition
+        average_buffers (boolean): value for controller.average_buffers
+        average_buffers_postdemod (boolean): value for controller.average_buffers_postdemod
+        force (boolean): reconfigure even if the configuration did not change
+        verbose (boolean): passed on to controller.setup_acquisition
+        kwargs: passed on to controller.setup_acquisition (samples, records, buffers, acq_time, ...)
+
+    Returns:
+    True if the controller was (re)configured, False if the previous configuration was reused.
+    """
+    try:
+        demod_frq = controller.demod_frq()
+    except AttributeError:
+        demod_frq = None
+    # board settings that the setup_* functions change outside of setup_acquisition, e.g. the sample rate in setup_QPP
+    alazar = _alazar_of(controller)
+    sample_rate = alazar.sample_rate() if alazar is not None else None
+    fingerprint = (average_buffers, average_buffers_postdemod, demod_frq, sample_rate,
+                   tuple(sorted(kwargs.items())))
+
+    fingerprint_old, count = _controller_setups.get(controller, (None, 0))
+    if not force and fingerprint == fingerprint_old:
+        return False
+
+    controller.verbose = True
+    controller.average_buffers(average_buffers)
+    controller.average_buffers_postdemod(average_buffers_postdemod)
+    controller.setup_acquisition(verbose=verbose, **kwargs)
+    _controller_setups[controller] = (fingerprint, count + 1)
+    return True
+
+
+def _alazar_of(controller):
+    """Returns the Alazar board of the controller, or None if it can not be found."""
+    name = getattr(controller, "alazar_name", None)
+    if name is not None and qcodes.Instrument.exist(name):
+        return qcodes.Instrument.find_instrument(name)
+    station = qcodes.Station.default
+    if station is not None and "alazar" in station.components:
+        return station.components["alazar"]
+    return None
 
+
+def _acquire(controller):
+    """Returns the data of an acquisition of the controller, timed as the 'acquisition' phase.
+    """
+    with timing.phase("acquisition"):
+        return controller.acquisition()
+
+
+def reset_controller_fingerprint(controller):
+    """Forgets the last acquisition configuration of the controller, such that the next call to
+    setup_controller reconfigures it. Needed whenever the controller is set up by other means.
+    """
+    fingerprint_old, count = _controller_setups.get(controller, (None, 0))
+    _controller_setups[controller] = (None, count)
+
+
+def get_controller_setup_count(controller):
+    """Returns how many times the controller has actually been configured by setup_controller.
+    Convenient for checking that a sweep configures the controller once rather than at every point.
+    """
+    return _controller_setups.get(controller, (None, 0))[1]
+
+
+@timing.timed("setup")
 def setup_time_rabi(controller, pulse_times, readout_time,
-                    navgs=500, acq_time=2.56e-6):
+                    navgs=500, acq_time=2.56e-6, single_shot=False):
     """Function that sets up a Tektronix AWG5014C sequence as well as the Alazar controller for 
     performing a time Rabi measurement.
 
@@ -28,21 +128,20 @@ def setup_time_rabi(controller, pulse_times, readout_time,
         readout_time (s): time during which the readout tone will be on
         navgs (int): number of times each rabi sequence is performed and then averaged
         acq_time (s): I have forgotted what that is
+        single_shot (boolean): if True, the buffers are not averaged such that every shot is returned
 
     """
 
     station = qcodes.Station.default
 
     # setting up the AWG
+    from cqed.awg_sequences.awg_sequences import RabiSequence
     seq = RabiSequence(station.awg, SR=1e9)
     seq.wait = 'all'
     seq.setup_awg(pulse_times=pulse_times, readout_time=readout_time,
                   cycle_time=20e-6, start_awg=True)
-    controller.verbose = True
-    controller.average_buffers(False)
-    controller.average_buffers_postdemod(True)
-    controller.setup_acquisition(
-        samples=None, records=pulse_times.size, buffers=navgs, acq_time=acq_time, verbose=False)
+    setup_controller(controller, average_buffers_postdemod=not single_shot,
+                     samples=None, records=pulse_times.size, buffers=navgs, acq_time=acq_time)
 
 
 def measure_time_rabi(controller, pulse_times, setup_awg=False, qubsrc_power=None, qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None, suffix='', fit=False, T1_guess=None, **kw):
@@ -86,7 +185,7 @@ def measure_time_rabi(controller, pulse_times, setup_awg=False, qubsrc_power=Non
         station.awg.stop()
         station.awg.start()
 
-        data = np.squeeze(controller.acquisition())[..., 0]
+        data = np.squeeze(_acquire(controller))[..., 0]
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
         station.fg.ch1.state('OFF')
@@ -101,6 +200,8 @@ def measure_time_rabi(controller, pulse_times, setup_awg=False, qubsrc_power=Non
         time.sleep(0.1)
 
         if fit:
+            import lmfit
+            from scipy.signal import savgol_filter
 
             angle = dp.IQangle(mag*np.exp(1.j*phase))
             rotated_data = dp.IQrotate(mag*np.exp(1.j*phase), angle)
@@ -133,7 +234,8 @@ def measure_time_rabi(controller, pulse_times, setup_awg=False, qubsrc_power=Non
             params['t1'].set(max=50e-6)
             params['period'].set(min=1e-9)
             params['period'].set(max=5e-6)
-            out = mod.fit(ydat, params, x=xdat)
+            with timing.phase("analysis"):
+                out = mod.fit(ydat, params, x=xdat)
             pipulse_time = 1*out.params['period'].value/2
             if pipulse_time < 10e-9:
                 pipulse_time = 3*out.params['period'].value/2
@@ -187,6 +289,7 @@ def measure_time_rabi(controller, pulse_times, setup_awg=False, qubsrc_power=Non
         ])
 
 
+@timing.timed("setup")
 def setup_ramsey(controller, delays, pulse_time, readout_time,
                  navgs=500, acq_time=2.56e-6, setup_awg=True):
     """
@@ -197,16 +300,13 @@ def setup_ramsey(controller, delays, pulse_time, readout_time,
 
     # setting up the AWG
     if setup_awg:
+        from cqed.awg_sequences.awg_sequences import RamseySequence
         seq = RamseySequence(station.awg, SR=1e9)
         seq.wait = 'all'
         seq.setup_awg(delays=delays, pulse_time=pulse_time,
                       readout_time=readout_time, cycle_time=20e-6, start_awg=True)
 
-    controller.verbose = True
-    controller.average_buffers(False)
-    controller.average_buffers_postdemod(True)
-    controller.setup_acquisition(
-        samples=None, records=delays.size, buffers=navgs, acq_time=acq_time, verbose=False)
+    setup_controller(controller, samples=None, records=delays.size, buffers=navgs, acq_time=acq_time)
 
 
 def measure_ramsey(controller, delays, pulse_time, readout_time, qubsrc_power=None, qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None,
@@ -253,7 +353,7 @@ def measure_ramsey(controller, delays, pulse_time, readout_time, qubsrc_power=No
         station.awg.stop()
         station.awg.start()
 
-        data = np.squeeze(controller.acquisition())[..., 0]
+        data = np.squeeze(_acquire(controller))[..., 0]
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
         station.fg.ch1.state('OFF')
@@ -271,6 +371,8 @@ def measure_ramsey(controller, delays, pulse_time, readout_time, qubsrc_power=No
         # but without them the timing goes wrong
 
         if fit:
+            import lmfit
+            from scipy.signal import savgol_filter
             # rotate IQ data
             angle = dp.IQangle(mag*np.exp(1.j*phase))
             rotated_data = dp.IQrotate(mag*np.exp(1.j*phase), angle)
@@ -286,7 +388,8 @@ def measure_ramsey(controller, delays, pulse_time, readout_time, qubsrc_power=No
             params = mod.make_params(off=np.mean(
                 ydat), amp=ydat[0], t1=0.15e-6, period=period_estimate, phase=0)
             params['t1'].set(min=1e-9)
-            out = mod.fit(ydat, params, x=xdat)
+            with timing.phase("analysis"):
+                out = mod.fit(ydat, params, x=xdat)
             T2_time = out.params['t1'].value
 
             return [times, mag, phase, T2_time]
@@ -336,15 +439,19 @@ def measure_ramsey(controller, delays, pulse_time, readout_time, qubsrc_power=No
         ])
 
 
-def setup_T1(controller, delays, pulse_time, readout_time, navgs=500, acq_time=2.56e-6, setup_awg=True):
+@timing.timed("setup")
+def setup_T1(controller, delays, pulse_time, readout_time, navgs=500, acq_time=2.56e-6, setup_awg=True,
+             single_shot=False):
     """
     Set up ...
+    If single_shot is True, the buffers are not averaged such that every shot is returned.
     """
 
     station = qcodes.Station.default
 
     # setting up the AWG
     if setup_awg:
+        from cqed.awg_sequences.awg_sequences import T1Sequence
         seq = T1Sequence(station.awg, SR=1e9)
         seq.wait = 'all'
         # if
@@ -353,11 +460,8 @@ def setup_T1(controller, delays, pulse_time, readout_time, navgs=500, acq_time=2
         seq.setup_awg(delays=delays, pulse_time=pulse_time,
                       readout_time=readout_time, cycle_time=20e-6, start_awg=True)
 
-    controller.verbose = True
-    controller.average_buffers(False)
-    controller.average_buffers_postdemod(True)
-    controller.setup_acquisition(
-        samples=None, records=delays.size, buffers=navgs, acq_time=acq_time, verbose=False)
+    setup_controller(controller, average_buffers_postdemod=not single_shot,
+                     samples=None, records=delays.size, buffers=navgs, acq_time=acq_time)
 
 
 def measure_T1(controller, delays, pulse_time, readout_time, qubsrc_power=None, qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None,
@@ -403,7 +507,7 @@ def measure_T1(controller, delays, pulse_time, readout_time, qubsrc_power=None,
         station.awg.stop()
         station.awg.start()
 
-        data = np.squeeze(controller.acquisition())[..., 0]
+        data = np.squeeze(_acquire(controller))[..., 0]
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
         station.fg.ch1.state('OFF')
@@ -421,6 +525,7 @@ def measure_T1(controller, delays, pulse_time, readout_time, qubsrc_power=None,
         # but without them the timing goes wrong
 
         if fit:
+            import lmfit
             # rotate IQ data
             angle = dp.IQangle(mag*np.exp(1.j*phase))
             rotated_data = dp.IQrotate(mag*np.exp(1.j*phase), angle)
@@ -442,7 +547,8 @@ def measure_T1(controller, delays, pulse_time, readout_time, qubsrc_power=None,
                 off=ydat[-1], amp=ydat[0]-ydat[-1], t1=T1_estimate)
             params['t1'].set(min=1e-9)
             params['t1'].set(max=40e-6)
-            out = mod.fit(ydat, params, x=xdat)
+            with timing.phase("analysis"):
+                out = mod.fit(ydat, params, x=xdat)
             T1_time = out.params['t1']
             d["t1"] = T1_time
 
@@ -493,6 +599,7 @@ def measure_T1(controller, delays, pulse_time, readout_time, qubsrc_power=None,
         ])
 
 
+@timing.timed("setup")
 def setup_echo(controller, delays, pulse_time, readout_time,
                navgs=500, acq_time=2.56e-6, setup_awg=True):
     """
@@ -503,16 +610,13 @@ def setup_echo(controller, delays, pulse_time, readout_time,
 
     # setting up the AWG
     if setup_awg:
+        from cqed.awg_sequences.awg_sequences import EchoSequence
         seq = EchoSequence(station.awg, SR=1e9)
         seq.wait = 'all'
         seq.setup_awg(delays=delays, pulse_time=pulse_time,
                       readout_time=readout_time, cycle_time=20e-6, start_awg=True)
 
-    controller.verbose = True
-    controller.average_buffers(False)
-    controller.average_buffers_postdemod(True)
-    controller.setup_acquisition(
-        samples=None, records=delays.size, buffers=navgs, acq_time=acq_time, verbose=False)
+    setup_controller(controller, samples=None, records=delays.size, buffers=navgs, acq_time=acq_time)
 
 
 def measure_echo(controller, delays, pulse_time, readout_time, qubsrc_power=None, qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None,
@@ -558,7 +662,7 @@ def measure_echo(controller, delays, pulse_time, readout_time, qubsrc_power=None
         station.awg.stop()
         station.awg.start()
 
-        data = np.squeeze(controller.acquisition())[..., 0]
+        data = np.squeeze(_acquire(controller))[..., 0]
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
         station.fg.ch1.state('OFF')
@@ -576,6 +680,7 @@ def measure_echo(controller, delays, pulse_time, readout_time, qubsrc_power=None
         # but without them the timing goes wrong
 
         if fit:
+            import lmfit
             # rotate IQ data
             angle = dp.IQangle(mag*np.exp(1.j*phase))
             rotated_data = dp.IQrotate(mag*np.exp(1.j*phase), angle)
@@ -587,7 +692,8 @@ def measure_echo(controller, delays, pulse_time, readout_time, qubsrc_power=None
             params = mod.make_params(
                 off=ydat[-1], amp=ydat[0]-ydat[-1], t1=1e-6)
             params['t1'].set(min=1e-9)
-            out = mod.fit(ydat, params, x=xdat)
+            with timing.phase("analysis"):
+                out = mod.fit(ydat, params, x=xdat)
             T2_time = out.params['t1']
 
             return [times, mag, phase, T2_time]
@@ -637,6 +743,192 @@ def measure_echo(controller, delays, pulse_time, readout_time, qubsrc_power=None
         ])
 
 
+# experiment kind: (sequence class in cqed.awg_sequences.awg_sequences, list of the sequence arguments that can be
+# swept with the name and unit of their DataParameter)
+INTERLEAVED_EXPERIMENTS = {
+    'rabi': ('RabiSequence', [('pulse_times', 'pulse_time', 's'), ('amplitudes', 'pulse_amplitude', 'V')]),
+    'ramsey': ('RamseySequence', [('delays', 'delay_time', 's')]),
+    'T1': ('T1Sequence', [('delays', 'delay_time', 's')]),
+    'echo': ('EchoSequence', [('delays', 'delay_time', 's')]),
+}
+
+
+def _interleaved_sweep(kind, kwargs):
+    """Returns the swept argument of an interleaved experiment, with the name and unit of its DataParameter."""
+    if kind not in INTERLEAVED_EXPERIMENTS:
+        raise ValueError("Unknown experiment '{}', choose from {}.".format(kind, list(INTERLEAVED_EXPERIMENTS)))
+    for argument, name, unit in INTERLEAVED_EXPERIMENTS[kind][1]:
+        if kwargs.get(argument) is not None:
+            return argument, name, unit
+    raise ValueError("Experiment '{}' needs one of the swept arguments {}.".format(
+        kind, [argument for argument, _, _ in INTERLEAVED_EXPERIMENTS[kind][1]]))
+
+
+def _resolve_interleaved_experiments(experiments, d=None):
+    """Replaces a pulse_time of 'dict' by the pi pulse stored in the dictionary, following the
+    conventions of measure_T1 (pi pulse) and measure_ramsey/measure_echo (pi/2 pulse).
+    """
+    resolved = []
+    for kind, kwargs in experiments:
+        if kind not in INTERLEAVED_EXPERIMENTS:
+            raise ValueError("Unknown experiment '{}', choose from {}.".format(
+                kind, list(INTERLEAVED_EXPERIMENTS)))
+        kwargs = dict(kwargs)
+        if kwargs.get('pulse_time') == 'dict':
+            if kind in ['ramsey', 'echo']:
+                kwargs['pulse_time'] = d['pipulse']/2
+            else:
+                kwargs['pulse_time'] = d['pipulse']
+        resolved.append((kind, kwargs))
+    return resolved
+
+
+@timing.timed("setup")
+def setup_interleaved(controller, experiments, readout_time,
+                      navgs=500, acq_time=2.56e-6, setup_awg=True):
+    """Function that sets up a single Tektronix AWG5014C sequence containing several time-domain
+    experiments back to back, as well as the Alazar controller for acquiring all of them in a
+    single acquisition.
+
+    Args:
+        controller (QCoDeS instrument): alazar controller for handling acquisition
+        experiments (list): list of (kind, kwargs) tuples, with kind one of 'rabi', 'ramsey', 'T1' or 'echo'
+            and kwargs the arguments of the corresponding sequence,
+            e.g. [('T1', dict(delays=delays, pulse_time=40e-9)), ('echo', dict(delays=delays, pulse_time=20e-9))].
+            Ramsey, T1 and echo sweep delays, rabi sweeps pulse_times or amplitudes. The kwargs override the
+            defaults readout_time=readout_time and cycle_time=20e-6.
+        readout_time (s): time during which the readout tone will be on
+        navgs (int): number of times the full sequence is performed and then averaged
+        acq_time (s): acquisition time per record
+        setup_awg (boolean): whether to upload the sequence to the AWG
+
+    """
+
+    station = qcodes.Station.default
+
+    # setting up the AWG
+    if setup_awg:
+        from cqed.awg_sequences import awg_sequences
+        seq = awg_sequences.InterleavedSequence(station.awg, SR=1e9)
+        seq.wait = 'all'
+        seq.setup_awg(experiments=[(getattr(awg_sequences, INTERLEAVED_EXPERIMENTS[kind][0]),
+                                    dict(dict(readout_time=readout_time, cycle_time=20e-6), **kwargs))
+                                   for kind, kwargs in experiments],
+                      start_awg=True)
+
+    records = sum([np.size(kwargs[_interleaved_sweep(kind, kwargs)[0]]) for kind, kwargs in experiments])
+
+    setup_controller(controller, samples=None, records=records, buffers=navgs, acq_time=acq_time)
+
+
+def measure_interleaved(controller, experiments, readout_time, qubsrc_power=None, qubsrc_freq=None, hetsrc_power=None,
+                        hetsrc_freq=None, navgs=500, acq_time=2.56e-6, setup_awg=True, suffix=''):
+    """Pysweep measurement function that measures several time-domain experiments (for example T1,
+    Ramsey and echo) using a single AWG sequence and a single Alazar acquisition per point.
+    The demodulated records are split back into separate DataParameters per experiment, named after the
+    experiment kind, e.g. delay_time_T1, amplitude_T1 and phase_T1, or pulse_amplitude_rabi (V) for a rabi
+    experiment that sweeps amplitudes. Fitting is not done here;
+    the data can be fitted afterwards.
+
+    Args:
+        experiments (list): see `setup_interleaved`. A pulse_time of 'dict' uses d['pipulse'] like in
+            measure_T1 (and d['pipulse']/2 for ramsey and echo), and forces the AWG to be set up.
+        suffix (str): suffix added to the DataParameters.
+        Other args are the same as for measure_T1.
+
+    Returns:
+    Pysweep measurement function
+    """
+
+    kinds = [kind for kind, _ in experiments]
+    if len(set(kinds)) != len(kinds):
+        raise ValueError("Every experiment kind can only be interleaved once.")
+    from_dict = any([kwargs.get('pulse_time') == 'dict' for _, kwargs in experiments])
+
+    def return_alazar_trace(d):
+        station = d["STATION"]
+        resolved = _resolve_interleaved_experiments(experiments, d)
+        setup_interleaved(controller, resolved, readout_time, navgs=navgs, acq_time=acq_time,
+                          setup_awg=setup_awg or from_dict)
+
+        if qubsrc_power is not None:
+            station.qubsrc.power(qubsrc_power)
+        if hetsrc_power is not None:
+            station.hetsrc.RF.power(hetsrc_power)
+
+        if qubsrc_freq == 'dict':
+            station.qubsrc.frequency(d["fq"])
+        elif qubsrc_freq == None:
+            pass
+        else:
+            station.qubsrc.frequency(qubsrc_freq)
+
+        if hetsrc_freq == 'dict':
+            station.hetsrc.frequency(d["f0"])
+        elif hetsrc_freq == None:
+            pass
+        else:
+            station.hetsrc.frequency(hetsrc_freq)
+
+        station.qubsrc.modulation_rf('ON')
+        station.qubsrc.output_rf('ON')
+        station.RF.on()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('ON')
+        station.RF.ref_LO_out('LO')
+        station.LO.on()
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.awg.start()
+
+        data = np.squeeze(_acquire(controller))[..., 0]
+        mag, phase = np.abs(data), np.angle(data, deg=False)
+
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.qubsrc.modulation_rf('OFF')
+        station.qubsrc.output_rf('OFF')
+        station.RF.off()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('OFF')
+        station.RF.ref_LO_out('OFF')
+        station.LO.off()
+        time.sleep(0.1)
+
+        sweep_vals = [np.asarray(kwargs[_interleaved_sweep(kind, kwargs)[0]]) for kind, kwargs in resolved]
+        split_at = np.cumsum([vals.size for vals in sweep_vals])[:-1]
+
+        results = []
+        for vals, mag_part, phase_part in zip(sweep_vals, np.split(mag, split_at), np.split(phase, split_at)):
+            results += [vals, mag_part, phase_part]
+        return results
+
+    dataparameters = []
+    for kind, kwargs in experiments:
+        _, name, unit = _interleaved_sweep(kind, kwargs)
+        name = name + '_' + kind + str(suffix)
+        dataparameters += [
+            DataParameter(name=name,
+                          unit=unit,
+                          paramtype="array",
+                          independent=2,
+                          ),
+            DataParameter(name="amplitude_" + kind + str(suffix),
+                          unit="",
+                          paramtype="array",
+                          extra_dependencies=[name],
+                          ),
+            DataParameter(name="phase_" + kind + str(suffix),
+                          unit="rad",
+                          paramtype="array",
+                          extra_dependencies=[name],
+                          ),
+        ]
+
+    return MeasurementFunction(return_alazar_trace, dataparameters)
+
+
+@timing.timed("setup")
 def setup_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True):
     """
     Set up ...
@@ -646,20 +938,377 @@ def setup_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True):
 
     # setting up the AWG
     if setup_awg:
+        from cqed.awg_sequences.awg_sequences import QPTriggerSequence
         seq = QPTriggerSequence(station.awg, SR=1e7)
         seq.load_sequence(cycle_time=acq_time+1e-3, plot=False,
                           use_event_seq=True, ncycles=navg)
 
-    controller.verbose = True
-    controller.average_buffers(False)
-    controller.average_buffers_postdemod(False)
     station.alazar.sample_rate(int(SR))
     npoints = int(acq_time*SR // 128 * 128)
-    controller.setup_acquisition(npoints, 1, navg)
+    setup_controller(controller, average_buffers_postdemod=False, samples=npoints, records=1, buffers=navg)
     print(controller, navg, acq_time, controller.demod_frq(), npoints)
 
 
-def measure_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True, hetsrc_power=None, hetsrc_freq=None, **kw):
+@timing.timed("setup")
+def setup_readout_calibration(controller, pipulse_time, readout_time, amplitude=0.5, nshots=5000, acq_time=2.56e-6):
+    """Function that sets up a Tektronix AWG5014C sequence as well as the Alazar controller for
+    measuring single shots with the qubit prepared in the ground state (no pulse) and in the excited state (pi pulse).
+
+    Args:
+        controller (QCoDeS instrument): alazar controller for handling acquisition
+        pipulse_time (s): length of the pi pulse
+        readout_time (s): time during which the readout tone will be on
+        amplitude: amplitude of the pi pulse
+        nshots (int): number of shots per state
+        acq_time (s): acquisition time per record
+    """
+
+    station = qcodes.Station.default
+
+    from cqed.awg_sequences.awg_sequences import RabiSequence
+    seq = RabiSequence(station.awg, SR=1e9)
+    seq.wait = 'all'
+    seq.setup_awg(amplitudes=np.array([0, amplitude]), pulse_time=pipulse_time, readout_time=readout_time,
+                  cycle_time=20e-6, start_awg=True)
+    setup_controller(controller, average_buffers_postdemod=False,
+                     samples=None, records=2, buffers=nshots, acq_time=acq_time)
+
+
+def _acquire_single_shots(controller, records):
+    """Returns the single shots of the last acquisition as a shots x records array. Every shot is the average of the
+    demodulated time points of its record, which is a single point when the controller is set up with acq_time.
+    """
+    data = np.asarray(_acquire(controller))[..., 0]  # buffers x records x time points
+    return np.reshape(data, (-1, records, data.shape[-1])).mean(axis=-1)
+
+
+def measure_readout_calibration(controller, pipulse_time, readout_time, amplitude=0.5, nshots=5000, acq_time=2.56e-6,
+                                qubsrc_power=None, qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None,
+                                chunk_size=2**20, suffix=''):
+    """Pysweep measurement function that trains a linear discriminant on single shots of the ground and excited
+    state and stores it as d['discriminator'], for use by the single-shot measurement functions.
+
+    Args:
+        pipulse_time (s): length of the pi pulse. If 'dict', d['pipulse'] is used.
+        chunk_size (int): maximum number of shots classified at once
+        suffix (str): suffix added to the DataParameters.
+        Other args: see `setup_readout_calibration` and `measure_T1`.
+
+    Returns:
+    Pysweep measurement function
+    """
+
+    def return_calibration(d):
+        station = d["STATION"]
+        if pipulse_time == 'dict':
+            setup_readout_calibration(controller, d['pipulse'], readout_time, amplitude=amplitude, nshots=nshots,
+                                      acq_time=acq_time)
+        else:
+            setup_readout_calibration(controller, pipulse_time, readout_time, amplitude=amplitude, nshots=nshots,
+                                      acq_time=acq_time)
+
+        if qubsrc_power is not None:
+            station.qubsrc.power(qubsrc_power)
+        if hetsrc_power is not None:
+            station.hetsrc.RF.power(hetsrc_power)
+
+        if qubsrc_freq == 'dict':
+            station.qubsrc.frequency(d["fq"])
+        elif qubsrc_freq == None:
+            pass
+        else:
+            station.qubsrc.frequency(qubsrc_freq)
+
+        if hetsrc_freq == 'dict':
+            station.hetsrc.frequency(d["f0"])
+        elif hetsrc_freq == None:
+            pass
+        else:
+            station.hetsrc.frequency(hetsrc_freq)
+
+        station.qubsrc.modulation_rf('ON')
+        station.qubsrc.output_rf('ON')
+        station.RF.on()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('ON')
+        station.RF.ref_LO_out('LO')
+        station.LO.on()
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.awg.start()
+
+        shots = _acquire_single_shots(controller, 2)
+
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.qubsrc.modulation_rf('OFF')
+        station.qubsrc.output_rf('OFF')
+        station.RF.off()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('OFF')
+        station.RF.ref_LO_out('OFF')
+        station.LO.off()
+        time.sleep(0.1)
+
+        from cqed.analysis.state_discrimination import LinearDiscriminator
+        discriminator = LinearDiscriminator(chunk_size=chunk_size)
+        with timing.phase("analysis"):
+            fidelity = discriminator.fit(shots[:, 0], shots[:, 1])
+        d['discriminator'] = discriminator
+
+        return [fidelity, discriminator.error_ge, discriminator.error_eg]
+
+    return MeasurementFunction(return_calibration, [
+        DataParameter(name="assignment_fidelity" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+        DataParameter(name="P_e_given_g" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+        DataParameter(name="P_g_given_e" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+    ])
+
+
+def measure_time_rabi_single_shot(controller, pulse_times, discriminator='dict', setup_awg=True, qubsrc_power=None,
+                                  qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None, correct=False, suffix='', **kw):
+    """Pysweep measurement function for a time Rabi measurement in single-shot mode: instead of averaging the
+    demodulated buffers, every shot is classified with a discriminator and the excited state population per
+    pulse time is returned, together with the assignment fidelity of the discriminator.
+
+    Args:
+        discriminator: a trained cqed.analysis.state_discrimination.LinearDiscriminator. If 'dict',
+            d['discriminator'] as stored by `measure_readout_calibration` is used.
+        correct (boolean): correct the populations for readout errors
+        kw: see `setup_time_rabi`, with navgs the number of shots per pulse time.
+        Other args: see `measure_time_rabi`.
+
+    Returns:
+    Pysweep measurement function
+    """
+
+    def return_populations(d):
+        if setup_awg:
+            setup_time_rabi(controller=controller,
+                            pulse_times=pulse_times, single_shot=True, **kw)
+
+        station = d["STATION"]
+
+        if qubsrc_power is not None:
+            station.qubsrc.power(qubsrc_power)
+        if hetsrc_power is not None:
+            station.hetsrc.RF.power(hetsrc_power)
+
+        if qubsrc_freq == 'dict':
+            station.qubsrc.frequency(d["fq"])
+        elif qubsrc_freq == None:
+            pass
+        else:
+            station.qubsrc.frequency(qubsrc_freq)
+
+        if hetsrc_freq == 'dict':
+            station.hetsrc.frequency(d["f0"])
+        elif hetsrc_freq == None:
+            pass
+        else:
+            station.hetsrc.frequency(hetsrc_freq)
+
+        station.qubsrc.modulation_rf('ON')
+        station.qubsrc.output_rf('ON')
+        station.RF.on()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('ON')
+        station.RF.ref_LO_out('LO')
+        station.LO.on()
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.awg.start()
+
+        shots = _acquire_single_shots(controller, pulse_times.size)
+
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.qubsrc.modulation_rf('OFF')
+        station.qubsrc.output_rf('OFF')
+        station.RF.off()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('OFF')
+        station.RF.ref_LO_out('OFF')
+        station.LO.off()
+        time.sleep(0.1)
+
+        disc = d['discriminator'] if discriminator == 'dict' else discriminator
+        return [pulse_times, disc.excited_population(shots, correct=correct), disc.assignment_fidelity]
+
+    return MeasurementFunction(return_populations, [
+        DataParameter(name="pulse_time" + str(suffix),
+                      unit="s",
+                      paramtype="array",
+                      independent=2,
+                      ),
+        DataParameter(name="excited_population" + str(suffix),
+                      unit="",
+                      paramtype="array",
+                      extra_dependencies=["pulse_time" + str(suffix)],
+                      ),
+        DataParameter(name="assignment_fidelity" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+    ])
+
+
+def measure_T1_single_shot(controller, delays, pulse_time, readout_time, discriminator='dict', qubsrc_power=None,
+                           qubsrc_freq=None, hetsrc_power=None, hetsrc_freq=None, navgs=500, acq_time=2.56e-6,
+                           setup_awg=True, correct=False, suffix='', **kw):
+    """Pysweep measurement function for a T1 measurement in single-shot mode: instead of averaging the
+    demodulated buffers, every shot is classified with a discriminator and the excited state population per
+    delay is returned, together with the assignment fidelity of the discriminator.
+
+    Args:
+        discriminator: a trained cqed.analysis.state_discrimination.LinearDiscriminator. If 'dict',
+            d['discriminator'] as stored by `measure_readout_calibration` is used.
+        navgs (int): number of shots per delay
+        correct (boolean): correct the populations for readout errors
+        Other args: see `measure_T1`.
+
+    Returns:
+    Pysweep measurement function
+    """
+
+    def return_populations(d):
+        station = d["STATION"]
+        if pulse_time == 'dict':
+            setup_T1(controller, delays, d['pipulse'], readout_time, navgs=navgs, acq_time=acq_time,
+                     setup_awg=True, single_shot=True, **kw)
+        else:
+            setup_T1(controller, delays, pulse_time, readout_time, navgs=navgs, acq_time=acq_time,
+                     setup_awg=setup_awg, single_shot=True, **kw)
+
+        if qubsrc_power is not None:
+            station.qubsrc.power(qubsrc_power)
+        if hetsrc_power is not None:
+            station.hetsrc.RF.power(hetsrc_power)
+
+        if qubsrc_freq == 'dict':
+            station.qubsrc.frequency(d["fq"])
+        elif qubsrc_freq == None:
+            pass
+        else:
+            station.qubsrc.frequency(qubsrc_freq)
+
+        if hetsrc_freq == 'dict':
+            station.hetsrc.frequency(d["f0"])
+        elif hetsrc_freq == None:
+            pass
+        else:
+            station.hetsrc.frequency(hetsrc_freq)
+
+        station.qubsrc.modulation_rf('ON')
+        station.qubsrc.output_rf('ON')
+        station.RF.on()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('ON')
+        station.RF.ref_LO_out('LO')
+        station.LO.on()
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.awg.start()
+
+        shots = _acquire_single_shots(controller, delays.size)
+
+        station.fg.ch1.state('OFF')
+        station.awg.stop()
+        station.qubsrc.modulation_rf('OFF')
+        station.qubsrc.output_rf('OFF')
+        station.RF.off()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('OFF')
+        station.RF.ref_LO_out('OFF')
+        station.LO.off()
+        time.sleep(0.1)
+
+        disc = d['discriminator'] if discriminator == 'dict' else discriminator
+        return [delays, disc.excited_population(shots, correct=correct), disc.assignment_fidelity]
+
+    return MeasurementFunction(return_populations, [
+        DataParameter(name="delay_time" + str(suffix),
+                      unit="s",
+                      paramtype="array",
+                      independent=2,
+                      ),
+        DataParameter(name="excited_population" + str(suffix),
+                      unit="",
+                      paramtype="array",
+                      extra_dependencies=["delay_time" + str(suffix)],
+                      ),
+        DataParameter(name="assignment_fidelity" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+    ])
+
+
+# largest memory (bytes) held by one chunk of QPP traces by default
+QPP_CHUNK_BYTES = 2 ** 30
+# memory per sample of a chunk: the raw int16 data of both channels (4 bytes) and their demodulated
+# complex128 data (32 bytes), which is kept as a whole while the first channel is written
+_QPP_BYTES_PER_SAMPLE = 2 * 2 + 2 * 16
+
+
+def _QPP_chunks(navg, acq_time, SR, buffers_per_chunk):
+    """Returns the number of traces per chunk and the number of chunks of a QPP measurement. By default a chunk holds
+    as many traces as fit in QPP_CHUNK_BYTES of memory. Warns if navg is rounded up to a multiple of the chunk size.
+    """
+    if buffers_per_chunk is None:
+        trace_bytes = int(acq_time * SR) * _QPP_BYTES_PER_SAMPLE
+        buffers_per_chunk = int(min(navg, max(1, QPP_CHUNK_BYTES // trace_bytes)))
+    nchunks = int(np.ceil(navg / buffers_per_chunk))
+    if nchunks * buffers_per_chunk != navg:
+        warn(f"navg={navg} is rounded up to {nchunks * buffers_per_chunk} traces, "
+             f"a multiple of buffers_per_chunk={buffers_per_chunk}.")
+    return buffers_per_chunk, nchunks
+
+
+def _acquire_QPP_chunks(controller, station, nchunks):
+    """Generator that acquires nchunks chunks of QPP traces, restarting the trigger sequence for every chunk.
+    """
+    for ii in range(nchunks):
+        if ii > 0:
+            station.awg.stop()
+            station.awg.start()
+        station.alazar.clear_buffers()
+        yield np.squeeze(_acquire(controller))[..., 0]
+
+
+def measure_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True, hetsrc_power=None, hetsrc_freq=None,
+                buffers_per_chunk=None, **kw):
+    """Pysweep measurement function that measures navg demodulated time traces of length acq_time,
+    used for QPP measurements. The traces are not stored in the dataset but streamed to a memory-mappable
+    file next to the database, see cqed.utils.trace_storage; the dataset only contains its timestamp.
+    Acquiring in chunks keeps the memory usage bounded and lets writing to disk overlap with acquisition,
+    such that the total acquisition can be larger than the available memory. The trigger sequence is restarted
+    for every chunk, which adds a gap (of the order of the AWG restart time, tens of ms) between the last trace of a
+    chunk and the first trace of the next one, on top of the 1 ms between consecutive traces.
+    Use cqed.utils.trace_storage.load_traces(run_id, timestamp) to open the traces for analysis.
+
+    Args:
+        controller (QCoDeS instrument): alazar controller for handling acquisition
+        acq_time (s): length of a single trace
+        navg (int): number of traces; rounded up to a multiple of buffers_per_chunk, with a warning
+        SR (Hz): sample rate of the alazar
+        buffers_per_chunk (int): number of traces acquired at once. By default as many as fit in QPP_CHUNK_BYTES
+            (1 GiB) of memory, and at most navg.
+        kw: see `setup_QPP`
+
+    Returns:
+    Pysweep measurement function
+    """
+    buffers_per_chunk, nchunks = _QPP_chunks(navg, acq_time, SR, buffers_per_chunk)
 
     @MakeMeasurementFunction(
         [
@@ -668,11 +1317,13 @@ def measure_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True, hetsrc_pow
     )
     def return_alazar_trace(d):
 
-        setup_QPP(controller, acq_time, navg, SR=SR, setup_awg=setup_awg, **kw)
+        setup_QPP(controller, acq_time, buffers_per_chunk, SR=SR, setup_awg=setup_awg, **kw)
 
         station = d["STATION"]
 
-        station = d["STATION"]
+        timestamp = int(time.time()*1e6)
+        datasaver_run_id = d["DATASAVER"].datasaver._dataset.run_id
+        path = trace_path(data_folder(), datasaver_run_id, timestamp)
 
         station.awg.start()
 
@@ -694,9 +1345,11 @@ def measure_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True, hetsrc_pow
         station.RF.ref_LO_out('LO')
         station.LO.on()
 
-        station.alazar.clear_buffers()
-        data = np.squeeze(controller.acquisition())[..., 0]
-        time.sleep(0.1)
+        with TraceWriter(path, nchunks * buffers_per_chunk, len(controller.demod_tvals),
+                         tvals=controller.demod_tvals) as writer:
+            for chunk in _acquire_QPP_chunks(controller, station, nchunks):
+                writer.append(chunk)
+            time.sleep(0.1)
 
         station.awg.stop()
         station.qubsrc.output_rf('OFF')
@@ -704,17 +1357,108 @@ def measure_QPP(controller, acq_time, navg, SR=250e6, setup_awg=True, hetsrc_pow
         station.RF.ref_LO_out('OFF')
         station.LO.off()
 
-        timestamp = int(time.time()*1e6)
-        datasaver_run_id = d["DATASAVER"].datasaver._dataset.run_id
-        data_folder_path = str(qcodes.config.core.db_location)[:-3]+"\\"
-        Path(data_folder_path).mkdir(parents=True, exist_ok=True)
-        np.save(data_folder_path+"ID_" +
-                f"{datasaver_run_id}_IQ_{timestamp:d}", [controller.demod_tvals, data])
-
         return [timestamp]
     return return_alazar_trace
 
 
+def measure_QPP_online(controller, acq_time, navg, SR=250e6, setup_awg=True, hetsrc_power=None, hetsrc_freq=None,
+                       buffers_per_chunk=None, nbins=101, nperseg=None, suffix='', **kw):
+    """Pysweep measurement function that measures QPP time traces like measure_QPP, but analyses them on the fly
+    instead of storing them. Every chunk of traces updates a two-Gaussian fit of the IQ points, a histogram of the
+    signal projected on the axis connecting the two Gaussians, and the PSD of that signal, from which the switching
+    rate is obtained. Only these compact results are stored, see cqed.analysis.qpp_analysis.QPPAnalyzer.
+
+    Args:
+        buffers_per_chunk (int): number of traces acquired and analysed at once.
+            By default as many as fit in QPP_CHUNK_BYTES (1 GiB) of memory, and at most navg.
+        nbins (int): number of bins of the histogram
+        nperseg (int): number of points of the segments used for the PSD, by default a full trace
+        suffix (str): suffix added to the DataParameters.
+        Other args: see `measure_QPP`
+
+    Returns:
+    Pysweep measurement function
+    """
+    buffers_per_chunk, nchunks = _QPP_chunks(navg, acq_time, SR, buffers_per_chunk)
+
+    def return_alazar_analysis(d):
+
+        setup_QPP(controller, acq_time, buffers_per_chunk, SR=SR, setup_awg=setup_awg, **kw)
+
+        station = d["STATION"]
+
+        station.awg.start()
+
+        if hetsrc_power is not None:
+            station.hetsrc.RF.power(hetsrc_power)
+
+        if hetsrc_freq == 'dict':
+            station.hetsrc.frequency(d["f0"])
+        elif hetsrc_freq == None:
+            pass
+        else:
+            station.hetsrc.frequency(hetsrc_freq)
+
+        station.qubsrc.modulation_rf('OFF')
+        station.qubsrc.output_rf('ON')
+        station.RF.on()
+        station.RF.pulsemod_source('EXT')
+        station.RF.pulsemod_state('OFF')
+        station.RF.ref_LO_out('LO')
+        station.LO.on()
+
+        tvals = controller.demod_tvals
+        from cqed.analysis.qpp_analysis import QPPAnalyzer
+        analyzer = QPPAnalyzer(tvals[1] - tvals[0], nbins=nbins, nperseg=nperseg)
+        for chunk in _acquire_QPP_chunks(controller, station, nchunks):
+            analyzer.update(chunk)
+        time.sleep(0.1)
+
+        station.awg.stop()
+        station.qubsrc.output_rf('OFF')
+        station.RF.off()
+        station.RF.ref_LO_out('OFF')
+        station.LO.off()
+
+        result = analyzer.result()
+        return [result['bin_centers'], result['counts'], result['snr'], result['switching_rate'],
+                result['rate_01'], result['rate_10'], result['weights'][1]]
+
+    return MeasurementFunction(return_alazar_analysis, [
+        DataParameter(name="projected_signal" + str(suffix),
+                      unit="",
+                      paramtype="array",
+                      independent=2,
+                      ),
+        DataParameter(name="counts" + str(suffix),
+                      unit="",
+                      paramtype="array",
+                      extra_dependencies=["projected_signal" + str(suffix)],
+                      ),
+        DataParameter(name="SNR" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+        DataParameter(name="switching_rate" + str(suffix),
+                      unit="Hz",
+                      paramtype="numeric",
+                      ),
+        DataParameter(name="rate_01" + str(suffix),
+                      unit="Hz",
+                      paramtype="numeric",
+                      ),
+        DataParameter(name="rate_10" + str(suffix),
+                      unit="Hz",
+                      paramtype="numeric",
+                      ),
+        DataParameter(name="occupation_1" + str(suffix),
+                      unit="",
+                      paramtype="numeric",
+                      ),
+    ])
+
+
+@timing.timed("setup")
 def setup_single_averaged_IQpoint(controller, time_bin, integration_time, setup_awg=True,
                                   post_integration_delay=10e-6,
                                   verbose=True, allocated_buffers=None):
@@ -733,6 +1477,7 @@ def setup_single_averaged_IQpoint(controller, time_bin, integration_time, setup_
     navgs = int(integration_time / time_bin)
 
     if setup_awg:
+        from pytopo.rf.alazar.awg_sequences import TriggerSequence
         trig_seq = TriggerSequence(station.awg, SR=1e7)
         trig_seq.wait = 'off'
         trig_seq.setup_awg(
@@ -740,11 +1485,10 @@ def setup_single_averaged_IQpoint(controller, time_bin, integration_time, setup_
 
     ctl = controller
     ctl.buffers_per_block(None)
-    ctl.average_buffers(None)
-    ctl.average_buffers_postdemod(True)
 
-    ctl.setup_acquisition(samples=int((time_bin-post_integration_delay) * alazar.sample_rate() // 128 * 128),
-                          records=1, buffers=navgs, allocated_buffers=allocated_buffers, verbose=verbose)
+    setup_controller(ctl, average_buffers=None, average_buffers_postdemod=True,
+                     samples=int((time_bin-post_integration_delay) * alazar.sample_rate() // 128 * 128),
+                     records=1, buffers=navgs, allocated_buffers=allocated_buffers, verbose=verbose)
 
 
 def measure_single_averaged_IQpoint(controller, time_bin, integration_time, channel=0, **kw):
@@ -764,7 +1508,7 @@ def measure_single_averaged_IQpoint(controller, time_bin, integration_time, chan
         #                           verbose=True, allocated_buffers=None)
 
         station = d["STATION"]
-        data = controller.acquisition()
+        data = _acquire(controller)
         data = np.squeeze(data)[..., 0].mean()
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
@@ -786,12 +1530,14 @@ def measure_soft_time_avg_spec(controller, sweep_param, sweep_vals, integration_
         ]
     )
     def return_alazar_trace(d):
+        reset_controller_fingerprint(controller)
+        from pytopo.rf.alazar.softsweep import setup_triggered_softsweep
         setup_triggered_softsweep(controller, sweep_param, sweep_vals, integration_time,
                                   setup_awg=True, verbose=True, **kw)
         station = d["STATION"]
         freqs = sweep_vals
 
-        data = np.squeeze(controller.acquisition())[..., channel]
+        data = np.squeeze(_acquire(controller))[..., channel]
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
         return [freqs, mag, phase]
@@ -818,11 +1564,13 @@ def measure_soft_time_avg_spec_optimized(controller, sweep_param, sweep_vals, in
             d["f0"] = hetsrc_freq
 
         hetsrc.frequency(d["f0"])
+        reset_controller_fingerprint(controller)
+        from pytopo.rf.alazar.softsweep import setup_triggered_softsweep
         setup_triggered_softsweep(controller, sweep_param, sweep_vals, integration_time,
                                   setup_awg=True, verbose=True, **kw)
         freqs = sweep_vals
 
-        data = np.squeeze(controller.acquisition())[..., channel]
+        data = np.squeeze(_acquire(controller))[..., channel]
         mag, phase = np.abs(data), np.angle(data, deg=False)
 
         return [freqs, mag, phase]
@@ -4,7 +4,11 @@ from pysweep.core.measurementfunctions import MakeMeasurementFunction
 from pysweep.core.sweepobject import SweepObject
 from pysweep.databackends.base import DataParameter
 import numpy as np
+from time import sleep, monotonic
 from warnings import showwarning
+from cqed.utils.field_path_planner import spherical_to_cartesian
+from cqed.utils.field_cache import FieldCache
+from cqed.utils import timing
 
 
 def field_limit(Bx, By, Bz, max_field_strength=1.5) -> bool:
@@ -35,10 +39,76 @@ class Magnet:
     """ A class containing a set of functions to conveniently use for magnet sweeping with pysweep.
     Code assumes that the magnet instrument provided has a similar get/set_field structure as the Oxford Mercury IPS.
     To also include the AMI sources we might have to get a little creative. 
+
+    ramp_mode (str): mode passed to instrument.ramp by the sweep objects. 'safe' ramps the axes one by one,
+    'simul_block' ramps them simultaneously, which is up to three times faster for field rotations.
+    planner (FieldPathPlanner): if given, the sweep objects use it to estimate their ramp time and,
+    with optimize_order=True, to order their points for the shortest total ramp time.
+    The estimate of a single pass is available as the attribute expected_ramp_time (s) of the sweep object.
+    field_max_age (s): the measurement functions read the field once per ramp and share it through a FieldCache,
+    which the ramps of the sweep objects invalidate. The cached field is also read again when it is older than this,
+    such that ramps done outside of this class (e.g. on the front panel) are noticed. None keeps it until the next
+    ramp. If the instrument has its own field_cache (as the CustomMagnet), that one is used instead, and the
+    instrument invalidates it on its ramps.
     """
 
-    def __init__(self, instrument):
+    def __init__(self, instrument, ramp_mode="safe", planner=None, field_max_age=1.0):
         self.magnet = instrument
+        self.ramp_mode = ramp_mode
+        self.planner = planner
+        self.field_cache = getattr(instrument, "field_cache", None)
+        self._own_field_cache = self.field_cache is None
+        if self._own_field_cache:
+            self.field_cache = FieldCache(self._read_field, max_age=field_max_age)
+
+    def _plan(self, points, xyz, optimize_order):
+        """ Reorder the points with the planner if requested, and estimate the ramp time of a single
+        pass through them starting from the present field.
+        Returns the points, their fields and the estimate (None without planner).
+        """
+        xyz = np.atleast_2d(xyz)
+        if self.planner is None:
+            return points, xyz, None
+        self.planner.check(xyz)
+        start = self.field_cache.get()
+        if optimize_order:
+            order = self.planner.order_points(xyz, start=start)
+            points, xyz = np.asarray(points)[order], xyz[order]
+        return points, xyz, self.planner.path_time(xyz, start=start)
+
+    def _axis_points(self, points, axis, optimize_order):
+        """ _plan for a sweep of a single axis. Without planner, the other axes of the fields are NaN. """
+        if self.planner is not None:
+            xyz = np.tile(self.field_cache.get(), (len(points), 1))
+        else:
+            xyz = np.full((len(points), 3), np.nan)
+        xyz[:, axis] = points
+        return self._plan(points, xyz, optimize_order)
+
+    def _point_function(self, points, xyz, serpentine):
+        """ Point function returning the points. If serpentine is True, they are returned in reverse when the
+        present field is closer to the last point than to the first. Used as the inner sweep of a 2D map, this
+        makes the field go back and forth instead of ramping back to the first point for every outer point,
+        and the direction follows from where the outer setpoint left the field, also when a sweep is rerun.
+        """
+
+        @MakeMeasurementFunction([])
+        def point_function(d):
+            if serpentine and len(points) > 1:
+                # NaN components are not swept and do not count
+                distances = np.nansum((xyz[[0, -1]] - self.field_cache.get()) ** 2, axis=1)
+                if distances[1] < distances[0]:
+                    return points[::-1], []
+            return points, []
+
+        return point_function
+
+    @staticmethod
+    def _sweep_object(set_function, unit, label, point_function, expected_ramp_time):
+        sweep_object = SweepObject(set_function=set_function, unit=unit, label=label, point_function=point_function,
+                                   dataparameter=None)
+        sweep_object.expected_ramp_time = expected_ramp_time
+        return sweep_object
 
     def measure_magnet_components(self):
         """ Measure the x, y, z component of the magnet and return as list
@@ -53,9 +123,7 @@ class Magnet:
             ]
         )
         def measurement_function(d):
-            x_meas = self.magnet.x_measured()
-            y_meas = self.magnet.y_measured()
-            z_meas = self.magnet.z_measured()
+            x_meas, y_meas, z_meas = self.field_cache.get()
             return [x_meas, y_meas, z_meas]
 
         return measurement_function
@@ -78,9 +146,7 @@ class Magnet:
             ]
         )
         def measurement_function(d):
-            x = self.magnet.x_measured() + 1e-9  # avoiding dividing by true zero
-            y = self.magnet.y_measured() + 1e-9
-            z = self.magnet.z_measured() + 1e-9
+            x, y, z = self.field_cache.get() + 1e-9  # avoiding dividing by true zero
 
             r_meas = np.sqrt(x ** 2 + y ** 2 + z ** 2)
             phi_meas = np.arctan2(y, x) / np.pi * 180
@@ -92,7 +158,8 @@ class Magnet:
 
         return measurement_function
 
-    def sweep_phi(self, r, theta, points, max_field_strength=1.5, use_conventions=True):
+    def sweep_phi(self, r, theta, points, max_field_strength=1.5, use_conventions=True,
+                  serpentine=False, optimize_order=False):
         """ Generate a pysweep.SweepObject to sweep phi at fixed amplitude and theta.
         Here we use the ISO 80000-2:2009 physics convention for the (r, theta, phi) <--> (x, y, z) definition. 
         Only values for the x, y, and z component are passed to the magnet.
@@ -103,6 +170,8 @@ class Magnet:
         points (float): sweep values for phi, i.e. the azimuth (in plane) angle, unit: degrees, range: 0 <= phi <= 360 
         max_field_strength (float): maximum magnetic field strength, unit: T
         use_conventions (boolean): check if the values specified are consistent with conventions. Can be problematic when sweeping through 0 degrees.
+        serpentine (boolean): reverse the points on every other pass, for the inner sweep of a 2D map
+        optimize_order (boolean): let the planner order the points for the shortest total ramp time
 
         Output:
         pysweep.SweepObject
@@ -117,9 +186,8 @@ class Magnet:
                 60,
             )
 
-        @MakeMeasurementFunction([])
-        def point_function(d):
-            return points, []
+        points, xyz, expected_ramp_time = self._plan(points, spherical_to_cartesian(r, theta, points), optimize_order)
+        point_function = self._point_function(points, xyz, serpentine)
 
         @MakeMeasurementFunction([])
         def set_function(phi, d):
@@ -155,19 +223,14 @@ class Magnet:
             self.magnet.y_target(y)
             self.magnet.z_target(z)
 
-            self.magnet.ramp(mode="safe")
+            self._ramp(self.ramp_mode, max_field_strength)
 
             return []
 
-        return SweepObject(
-            set_function=set_function,
-            unit="degrees",
-            label="phi",
-            point_function=point_function,
-            dataparameter=None,
-        )
+        return self._sweep_object(set_function, "degrees", "phi", point_function, expected_ramp_time)
 
-    def sweep_theta(self, r, phi, points, max_field_strength=1.5, use_conventions=True):
+    def sweep_theta(self, r, phi, points, max_field_strength=1.5, use_conventions=True,
+                    serpentine=False, optimize_order=False):
         """ Generate a pysweep.SweepObject to sweep theta at fixed amplitude and phi.
         Here we use the ISO 80000-2:2009 physics convention for the (r, theta, phi) <--> (x, y, z) definition. 
         Only values for the x, y, and z component are passed to the magnet.
@@ -178,6 +241,8 @@ class Magnet:
         points (float): sweep values for theta, i.e. the inclination angle, unit: degrees, range: 0 <= phi <= 180
         max_field_strength (float): maximum magnetic field strength, unit: T
         use_conventions (boolean): check if the values specified are consistent with conventions. Can be problematic when sweeping through 0 degrees.
+        serpentine (boolean): reverse the points on every other pass, for the inner sweep of a 2D map
+        optimize_order (boolean): let the planner order the points for the shortest total ramp time
 
         Output:
         pysweep.SweepObject
@@ -192,9 +257,8 @@ class Magnet:
                 109,
             )
 
-        @MakeMeasurementFunction([])
-        def point_function(d):
-            return points, []
+        points, xyz, expected_ramp_time = self._plan(points, spherical_to_cartesian(r, points, phi), optimize_order)
+        point_function = self._point_function(points, xyz, serpentine)
 
         @MakeMeasurementFunction([])
         def set_function(theta, d):
@@ -234,19 +298,14 @@ class Magnet:
             self.magnet.y_target(y)
             self.magnet.z_target(z)
 
-            self.magnet.ramp(mode="safe")
+            self._ramp(self.ramp_mode, max_field_strength)
 
             return []
 
-        return SweepObject(
-            set_function=set_function,
-            unit="degrees",
-            label="theta",
-            point_function=point_function,
-            dataparameter=None,
-        )
+        return self._sweep_object(set_function, "degrees", "theta", point_function, expected_ramp_time)
 
-    def sweep_r(self, phi, theta, points, max_field_strength=1.5, use_conventions=True):
+    def sweep_r(self, phi, theta, points, max_field_strength=1.5, use_conventions=True,
+                serpentine=False, optimize_order=False):
         """ Generate a pysweep.SweepObject to sweep field amplitude at fixed phi and theta.
         Here we use the ISO 80000-2:2009 physics convention for the (r, theta, phi) <--> (x, y, z) definition. 
         Only values for the x, y, and z component are passed to the magnet.
@@ -257,6 +316,8 @@ class Magnet:
         points (float): sweep values for r, i.e. the magentic field strength, unit: T, range: 0 <= r <= max_field_strength
         max_field_strength (float): maximum magnetic field strength, unit: T
         use_conventions (boolean): check if the values specified are consistent with conventions. Can be problematic when sweeping through 0 magnitude.
+        serpentine (boolean): reverse the points on every other pass, for the inner sweep of a 2D map
+        optimize_order (boolean): let the planner order the points for the shortest total ramp time
 
         Output:
         pysweep.SweepObject
@@ -271,9 +332,8 @@ class Magnet:
                 162,
             )
 
-        @MakeMeasurementFunction([])
-        def point_function(d):
-            return points, []
+        points, xyz, expected_ramp_time = self._plan(points, spherical_to_cartesian(points, theta, phi), optimize_order)
+        point_function = self._point_function(points, xyz, serpentine)
 
         @MakeMeasurementFunction([])
         def set_function(r, d):
@@ -313,23 +373,19 @@ class Magnet:
             self.magnet.y_target(y)
             self.magnet.z_target(z)
 
-            self.magnet.ramp(mode="safe")
+            self._ramp(self.ramp_mode, max_field_strength)
 
             return []
 
-        return SweepObject(
-            set_function=set_function,
-            unit="T",
-            label="r",
-            point_function=point_function,
-            dataparameter=None,
-        )
+        return self._sweep_object(set_function, "T", "r", point_function, expected_ramp_time)
 
-    def sweep_x(self, points, max_field_strength=1.5):
+    def sweep_x(self, points, max_field_strength=1.5, serpentine=False, optimize_order=False):
         ''' Generate a pysweep.SweepObject to sweep field x amplitude at fixed y and z.
         Inputs:
         points (float): sweep values for x, i.e. the magentic field strength, unit: T, range: -max_field_strength <= x <= max_field_strength
         max_field_strength (float): maximum magnetic field strength, unit: T
+        serpentine (boolean): reverse the points on every other pass, for the inner sweep of a 2D map
+        optimize_order (boolean): let the planner order the points for the shortest total ramp time
         Output:
         pysweep.SweepObject
         '''
@@ -338,9 +394,8 @@ class Magnet:
             showwarning('Be aware that mu-metal shields are saturated by too large magnetic fields and will not work afterwards.'
                         'Are you sure you want to go to more than 1.5 T?', ResourceWarning, 'cqed/cqed/custom_pysweep_functions/magnet', 162)
 
-        @MakeMeasurementFunction([])
-        def point_function(d):
-            return points, []
+        points, xyz, expected_ramp_time = self._axis_points(points, 0, optimize_order)
+        point_function = self._point_function(points, xyz, serpentine)
 
         @MakeMeasurementFunction([])
         def set_function(x, d):
@@ -350,17 +405,19 @@ class Magnet:
                 max_field_strength)
 
             self.magnet.x_target(x)
-            self.magnet.ramp(mode="safe")
+            self._ramp(self.ramp_mode, max_field_strength)
 
             return []
 
-        return SweepObject(set_function=set_function, unit="T", label="x_field", point_function=point_function, dataparameter=None)
+        return self._sweep_object(set_function, "T", "x_field", point_function, expected_ramp_time)
 
-    def sweep_y(self, points, max_field_strength=1.5):
+    def sweep_y(self, points, max_field_strength=1.5, serpentine=False, optimize_order=False):
         ''' Generate a pysweep.SweepObject to sweep field y amplitude at fixed x and z.
         Inputs:
         points (float): sweep values for y, i.e. the magentic field strength, unit: T, range: -max_field_strength <= y <= max_field_strength
         max_field_strength (float): maximum magnetic field strength, unit: T
+        serpentine (boolean): reverse the points on every other pass, for the inner sweep of a 2D map
+        optimize_order (boolean): let the planner order the points for the shortest total ramp time
         Output:
         pysweep.SweepObject
         '''
@@ -369,9 +426,8 @@ class Magnet:
             showwarning('Be aware that mu-metal shields are saturated by too large magnetic fields and will not work afterwards.'
                         'Are you sure you want to go to more than 1.5 T?', ResourceWarning, 'cqed/cqed/custom_pysweep_functions/magnet', 162)
 
-        @MakeMeasurementFunction([])
-        def point_function(d):
-            return points, []
+        points, xyz, expected_ramp_time = self._axis_points(points, 1, optimize_order)
+        point_function = self._point_function(points, xyz, serpentine)
 
         @MakeMeasurementFunction([])
         def set_function(y, d):
@@ -381,17 +437,19 @@ class Magnet:
                 max_field_strength)
 
             self.magnet.y_target(y)
-            self.magnet.ramp(mode="safe")
+            self._ramp(self.ramp_mode, max_field_strength)
 
             return []
 
-        return SweepObject(set_function=set_function, unit="T", label="y_field", point_function=point_function, dataparameter=None)
+        return self._sweep_object(set_function, "T", "y_field", point_function, expected_ramp_time)
 
-    def sweep_z(self, points, max_field_strength=1.5):
+    def sweep_z(self, points, max_field_strength=1.5, serpentine=False, optimize_order=False):
         ''' Generate a pysweep.SweepObject to sweep field z amplitude at fixed x and y.
         Inputs:
         points (float): sweep values for z, i.e. the magentic field strength, unit: T, range: -max_field_strength <= z <= max_field_strength
         max_field_strength (float): maximum magnetic field strength, unit: T
+        serpentine (boolean): reverse the points on every other pass, for the inner sweep of a 2D map
+        optimize_order (boolean): let the planner order the points for the shortest total ramp time
         Output:
         pysweep.SweepObject
         '''
@@ -400,9 +458,8 @@ class Magnet:
             showwarning('Be aware that mu-metal shields are saturated by too large magnetic fields and will not work afterwards.'
                         'Are you sure you want to go to more than 1.5 T?', ResourceWarning, 'cqed/cqed/custom_pysweep_functions/magnet', 162)
 
-        @MakeMeasurementFunction([])
-        def point_function(d):
-            return points, []
+        points, xyz, expected_ramp_time = self._axis_points(points, 2, optimize_order)
+        point_function = self._point_function(points, xyz, serpentine)
 
         @MakeMeasurementFunction([])
         def set_function(z, d):
@@ -412,8 +469,110 @@ class Magnet:
                 max_field_strength)
 
             self.magnet.z_target(z)
-            self.magnet.ramp(mode="safe")
+            self._ramp(self.ramp_mode, max_field_strength)
+
+            return []
+
+        return self._sweep_object(set_function, "T", "z_field", point_function, expected_ramp_time)
+
+    def sweep_continuous(self, x, y, z, npoints, max_field_strength=1.5):
+        """ Generate a pysweep.SweepObject that ramps the field to (x, y, z) in one go and measures while it ramps.
+        The swept parameter is the index of the measurement. At index 0 a non-blocking ramp ('simul') is started,
+        after which every point measures immediately; the last index waits for the ramp to finish, so the last
+        measurement is taken at the final field. Combine with measure_field_while_ramping to record the field at
+        every point. Choose npoints such that the ramp time divided by npoints roughly matches the measurement time.
+
+        Inputs:
+        x, y, z (float): final field, unit: T
+        npoints (int): number of measurements during the ramp
+        max_field_strength (float): maximum magnetic field strength, unit: T
+
+        Output:
+        pysweep.SweepObject
+        """
+
+        if max_field_strength > 1.5:
+            showwarning('Be aware that mu-metal shields are saturated by too large magnetic fields and will not work afterwards.'
+                        'Are you sure you want to go to more than 1.5 T?', ResourceWarning, 'cqed/cqed/custom_pysweep_functions/magnet', 162)
 
+        assert max_field_strength > np.sqrt(x ** 2 + y ** 2 + z ** 2), 'The field amplitude must not exceed {}.' \
+            ' Upper limit can be adjusted with kwarg: max_field_strength.' \
+            ' Proceed with caution (Mu-metal shields do not appreciate high fields!)'.format(
+            max_field_strength)
+
+        @MakeMeasurementFunction([])
+        def point_function(d):
+            return np.arange(npoints), []
+
+        @MakeMeasurementFunction([])
+        def set_function(index, d):
+            if index == 0:
+                self.magnet.x_target(x)
+                self.magnet.y_target(y)
+                self.magnet.z_target(z)
+                self._ramp("simul", max_field_strength)
+                d["ramp_start"] = monotonic()
+            elif index == npoints - 1:
+                with timing.phase("ramp"):
+                    while self.magnet.is_ramping():
+                        sleep(0.1)
+
+            d["ramp_field"] = (monotonic(), self.field_cache.read())
             return []
 
-        return SweepObject(set_function=set_function, unit="T", label="z_field", point_function=point_function, dataparameter=None)
\ No newline at end of file
+        return SweepObject(set_function=set_function, unit="#", label="ramp_index", point_function=point_function, dataparameter=None)
+
+    def measure_field_while_ramping(self):
+        """ Measure the field during a sweep_continuous, to be placed after the actual measurement function.
+        The field is read before (by the set function) and after the measurement, and interpolated linearly
+        to the middle of the measurement, i.e. the average of both readbacks.
+        output: [x, y, z, ramp_time], with ramp_time the time since the start of the ramp in s
+        """
+
+        @MakeMeasurementFunction(
+            [
+                DataParameter(name="x", unit="T"),
+                DataParameter(name="y", unit="T"),
+                DataParameter(name="z", unit="T"),
+                DataParameter(name="ramp_time", unit="s"),
+            ]
+        )
+        def measurement_function(d):
+            t_before, field_before = d["ramp_field"]
+            field_after = self.field_cache.read()
+            t_after = monotonic()
+
+            field = (field_before + field_after) / 2
+            return [field[0], field[1], field[2], (t_before + t_after) / 2 - d["ramp_start"]]
+
+        return measurement_function
+
+    def measure_readback_count(self):
+        """ Measure the number of field readbacks from the instruments since the previous point,
+        to check that the field cache works as intended: one readback of every axis per point, and one more for
+        the CustomMagnet, which reads the start of every ramp fresh for its path checks.
+        output: [field_readbacks]
+        """
+
+        @MakeMeasurementFunction([DataParameter(name="field_readbacks", unit="#")])
+        def measurement_function(d):
+            return [self.field_cache.reset_counts()]
+
+        return measurement_function
+
+    def _ramp(self, mode, max_field_strength):
+        """ Ramps the magnet. Instruments that check the path of their ramps (as the CustomMagnet) also get the
+        max_field_strength of the sweep. Instruments with their own field_cache invalidate and update it themselves,
+        such that there is a single readback per ramp; otherwise the cache of this class is invalidated.
+        """
+        with timing.phase("ramp"):
+            if hasattr(self.magnet, "field_limits"):
+                self.magnet.ramp(mode=mode, max_field_strength=max_field_strength)
+            else:
+                self.magnet.ramp(mode=mode)
+        if self._own_field_cache:
+            self.field_cache.invalidate()
+
+    def _read_field(self):
+        with timing.phase("field readback"):
+            return np.array([self.magnet.x_measured(), self.magnet.y_measured(), self.magnet.z_measured()])
@@ -7,6 +7,9 @@ from pysweep.core.measurementfunctions import MakeMeasurementFunction, Measureme
 from pysweep.databackends.base import DataParameter
 import numpy as np
 import time
+from cqed.utils.peak_finding import find_multiple_peaks_filtered
+from cqed.utils.peak_linking import PeakLinker
+from cqed.utils import timing
 
 # ---------------------------------- linear mode functions from here onwards ------------------------------------------
 
@@ -122,17 +125,21 @@ def measure_linear_sweep(suffix='', **kwargs):
     )
     def measurement_function(d):
         station = d["STATION"]
-        if bool(kwargs):  # checks if there are kwargs, otherwise we can skip setting up the VNA
-            setup_linear_sweep(station=station, **kwargs)
+        with timing.phase("setup"):
+            if bool(kwargs):  # checks if there are kwargs, otherwise we can skip setting up the VNA
+                setup_linear_sweep(station=station, **kwargs)
 
-        freqs = np.linspace(station.vna.S21.start(),
-                            station.vna.S21.stop(), station.vna.S21.npts())
+            freqs = np.linspace(station.vna.S21.start(),
+                                station.vna.S21.stop(), station.vna.S21.npts())
 
-        if not station.vna.rf_power():
-            station.vna.rf_on()
+        with timing.phase("RF toggle"):
+            if not station.vna.rf_power():
+                station.vna.rf_on()
 
-        vna_data = station.vna.S21.trace_mag_phase()
-        station.vna.rf_off()
+        with timing.phase("acquisition"):
+            vna_data = station.vna.S21.trace_mag_phase()
+        with timing.phase("RF toggle"):
+            station.vna.rf_off()
 
         return [freqs, vna_data[0], vna_data[1]]
 
@@ -234,7 +241,8 @@ def measure_resonance_frequency(peak_finder, save_trace=False, suffix='', **kwar
         freqs, mag, phase = measure_linear_sweep(
             suffix=suffix, **kwargs)(d)
 
-        m0 = peak_finder(freqs, mag)
+        with timing.phase("analysis"):
+            m0 = peak_finder(freqs, mag)
         if m0 == None:
             raise Exception(
                 "Failed to find a resonance."
@@ -277,6 +285,78 @@ def measure_resonance_frequency(peak_finder, save_trace=False, suffix='', **kwar
         ])
 
 
+def measure_resonance_frequencies(nresonances, peak_finder=None, linker=None, save_trace=False, suffix='', **kwargs):
+    """Pysweep VNA measurement function that estimates the frequencies of several resonances from a single wide
+    trace, e.g. of the resonators of a multiplexed chip, instead of one narrow sweep per resonance.
+    Every resonance keeps its label throughout the sweep by linking the peaks of every trace to the
+    predicted resonance frequencies, see `PeakLinker`. The frequencies are stored in the dictionary as `f0s`.
+
+    nresonances (int): number of resonances to track.
+    peak_finder: Function that returns all peaks from VNA output. Defaults to `find_multiple_peaks_filtered`
+    returning the nresonances most prominent peaks; pass for example dip=True via a lambda for hanger resonators.
+    linker (PeakLinker): links the peaks to the resonances. Defaults to labelling the resonances by frequency in the
+    first trace. The linker is available as the attribute `linker` of the returned measurement function; call its
+    `reset` before reusing the measurement function in a new sweep. Without initial positions, the linker raises a
+    ValueError if the first trace does not show exactly nresonances peaks.
+    save_trace (boolean): whether to save the full VNA trace and the determined frequencies or only the frequencies.
+    suffix (int): suffix added to the DataParameters.
+    kwargs: see `setup_linear_sweep`.
+
+    Returns:
+    Pysweep measurement function
+
+    """
+    if peak_finder is None:
+        def peak_finder(freqs, mag):
+            return find_multiple_peaks_filtered(freqs, mag, npeaks=nresonances)
+    if linker is None:
+        linker = PeakLinker(nresonances=nresonances)
+
+    def measurement_function(d):
+        freqs, mag, phase = measure_linear_sweep(
+            suffix=suffix, **kwargs)(d)
+
+        with timing.phase("analysis"):
+            f0s = linker(peak_finder(freqs, mag))
+        if np.all(np.isnan(f0s)):
+            raise Exception(
+                "Failed to find any of the resonances."
+            )
+        d["f0s"] = f0s
+
+        if save_trace == True:
+            return [freqs, mag, phase] + list(f0s)
+        else:
+            return list(f0s)
+
+    frequency_parameters = [DataParameter(name="resonance_frequency" + str(suffix) + "_" + str(ii),
+                                          unit="Hz",
+                                          paramtype="numeric",
+                                          ) for ii in range(nresonances)]
+    if save_trace == True:
+        measurement = MeasurementFunction(measurement_function, [
+            DataParameter(name="frequency" + str(suffix),
+                          unit="Hz",
+                          paramtype="array",
+                          independent=2,
+                          ),
+            DataParameter(name="amplitude" + str(suffix),
+                          unit="",
+                          paramtype="array",
+                          extra_dependencies=["frequency" + str(suffix)],
+                          ),
+            DataParameter(name="phase" + str(suffix),
+                          unit="rad",
+                          paramtype="array",
+                          extra_dependencies=["frequency" + str(suffix)],
+                          ),
+        ] + frequency_parameters)
+    else:
+        measurement = MeasurementFunction(measurement_function, frequency_parameters)
+    measurement.linker = linker
+    return measurement
+
+
 def measure_adaptive_linear_sweep(suffix='', **kwargs):
     """Pysweep VNA measurement function that measures S21 in a window around a
     frequency f0 as be updated through functions such as `measure_resonance_frequency`.
@@ -413,19 +493,23 @@ def measure_cw_sweep(suffix='', **kwargs):
     )
     def measurement_function(d):
         station = d["STATION"]
-        if bool(kwargs):  # checks if there are kwargs, otherwise we can skip setting up the VNA
-            setup_CW_sweep(station=station, **kwargs)
+        with timing.phase("setup"):
+            if bool(kwargs):  # checks if there are kwargs, otherwise we can skip setting up the VNA
+                setup_CW_sweep(station=station, **kwargs)
 
-        bw = station.vna.S21.bandwidth()
-        sweep_time = station.vna.S21.sweep_time()
-        npts = station.vna.S21.npts()
-        times = np.linspace(1 / bw, sweep_time, npts)
+            bw = station.vna.S21.bandwidth()
+            sweep_time = station.vna.S21.sweep_time()
+            npts = station.vna.S21.npts()
+            times = np.linspace(1 / bw, sweep_time, npts)
 
-        if not station.vna.rf_power():
-            station.vna.rf_on()
+        with timing.phase("RF toggle"):
+            if not station.vna.rf_power():
+                station.vna.rf_on()
 
-        vna_data = station.vna.S21.trace_fixed_frequency()
-        station.vna.rf_off()
+        with timing.phase("acquisition"):
+            vna_data = station.vna.S21.trace_fixed_frequency()
+        with timing.phase("RF toggle"):
+            station.vna.rf_off()
 
         return [times, vna_data[0], vna_data[1]]
 
@@ -465,11 +549,12 @@ def measure_PSD_averaged(averages=1, suffix='', **kwargs):
     )
     def measurement_function(d):
         station = d["STATION"]
-        if bool(kwargs):
-            # while this seems redundant as measure_cw_sweep can also recognise if there are kwargs
-            # we put the setting up here outside the for loop to save time as cw_sweeps can be very short
-            setup_CW_sweep(station=station, **kwargs)
-            
+        with timing.phase("setup"):
+            if bool(kwargs):
+                # while this seems redundant as measure_cw_sweep can also recognise if there are kwargs
+                # we put the setting up here outside the for loop to save time as cw_sweeps can be very short
+                setup_CW_sweep(station=station, **kwargs)
+
         bw = station.vna.S21.bandwidth()
         sweep_time = station.vna.S21.sweep_time()
         npts = station.vna.S21.npts()
@@ -483,7 +568,8 @@ def measure_PSD_averaged(averages=1, suffix='', **kwargs):
             vna_data = measure_cw_sweep()(d)
             I = vna_data[1]
             Q = vna_data[2]
-            fft_y = np.abs(np.fft.fft((Q - np.mean(Q))+1j*(I - np.mean(I))))**2
+            with timing.phase("analysis"):
+                fft_y = np.abs(np.fft.fft((Q - np.mean(Q))+1j*(I - np.mean(I))))**2
 
             if ii == 0:
                 fft_array = fft_y
@@ -550,15 +636,19 @@ def measure_cw_point(suffix='', **kwargs):
     )
     def measurement_function(d):
         station = d["STATION"]
-        if bool(kwargs):  # checks if there are kwargs, otherwise we can skip setting up the VNA
-            setup_CW_sweep(station=station, **kwargs)
+        with timing.phase("setup"):
+            if bool(kwargs):  # checks if there are kwargs, otherwise we can skip setting up the VNA
+                setup_CW_sweep(station=station, **kwargs)
 
-        if not station.vna.rf_power():
-            station.vna.rf_on()
+        with timing.phase("RF toggle"):
+            if not station.vna.rf_power():
+                station.vna.rf_on()
 
-        data = list(station.vna.S21.point_fixed_frequency_mag_phase())
+        with timing.phase("acquisition"):
+            data = list(station.vna.S21.point_fixed_frequency_mag_phase())
 
-        station.vna.rf_off()
+        with timing.phase("RF toggle"):
+            station.vna.rf_off()
 
         return data
     return measurement_function
@@ -589,29 +679,33 @@ def measure_twotone_sweep(frequencies, cw_frequency='dict', qubsrc_power=None, s
     """
     def measurement_function(d):
         station = d["STATION"]
-        station.qubsrc.output_rf('ON')
-        station.qubsrc.modulation_rf('OFF')
-
-        if qubsrc_power != None:
-            station.qubsrc.power(qubsrc_power)
+        with timing.phase("RF toggle"):
+            station.qubsrc.output_rf('ON')
+            station.qubsrc.modulation_rf('OFF')
 
         mag = np.zeros_like(frequencies)
         phase = np.zeros_like(frequencies)
 
-        if cw_frequency == 'dict':
-            setup_CW_sweep(station=station, cw_frequency=d["f0"], **kwargs)
-        elif cw_frequency is not None or bool(kwargs):
-            setup_CW_sweep(station=station,
-                           cw_frequency=cw_frequency, **kwargs)
+        with timing.phase("setup"):
+            if qubsrc_power != None:
+                station.qubsrc.power(qubsrc_power)
+
+            if cw_frequency == 'dict':
+                setup_CW_sweep(station=station, cw_frequency=d["f0"], **kwargs)
+            elif cw_frequency is not None or bool(kwargs):
+                setup_CW_sweep(station=station,
+                               cw_frequency=cw_frequency, **kwargs)
 
         for ii in range(len(frequencies)):
-            station.qubsrc.frequency(frequencies[ii])
-            time.sleep(settling_time)
+            with timing.phase("setup"):
+                station.qubsrc.frequency(frequencies[ii])
+                time.sleep(settling_time)
             data = measure_cw_point()(d)
             mag[ii] = data[0]
             phase[ii] = data[1]
 
-        station.qubsrc.output_rf('OFF')
+        with timing.phase("RF toggle"):
+            station.qubsrc.output_rf('OFF')
 
         return [frequencies, mag, phase]
 
@@ -653,7 +747,8 @@ def measure_qubit_frequency(frequencies, suffix='', save_trace=True, peak_finder
         freqs, mag, phase = measure_twotone_sweep(
             frequencies=frequencies, **kwargs)(d)
 
-        m0 = peak_finder(freqs, mag)
+        with timing.phase("analysis"):
+            m0 = peak_finder(freqs, mag)
 
         if m0 == None:
             raise Exception(
@@ -5,8 +5,34 @@ A set of functions that allow wrapping and combining multiple current sources in
 
 from qcodes.instrument.base import Instrument
 from qcodes.instrument.parameter import Parameter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from contextlib import nullcontext
+from threading import RLock, Thread
 import numpy as np
-from time import sleep
+from time import sleep, monotonic
+from warnings import warn
+from cqed.utils.field_cache import FieldCache
+from cqed.utils.field_path_planner import axis_order
+
+
+def _timed_ramp(write, currents, delay, lock):
+    """Software ramp of a current source: writes currents[i] at i * delay seconds after the start, and returns
+    len(currents) * delay seconds after the start. Every step is written at a fixed deadline rather than after a
+    fixed sleep, such that the time the writes take does not slow down the ramp. Steps that do not change the
+    current (e.g. below the resolution of the source) are not written. The lock is held for every write.
+    """
+    if len(currents) == 0:
+        return
+    times = delay * np.arange(len(currents))  # time of every write relative to the start of the ramp
+    keep = np.append(True, np.diff(currents) != 0)
+
+    start = monotonic()
+    for current, t in zip(currents[keep], times[keep]):
+        sleep(max(0, start + t - monotonic()))
+        with lock:
+            write(current)
+    sleep(max(0, start + len(currents) * delay - monotonic()))
 
 
 class CustomGS210(Instrument):
@@ -17,19 +43,28 @@ class CustomGS210(Instrument):
     but perhaps we can/should generalize this somehow. Need to have a look at the 
     AMI driver.
 
+    Ramps run at a rate of step / delay. If the source driver has a program submodule (as the qcodes GS200 driver),
+    the ramp is done by the source itself as a one-step program with a linear slope, such that it is smooth and
+    takes exactly the expected time instead of stepping through the driver. Otherwise the ramp is stepped in software
+    as for the CustomE36313A, with every step written at a fixed deadline.
+
     args:
     coil_constant (A/T): coil_constant of magnet used
     step (A): step size taken when ramping. Note the unit!
     delay (s): delay after each step taken when ramping
+    hardware_ramp (boolean): use the program of the source for ramping when available
     """
 
-    def __init__(self, name, instrument, coil_constant, step=1e-5, delay=5e-2):
+    def __init__(self, name, instrument, coil_constant, step=1e-5, delay=5e-2, hardware_ramp=True):
         super().__init__(name)
 
         self.source = instrument
         self.coil_constant = coil_constant  # A/T
         self.step = step
         self.delay = delay
+        self.hardware_ramp = hardware_ramp
+        self._ramp = None  # (start time, duration) of the present or last ramp
+        self.lock = RLock()  # held per command to the source, see CustomMagnet
 
         self.add_parameter(
             "field", unit="T", label="measured field", get_cmd=self._get_field,
@@ -43,14 +78,24 @@ class CustomGS210(Instrument):
             set_cmd=self._set_target,
         )
 
+        self.add_parameter(
+            "ramp_duration", unit="s", label="expected duration of the present or last ramp",
+            get_cmd=lambda: 0 if self._ramp is None else self._ramp[1],
+        )
+
+        self.add_parameter(
+            "ramp_progress", label="fraction of the present or last ramp that is done", get_cmd=self._get_progress,
+        )
+
         self._field_target = self.field()
 
     def _get_field(self):
-        if self.source.output() == "off":
-            B_value = 0
-        else:
-            I_value = self.source.current()
-            B_value = I_value / self.coil_constant
+        with self.lock:
+            if self.source.output() == "off":
+                B_value = 0
+            else:
+                I_value = self.source.current()
+                B_value = I_value / self.coil_constant
         return B_value
 
     def _get_target(self):
@@ -59,20 +104,67 @@ class CustomGS210(Instrument):
     def _set_target(self, val):
         self._field_target = val
 
+    def _get_progress(self):
+        if self._ramp is None or self._ramp[1] == 0:
+            return 1.0
+        return min((monotonic() - self._ramp[0]) / self._ramp[1], 1.0)
+
     def ramp_to_target(self):
-        if self.source.output() != "on":
-            self.source.source_mode("CURR")
-        self.source.output("on")
-        self.source.ramp_current(
-            ramp_to=self.field_target() * self.coil_constant,
-            step=self.step,
-            delay=self.delay,
-        )
+        with self.lock:
+            if self.source.output() != "on":
+                self.source.source_mode("CURR")
+            self.source.output("on")
+            I_start = self.source.current()
+
+        I_target = self.field_target() * self.coil_constant
+        duration = abs(I_target - I_start) * self.delay / self.step
+        self._ramp = (monotonic(), duration)
+
+        if self.hardware_ramp and hasattr(self.source, "program") and 0.1 <= duration <= 3600:
+            self._program_ramp(I_target, duration)
+        else:
+            nsteps = int(np.ceil(abs(I_target - I_start) / self.step))
+            _timed_ramp(self.source.current, np.linspace(I_start, I_target, nsteps + 1)[1:], self.delay, self.lock)
+
+    def _program_ramp(self, I_target, duration):
+        """Ramps linearly to I_target in duration seconds using a one-step program of the source, and blocks until done.
+        Warns if the current is not within step of I_target shortly after the ramp should have ended."""
+        program = self.source.program
+        with self.lock:
+            # the slope time can not exceed the interval time, so change them in the order that keeps slope <= interval
+            if duration > program.interval():
+                program.interval(duration)
+                program.slope(duration)
+            else:
+                program.slope(duration)
+                program.interval(duration)
+            program.repeat("OFF")
+            program.start()
+            self.source.write(":SOUR:LEV {:.6e}".format(I_target))
+            program.end()
+            program.run()
+
+        sleep(duration)
+        deadline = monotonic() + 10 * self.delay + 1
+        while True:
+            with self.lock:
+                I_value = self.source.current()
+            if abs(I_value - I_target) <= self.step:
+                return
+            if monotonic() > deadline:
+                warn(f"{self.name} did not reach {I_target:.6e} A after its {duration:.1f} s ramp program, "
+                     f"the current is {I_value:.6e} A.")
+                return
+            sleep(self.delay)
 
 class CustomE36313A(Instrument):
     """Meta instrument that wraps the Keysight E36313A to allow setting fields
     rather than currents.
 
+    The source has no ramp or list mode in its driver, so ramps are done in software, at a rate of step / delay.
+    Every step is written at a fixed deadline rather than after a fixed sleep, such that the time the writes take
+    does not slow down the ramp.
+
     args:
     coil_constant (A/T): coil_constant of magnet used
     step (A): step size taken when ramping. Note the unit!
@@ -87,6 +179,8 @@ class CustomE36313A(Instrument):
         assert step >= 6e-4  # resolution of the source
         self.step = step
         self.delay = delay
+        self._ramp = None  # (start time, duration) of the present or last ramp
+        self.lock = RLock()  # held per command to the source, see CustomMagnet
 
         self.add_parameter(
             "field", unit="T", label="measured field", get_cmd=self._get_field,
@@ -100,14 +194,24 @@ class CustomE36313A(Instrument):
             set_cmd=self._set_target,
         )
 
+        self.add_parameter(
+            "ramp_duration", unit="s", label="expected duration of the present or last ramp",
+            get_cmd=lambda: 0 if self._ramp is None else self._ramp[1],
+        )
+
+        self.add_parameter(
+            "ramp_progress", label="fraction of the present or last ramp that is done", get_cmd=self._get_progress,
+        )
+
         self._field_target = self.field()
 
     def _get_field(self):
-        if self.source.ch1.enable() == "off":
-            B_value = 0
-        else:
-            I_value = self.source.ch1.source_current()
-            B_value = I_value / self.coil_constant
+        with self.lock:
+            if self.source.ch1.enable() == "off":
+                B_value = 0
+            else:
+                I_value = self.source.ch1.source_current()
+                B_value = I_value / self.coil_constant
         return B_value
 
     def _get_target(self):
@@ -119,33 +223,41 @@ class CustomE36313A(Instrument):
         )  # ranges of the source
         self._field_target = val
 
+    def _get_progress(self):
+        if self._ramp is None or self._ramp[1] == 0:
+            return 1.0
+        return min((monotonic() - self._ramp[0]) / self._ramp[1], 1.0)
+
     def ramp_to_target(self):
         # this should be implemented on the driver level! Make a fork and pull request to qcodes_drivers_contrib?
-        self.source.ch1.enable("on")
-        resolution = (
-            6e-4 / self.coil_constant
-        )  # resolution of the source, which is quite coarse so we hardcode it to avoid weirdness
-        step_sign = np.sign(self.field_target() - self.field())
-        try:
-            field_values = np.append(
-                np.arange(self.field(), self.field_target(), step_sign * self.step),
-                self.field_target(),
-            )
-            field_values = resolution * np.round(field_values / resolution)
-            for val in field_values:
-                self.source.ch1.source_current(val * self.coil_constant)
-                sleep(self.delay)
-        except:
-            pass
-            # hacky workaround for when your higher level sweep function starts from the current setpoint
+        resolution = 6e-4  # resolution of the source in A, which is quite coarse so we hardcode it to avoid weirdness
+        with self.lock:
+            self.source.ch1.enable("on")
+            I_start = self.source.ch1.source_current()
+        I_target = resolution * np.round(self.field_target() * self.coil_constant / resolution)
+        nsteps = int(np.ceil(abs(I_target - I_start) / self.step))
+        if nsteps == 0:
+            # already at the target, e.g. when a higher level sweep function starts from the present setpoint
+            self._ramp = (monotonic(), 0)
+            return
+
+        currents = resolution * np.round(np.linspace(I_start, I_target, nsteps + 1)[1:] / resolution)
+        self._ramp = (monotonic(), nsteps * self.delay)
+        _timed_ramp(self.source.ch1.source_current, currents, self.delay, self.lock)
 
 class CustomDummy(Instrument):
-    """Meta instrument that sets fake parameters. Used for testing. """
+    """Meta instrument that sets fake parameters. Used for testing.
+
+    args:
+    ramp_rate (T/s): if given, ramping takes |target - field| / ramp_rate and the field
+    changes linearly in time while ramping. Otherwise every ramp takes 0.1 s.
+    """
 
-    def __init__(self, name, instrument):
+    def __init__(self, name, instrument, ramp_rate=None):
         super().__init__(name)
 
         self.source = instrument
+        self.ramp_rate = ramp_rate
 
         self.add_parameter(
             "field", unit="T", label="measured field", get_cmd=self._get_field,
@@ -159,10 +271,18 @@ class CustomDummy(Instrument):
             set_cmd=self._set_target,
         )
 
+        self._field = 0.0
         self._field_target = 0.0
+        self._ramp = None  # (start time, start field, stop field, duration) while ramping
+        self.lock = RLock()
 
     def _get_field(self):
-        return 0.0
+        with self.lock:
+            if self._ramp is None:
+                return self._field
+            t0, start, stop, duration = self._ramp
+        fraction = min((monotonic() - t0) / duration, 1) if duration > 0 else 1
+        return start + fraction * (stop - start)
 
     def _get_target(self):
         return self._field_target
@@ -171,78 +291,156 @@ class CustomDummy(Instrument):
         self._field_target = val
 
     def ramp_to_target(self):
-        sleep(0.1)
+        with self.lock:
+            start, stop = self.field(), self.field_target()
+            if self.ramp_rate is None:
+                duration = 0.1
+            else:
+                duration = abs(stop - start) / self.ramp_rate
+            self._ramp = (monotonic(), start, stop, duration)
+        sleep(duration)
+        with self.lock:
+            self._field = stop
+            self._ramp = None
+
+def _sphere(max_field_strength):
+    """Field limits of a sphere of radius max_field_strength, for CustomMagnet."""
+    def field_limits(Bx, By, Bz):
+        return np.sqrt(Bx ** 2 + By ** 2 + Bz ** 2) <= max_field_strength
+    return field_limits
+
 
 class CustomMagnet(Instrument):
     """
     Meta instrument to control the magnet using three individual magnet controllers.
     For example: x_source is an AMIGS200, y_source is mgnt.GRPY, z_source is mgnt.GRPZ.
+
+    args:
+    field_limits (callable): function mapping (Bx, By, Bz) -> True/False, where True means that the
+    field is inside the safe region, as for the mercuryIPS. Used to check the path of simultaneous ramps.
+    If None, the safe region is the sphere of radius max_field_strength.
+    max_field_strength (T): radius of the default safe region
+    path_tolerance (T): simultaneous ramps are split into straight segments until every segment is safe, or
+    shorter than this. The field can then leave the straight path by at most this much (see `ramp`).
+    field_max_age (s): the field is read back after every ramp and cached (see field_cache) for the measurement
+    functions. The cached field is read again when it is older than this, such that changes of the field made
+    elsewhere (front panel, another kernel) are noticed. None keeps it until the next ramp. The start point of the
+    safety checks of `ramp` is always read fresh.
+
+    The field can be read while a ramp runs in another thread ('simul' mode, or the threads of simultaneous ramps).
+    An instrument is never addressed by two threads at once: every command to it holds a lock per instrument. Sources
+    that have a `lock` attribute (as the ones above) take it around each of their own commands, such that reads can
+    go in between the steps of a software ramp. For other sources, the ramp commands and the reads take a lock per
+    root instrument.
     """
 
-    def __init__(self, name, x_source, y_source, z_source):
+    def __init__(self, name, x_source, y_source, z_source, field_limits=None, max_field_strength=1.5,
+                 path_tolerance=5e-3, field_max_age=1.0):
         super().__init__(name)
 
         self.x_source = x_source
         self.y_source = y_source
         self.z_source = z_source
+        self.field_limits = field_limits if field_limits is not None else _sphere(max_field_strength)
+        self.path_tolerance = path_tolerance
+        self._ramp_thread = None
+        self.field_cache = FieldCache(self._read_measured, max_age=field_max_age)
+
+        root_locks = {}
+        self._locks = {}
+        for axis in ["x", "y", "z"]:
+            source = getattr(self, f"{axis}_source")
+            root = getattr(source, "root_instrument", source)
+            self._locks[axis] = getattr(source, "lock", None) or root_locks.setdefault(id(root), RLock())
 
         self.add_parameter(
             "x_measured",
             unit="T",
             label="x measured field",
-            get_cmd=self.x_source.field,
+            get_cmd=lambda: self._call_source("x", "field"),
         )
 
         self.add_parameter(
             "x_target",
             unit="T",
             label="x target field",
-            get_cmd=self.x_source.field_target,
-            set_cmd=self.x_source.field_target,
+            get_cmd=lambda: self._call_source("x", "field_target"),
+            set_cmd=lambda val: self._call_source("x", "field_target", val),
         )
 
         self.add_parameter(
             "y_measured",
             unit="T",
             label="y measured field",
-            get_cmd=self.y_source.field,
+            get_cmd=lambda: self._call_source("y", "field"),
         )
 
         self.add_parameter(
             "y_target",
             unit="T",
             label="y target field",
-            get_cmd=self.y_source.field_target,
-            set_cmd=self.y_source.field_target,
+            get_cmd=lambda: self._call_source("y", "field_target"),
+            set_cmd=lambda val: self._call_source("y", "field_target", val),
         )
 
         self.add_parameter(
             "z_measured",
             unit="T",
             label="z measured field",
-            get_cmd=self.z_source.field,
+            get_cmd=lambda: self._call_source("z", "field"),
         )
 
         self.add_parameter(
             "z_target",
             unit="T",
             label="z target field",
-            get_cmd=self.z_source.field_target,
-            set_cmd=self.z_source.field_target,
+            get_cmd=lambda: self._call_source("z", "field_target"),
+            set_cmd=lambda val: self._call_source("z", "field_target", val),
         )
 
-    def ramp(self, mode="safe"):
-        """Ramp the fields to their present target value. Mode is always 'safe' for
-        now. Did not implement the others.
+    def ramp(self, mode="safe", max_field_strength=None):
+        """Ramp the fields to their present target value. The modes follow those of the mercuryIPS.
+
+        In 'safe' mode, the fields are ramped one-by-one in a blocking way, in an order for which every
+        intermediate field is within the limits (the smallest changes first when possible).
 
-        In 'safe' mode, the fields are ramped one-by-one in a blocking way that
-        ensures that the total field stays within the safe region (provided that
-        this region is convex).
+        In 'simul_block' mode, the sources are ramped concurrently in a blocking way. The straight path
+        from the present field to the target has to stay within `field_limits`, else a ValueError is raised.
+        The sources ramp independently, so within a segment the field can be anywhere in the box spanned by
+        its ends. The path is therefore split into segments whose box is within the limits, or which are
+        shorter than path_tolerance, such that the field leaves the straight path by at most path_tolerance.
+
+        In 'simul' mode, the 'simul_block' ramp runs in the background and this method returns immediately.
+        Use `is_ramping` and `wait_for_ramp` to follow it.
+
+        args:
+        max_field_strength (T): if given, the field additionally has to stay within a sphere of this radius,
+        e.g. the max_field_strength of a Magnet sweep
 
         """
-        meas_vals = self._get_measured()
-        targ_vals = self._get_targets()
-        order = np.argsort(np.abs(np.array(targ_vals) - np.array(meas_vals)))
+        if mode not in ["safe", "simul", "simul_block"]:
+            raise ValueError('Invalid ramp mode. Please provide either "simul", "safe" or "simul_block".')
+        limits = self.field_limits
+        if max_field_strength is not None:
+            sphere = _sphere(max_field_strength)
+            limits = lambda Bx, By, Bz: self.field_limits(Bx, By, Bz) and sphere(Bx, By, Bz)
+
+        self.wait_for_ramp()
+        # read fresh rather than cached: the paths are checked from here, and the field may have been changed elsewhere
+        meas_vals = list(self.field_cache.read())
+        self.field_cache.invalidate()
+
+        if mode == "simul":
+            # check the path before returning, such that an unsafe ramp raises here and not in the thread
+            waypoints = self._simultaneous_waypoints(meas_vals, self._get_targets(), limits)
+            self._ramp_thread = Thread(target=self._ramp_simultaneously, args=(waypoints,), daemon=True)
+            self._ramp_thread.start()
+            return
+        if mode == "simul_block":
+            self._ramp_simultaneously(self._simultaneous_waypoints(meas_vals, self._get_targets(), limits))
+            return
+
+        order = axis_order(meas_vals, self._get_targets(), limits)
 
         for slave in np.array(["x", "y", "z"])[order]:
             eval(f"self.{slave}_source.ramp_to_target()")
@@ -253,8 +451,67 @@ class CustomMagnet(Instrument):
                 pass
         self._update_field()
 
+    def is_ramping(self):
+        """Returns True while a ramp started with mode 'simul' is running."""
+        return self._ramp_thread is not None and self._ramp_thread.is_alive()
+
+    def wait_for_ramp(self):
+        """Blocks until a ramp started with mode 'simul' has finished."""
+        if self._ramp_thread is not None:
+            self._ramp_thread.join()
+            self._ramp_thread = None
+
+    def _path_is_safe(self, start, stop, limits):
+        """Checks the straight path from start to stop against the limits, at points at most path_tolerance apart."""
+        npoints = int(np.ceil(np.linalg.norm(stop - start) / self.path_tolerance)) + 1
+        return all(limits(*point) for point in np.linspace(start, stop, npoints))
+
+    def _simultaneous_waypoints(self, start, stop, limits):
+        """Splits the straight path from start to stop into segments for a simultaneous ramp, see `ramp`."""
+        start, stop = np.asarray(start, dtype=float), np.asarray(stop, dtype=float)
+        if not self._path_is_safe(start, stop, limits):
+            raise ValueError("Cannot ramp simultaneously from {} to {}: the straight path leaves the field limits."
+                             " Use mode 'safe' instead.".format(start, stop))
+        return self._split_path(start, stop, limits)
+
+    def _split_path(self, start, stop, limits):
+        # every axis changes monotonically within a segment, so the field stays within the box spanned by its ends,
+        # which is safe if its corners are (provided that the safe region is convex)
+        if np.linalg.norm(stop - start) <= self.path_tolerance or all(
+                limits(*corner) for corner in product(*zip(start, stop))):
+            return [stop]
+        middle = (start + stop) / 2
+        return self._split_path(start, middle, limits) + self._split_path(middle, stop, limits)
+
+    def _ramp_axes(self, axes):
+        """Ramps the given axes to their targets and waits until they are done. Axes that share an instrument
+        are handled by the same thread, such that their instrument is never addressed concurrently.
+        """
+        for axis in axes:
+            with self._ramp_lock(axis):
+                getattr(self, f"{axis}_source").ramp_to_target()
+        for axis in axes:
+            if hasattr(getattr(self, f"{axis}_source"), "ramp_status"):
+                while self._call_source(axis, "ramp_status") == "TO SET":
+                    sleep(0.1)
+
+    def _ramp_simultaneously(self, waypoints):
+        groups = {}
+        for axis in ["x", "y", "z"]:
+            source = getattr(self, f"{axis}_source")
+            groups.setdefault(id(getattr(source, "root_instrument", source)), []).append(axis)
+
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            for waypoint in waypoints:
+                for axis, value in zip(["x", "y", "z"], waypoint):
+                    getattr(self, f"{axis}_target")(value)
+                for future in [executor.submit(self._ramp_axes, axes) for axes in groups.values()]:
+                    future.result()
+        self._update_field()
+
     def x_ramp(self):
         # need to look up syntax in oxford IPS
+        self.field_cache.invalidate()
         self.x_source.ramp_to_target()
         try:
             while self.x_source.ramp_status() == "TO SET":
@@ -264,6 +521,7 @@ class CustomMagnet(Instrument):
         self._update_field()
 
     def y_ramp(self):
+        self.field_cache.invalidate()
         self.y_source.ramp_to_target()
         try:
             while self.y_source.ramp_status() == "TO SET":
@@ -273,6 +531,7 @@ class CustomMagnet(Instrument):
         self._update_field()
 
     def z_ramp(self):
+        self.field_cache.invalidate()
         self.z_source.ramp_to_target()
         try:
             while self.z_source.ramp_status() == "TO SET":
@@ -281,18 +540,23 @@ class CustomMagnet(Instrument):
             pass
         self._update_field()
 
-    def _get_measured(self):
-        field_components = []
-        for axis in ["x", "y", "z"]:
-            field_components.append(eval("self.{0:}_measured()".format(axis)))
-        return field_components
+    def _call_source(self, axis, name, *args):
+        """Calls the parameter or method name of the source of axis while holding its lock."""
+        with self._locks[axis]:
+            return getattr(getattr(self, f"{axis}_source"), name)(*args)
+
+    def _ramp_lock(self, axis):
+        """Lock to hold around ramp_to_target of the source of axis. Sources with their own lock hold it per
+        command during the ramp, and are not locked as a whole, such that the field can be read in between."""
+        if hasattr(getattr(self, f"{axis}_source"), "lock"):
+            return nullcontext()
+        return self._locks[axis]
+
+    def _read_measured(self):
+        return [getattr(self, f"{axis}_measured")() for axis in ["x", "y", "z"]]
 
     def _get_targets(self):
-        field_components = []
-        for axis in ["x", "y", "z"]:
-            field_components.append(eval("self.{0:}_target()".format(axis)))
-        return field_components
+        return [getattr(self, f"{axis}_target")() for axis in ["x", "y", "z"]]
 
     def _update_field(self):
-        coords = ["x", "y", "z"]
-        [getattr(self, f"{i}_measured").get() for i in coords]
+        self.field_cache.read()
@@ -0,0 +1,98 @@
+"""
+A cheap objective for field alignment: the resonance frequency tracked with single CW points.
+
+Near a resonance the phase of S21 changes linearly with frequency. After measuring that slope once
+with a linear sweep, a shift of the resonance follows from the phase of a single CW point at the old
+resonance frequency, which takes milliseconds instead of a full sweep and peak finding.
+
+"""
+
+import numpy as np
+from cqed.custom_pysweep_functions.vna import measure_linear_sweep, measure_cw_point, setup_CW_sweep
+
+
+class CWPhaseObjective:
+    """
+    Gettable returning the resonance frequency estimated from the phase of a single CW point, to be
+    used as the objective (or settle objective) of a FieldAligner.
+
+    A calibration measures a linear sweep around the last known resonance frequency, finds the resonance
+    with `peak_finder`, fits the phase slope around it, and switches the VNA to CW at the resonance.
+    Every call then measures one CW point and converts its phase shift into a frequency shift.
+    The calibration is repeated every `recalibration_interval` calls, and whenever the phase shift leaves
+    the linear range, in which case the recalibrated resonance frequency is returned.
+
+    args:
+    station: QCoDeS station that contains a R&S ZNB VNA instrument
+    peak_finder: Function that finds a peak from VNA output. See for example peak_finding.py
+    center (Hz): initial guess of the resonance frequency. If None, the present VNA settings are used.
+    span (Hz): span of the calibration sweep
+    npts (int): number of points of the calibration sweep
+    linear_range (rad): largest phase shift for which the phase is taken to be linear in frequency.
+    Also sets the part of the calibration sweep used for the fit of the slope.
+    recalibration_interval (int): number of CW points after which the calibration is repeated
+    sweep_kwargs (dict): other settings of the calibration sweep, see `setup_linear_sweep`
+    cw_kwargs (dict): settings of the CW points, see `setup_CW_sweep`
+    """
+
+    def __init__(self, station, peak_finder, center=None, span=20e6, npts=401, linear_range=0.5,
+                 recalibration_interval=50, sweep_kwargs=None, cw_kwargs=None):
+        self.d = {"STATION": station}
+        self.peak_finder = peak_finder
+        self.f0 = center
+        self.span = span
+        self.npts = npts
+        self.linear_range = linear_range
+        self.recalibration_interval = recalibration_interval
+        self.sweep_kwargs = {} if sweep_kwargs is None else sweep_kwargs
+        self.cw_kwargs = {} if cw_kwargs is None else cw_kwargs
+
+        self.slope = None
+        self.phase0 = None
+        self.npoints = 0
+        self.ncalibrations = 0
+
+    def calibrate(self):
+        """Measures the resonance frequency and phase slope with a linear sweep, and sets up CW at the resonance."""
+        # setup_linear_sweep keeps the present number of points unless fstep is given, so set it here
+        vna_trace = getattr(self.d["STATION"].vna.channels, self.sweep_kwargs.get("chan", "S21"))
+        vna_trace.npts(self.npts)
+        if self.f0 is None:
+            sweep = measure_linear_sweep(npts=self.npts, **self.sweep_kwargs)
+        else:
+            sweep = measure_linear_sweep(center=self.f0, span=self.span, npts=self.npts, **self.sweep_kwargs)
+        freqs, mag, phase = sweep(self.d)
+
+        f0 = self.peak_finder(freqs, mag)
+        if f0 is None:
+            raise Exception("Failed to find a resonance.")
+
+        phase = np.unwrap(phase)
+        i0 = int(np.argmin(np.abs(freqs - f0)))
+        linear = np.abs(phase - phase[i0]) < self.linear_range
+        # the contiguous part of the linear region around the resonance
+        low = i0 - np.argmin(linear[i0::-1]) + 1 if not linear[i0::-1].all() else 0
+        high = i0 + np.argmin(linear[i0:]) if not linear[i0:].all() else len(freqs)
+        if high - low < 3:
+            raise Exception("Too few points on the resonance to fit the phase slope; increase npts or decrease the span.")
+        self.slope = np.polyfit(freqs[low:high] - f0, phase[low:high], 1)[0]
+
+        self.f0 = f0
+        setup_CW_sweep(station=self.d["STATION"], cw_frequency=f0, **self.cw_kwargs)
+        # reference taken in CW mode, such that offsets between the sweep and CW settings cancel
+        self.phase0 = measure_cw_point()(self.d)[1]
+        self.npoints = 0
+        self.ncalibrations += 1
+        return f0
+
+    def __call__(self):
+        if self.slope is None or self.npoints >= self.recalibration_interval:
+            return self.calibrate()
+
+        phase = measure_cw_point()(self.d)[1]
+        self.npoints += 1
+        dphase = np.angle(np.exp(1j * (phase - self.phase0)))
+        if abs(dphase) > self.linear_range:
+            return self.calibrate()
+        # a resonance shifted by df has the phase at the old resonance of the unshifted one at f0 - df
+        return self.f0 - dphase / self.slope
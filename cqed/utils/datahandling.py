@@ -1,6 +1,5 @@
 from pathlib import Path
 from qcodes import initialise_or_create_database_at, config, load_by_run_spec
-from xarray import merge
 
 
 def create_local_dbase_in(folder_name='general', db_name='experiments.db', data_dir='D:/Data'):
@@ -38,6 +37,8 @@ def db_to_xarray(ind, **kwargs):
      and the dependent parameters as Data variables
     """
 
+    from xarray import merge
+
     d = load_by_run_spec(captured_run_id=ind, **kwargs)
     _df = []
     for obj in d.dependent_parameters:
@@ -6,8 +6,7 @@
 # if there is demand for it, it can be updated in a fairly short amount of time.
 
 import numpy as np
-from time import sleep
-import matplotlib.pyplot as plt
+from time import sleep, monotonic
 from warnings import showwarning
 
 # TODO:
@@ -24,12 +23,28 @@ class FieldAligner(object):
     Typically the Oxford mercuryIPS or a custom combination of sources.
     objective: A gettable QCoDeS parameter that returns the value to be
     optimized. Typically a resonator frequency.
+    settle_tolerance: If given, the waiting_time after every ramp becomes a maximum: the settle
+    objective is sampled repeatedly and the wait ends as soon as `settle_samples` successive
+    changes are all smaller than this (in units of the settle objective). If None, the full
+    waiting_time is always waited.
+    settle_objective: A cheap gettable used to detect settling, e.g. a single CW point.
+    Defaults to the objective, in which case the last sample taken while settling is used as the
+    measurement at the point.
+    settle_samples (int): Number of successive changes that must be within settle_tolerance.
+    settle_interval (s): Time between two samples of the settle objective.
     """
 
-    def __init__(self, instrument, objective):
+    def __init__(self, instrument, objective, settle_tolerance=None, settle_objective=None, settle_samples=1,
+                 settle_interval=0):
 
         self.magnet = instrument
         self.objective = objective
+        self.settle_tolerance = settle_tolerance
+        self.settle_objective = settle_objective
+        self.settle_samples = settle_samples
+        self.settle_interval = settle_interval
+        self.settle_times = []
+        self._settled_objective = None  # last sample of the objective while settling at the present point
 
     def optimize_axis(
         self,
@@ -98,12 +113,8 @@ class FieldAligner(object):
                     + "{0:.4f} mT".format((current_pos + direction * wiggle_step) * 1e3)
                 )
 
-            eval(f'self.magnet.{axis}_target(current_pos + direction * wiggle_step)')
-            self.magnet.ramp(mode='safe')
-            sleep(waiting_time)
-
-            new_pos = eval(f'self.magnet.{axis}_measured()')
-            new_objective = self.objective()
+            new_pos = self._ramp_and_wait(axis, current_pos + direction * wiggle_step, waiting_time)
+            new_objective = self._measure()
 
             objectives_meas.append(new_objective)
             locations.append(new_pos)
@@ -125,10 +136,7 @@ class FieldAligner(object):
                 current_objective = new_objective
                 current_pos = new_pos
 
-        r_meas, theta_meas, phi_meas = self.magnet_components_sph()
-        if r_meas > 2e-3:  # at low fields the angles are poorly defined due to noise
-            self.theta = theta_meas
-            self.phi = phi_meas
+        self._update_angles()
 
         optimum = objectives_meas[-1]
 
@@ -142,6 +150,8 @@ class FieldAligner(object):
         extra = {"objectives": objectives_meas, "fields": locations}
 
         if plot:
+            import matplotlib.pyplot as plt
+
             plt_xs = np.array(extra["fields"])
             plt_ys = np.array(extra["objectives"])
             plt.figure()
@@ -156,6 +166,251 @@ class FieldAligner(object):
         else:
             return optimum
 
+    def optimize_axis_parabola(
+        self,
+        axis,
+        step=200e-6,
+        resolution=20e-6,
+        approach_direction=1,
+        backlash=None,
+        max_amplitude=10e-3,
+        max_iterations=3,
+        waiting_time=3,
+        return_extra=False,
+        verbose=False,
+    ):
+        """At fixed magnitude of the other two axes, maximizes the objective by fitting a parabola to it.
+        Close to alignment the objective (e.g. a resonator frequency) decreases quadratically with the
+        perpendicular field, so three points around the present field suffice to estimate the optimum, after
+        which the field is set there directly and the objective is verified, refining the estimate with the
+        verification point. Typically this takes 4 to 5 objective evaluations, against 10 to 20 or more for the
+        wiggling of `optimize_axis` (see benchmarks/bench_field_aligner.py).
+
+        To deal with hysteresis, every field is approached from the same side: when the field has to move
+        against `approach_direction`, it first overshoots by `backlash` and then steps back.
+
+        Args:
+        axis (str): Axis to optimize.
+        step (T): Distance between the points of the parabola. It should be large enough that the change in
+        objective over a step clearly exceeds its noise.
+        resolution (T): The resolution of the magnet source used.
+        Fields set will be rounded to an integer multiple of this number.
+        approach_direction: 1 to approach every field from below, -1 from above.
+        backlash (T): overshoot used to approach a field from the right side. Defaults to `step`.
+        max_amplitude (T): The largest (absolute) value of the field along the axis that can be set.
+        Outside of this range the procedure will abort.
+        max_iterations (int): Number of times the parabola is re-measured around a new center when the
+        optimum lies outside of the measured points.
+        waiting_time (s): Amount of time waited after setting the field before continuing.
+        return_extra (boolean): If `True`, this method will return additional
+        data as a dictionary.
+        verbose (boolean): toggles print statements during optimization
+
+        Returns:
+        The optimal objective value found.
+        If `return_extra=True`, this method returns a tuple of the optimal objective
+        and a dictionary containing diagnostic data.
+
+        """
+        if backlash is None:
+            backlash = step
+        step = resolution * max(1, round(float(step) / resolution))
+        objectives_meas = []
+        locations = []
+
+        def evaluate(target):
+            target = resolution * round(float(target) / resolution)
+            if abs(target) > max_amplitude:
+                raise Exception("Axis magnitude limit reached.")
+            if verbose:
+                print("Measuring at {0:.4f} mT".format(target * 1e3))
+            locations.append(self._approach_and_wait(axis, target, approach_direction, backlash, waiting_time))
+            objectives_meas.append(self._measure())
+            return objectives_meas[-1]
+
+        center = getattr(self.magnet, f"{axis}_measured")()
+        vertex = None
+        for iteration in range(max_iterations):
+            for offset in np.array([-step, 0, step])[::approach_direction]:
+                evaluate(center + offset)
+
+            # fit on the points around the present center, relative to it for numerical stability
+            near = np.abs(np.array(locations) - center) <= 1.5 * step
+            a, b, _ = np.polyfit(np.array(locations)[near] - center, np.array(objectives_meas)[near], 2)
+            best = locations[int(np.argmax(objectives_meas))]
+
+            if a < 0 and abs(b / (2 * a)) <= 2 * step:
+                vertex = center - b / (2 * a)
+                break
+            elif a < 0:
+                if verbose:
+                    print("Optimum outside of the measured points, moving the parabola")
+                center = center + np.clip(-b / (2 * a), -3 * step, 3 * step)
+            else:
+                if verbose:
+                    print("No maximum found, moving towards the best point")
+                if abs(best - center) < step / 2:
+                    step = 2 * step  # the curvature is hidden by noise
+                else:
+                    center = best + 2 * step * np.sign(best - center)
+
+        if vertex is not None:
+            optimum = evaluate(vertex)
+            # refit including the verification point; the fit averages out noise, so it is trusted over
+            # the single best measured point
+            near = np.abs(np.array(locations) - center) <= 2 * step
+            a, b, _ = np.polyfit(np.array(locations)[near] - center, np.array(objectives_meas)[near], 2)
+            if a < 0 and abs(b / (2 * a)) <= 2 * step and abs(center - b / (2 * a) - vertex) > resolution:
+                vertex = center - b / (2 * a)
+                optimum = evaluate(vertex)
+        else:
+            best = int(np.argmax(objectives_meas))
+            self._approach_and_wait(axis, locations[best], approach_direction, backlash, waiting_time)
+            optimum = objectives_meas[best]
+
+        self._update_angles()
+        final_pos = getattr(self.magnet, f"{axis}_measured")()
+
+        print(
+            "Optimization finished after {} steps".format(len(objectives_meas)),
+            "\nTarget value from {0:.4f} GHz to ".format(objectives_meas[0] / 1e9)
+            + "{0:.4f} GHz".format(optimum / 1e9),
+            "\nFinal field = {0:.3f} mT".format(final_pos * 1e3),
+        )
+
+        extra = {"objectives": objectives_meas, "fields": locations, "vertex": vertex}
+
+        if return_extra:
+            return optimum, extra
+        else:
+            return optimum
+
+    def optimize_angles(
+        self,
+        r=None,
+        step=0.05,
+        max_iterations=3,
+        max_field_strength=1.5,
+        waiting_time=3,
+        return_extra=False,
+        verbose=False,
+    ):
+        """At fixed magnitude, maximizes the objective over both angles (theta, phi) at once by fitting a
+        paraboloid to it, instead of optimizing the axes one after the other. Six points around the present
+        angles determine the paraboloid, after which the field is rotated to its top and the objective is
+        verified, refining the estimate with the verification point. `self.theta` and `self.phi` are set to the
+        optimum at the end.
+
+        The angles are varied in local coordinates (d_theta, sin(theta) * d_phi), such that a step
+        rotates the field by the same angle in both directions.
+
+        Args:
+        r (T): magnitude of the field. Defaults to the present magnitude.
+        step (deg): rotation between the points of the paraboloid. It should be large enough that the change
+        in objective over a step clearly exceeds its noise.
+        max_iterations (int): Number of times the paraboloid is re-measured around a new center when the
+        optimum lies outside of the measured points.
+        max_field_strength (T): maximum magnetic field strength
+        waiting_time (s): Amount of time waited after setting the field before continuing.
+        return_extra (boolean): If `True`, this method will return additional
+        data as a dictionary.
+        verbose (boolean): toggles print statements during optimization
+
+        Returns:
+        The optimal objective value found.
+        If `return_extra=True`, this method returns a tuple of the optimal objective
+        and a dictionary containing diagnostic data.
+
+        """
+        r_meas, theta_meas, phi_meas = self.magnet_components_sph()
+        if r is None:
+            r = r_meas
+        if r > max_field_strength:
+            raise Exception("Target field exceeds max field strength.")
+        theta0, phi0 = getattr(self, "theta", theta_meas), getattr(self, "phi", phi_meas)
+        phi_scale = 1 / max(np.sin(np.radians(theta0)), 1e-3)
+
+        objectives_meas = []
+        locations = []
+
+        def evaluate(u, v):
+            if verbose:
+                print("Measuring at theta = {0:.4f} deg, phi = {1:.4f} deg".format(theta0 + u, phi0 + v * phi_scale))
+            self._rotate_and_wait(r, theta0 + u, phi0 + v * phi_scale, waiting_time)
+            locations.append((u, v))
+            objectives_meas.append(self._measure())
+            return objectives_meas[-1]
+
+        def fit(center, radius):
+            # objective = c + g.d + d.H.d / 2, with d the offset from center
+            uv = np.array(locations) - center
+            near = np.max(np.abs(uv), axis=1) <= radius
+            du, dv = uv[near].T
+            design = np.column_stack([np.ones_like(du), du, dv, du ** 2 / 2, dv ** 2 / 2, du * dv])
+            coefficients = np.linalg.lstsq(design, np.array(objectives_meas)[near], rcond=None)[0]
+            g = coefficients[1:3]
+            H = np.array([[coefficients[3], coefficients[5]], [coefficients[5], coefficients[4]]])
+            return g, H
+
+        center = np.zeros(2)
+        vertex = None
+        pattern = step * np.array([[0, 0], [1, 0], [1, 1], [0, 1], [-1, 0], [0, -1]])
+        for iteration in range(max_iterations):
+            for offset in pattern:
+                evaluate(*(center + offset))
+
+            g, H = fit(center, 1.5 * step)
+            best = np.array(locations[int(np.argmax(objectives_meas))])
+            if np.all(np.linalg.eigvalsh(H) < 0):
+                shift = -np.linalg.solve(H, g)
+                if np.max(np.abs(shift)) <= 2 * step:
+                    vertex = center + shift
+                    break
+                if verbose:
+                    print("Optimum outside of the measured points, moving the paraboloid")
+                center = center + np.clip(shift, -3 * step, 3 * step)
+            else:
+                if verbose:
+                    print("No maximum found, moving towards the best point")
+                if np.max(np.abs(best - center)) < step / 2:
+                    step = 2 * step  # the curvature is hidden by noise
+                    pattern = 2 * pattern
+                else:
+                    center = best + 2 * step * np.sign(best - center)
+
+        if vertex is not None:
+            optimum = evaluate(*vertex)
+            g, H = fit(center, 2 * step)
+            if np.all(np.linalg.eigvalsh(H) < 0):
+                shift = -np.linalg.solve(H, g)
+                if np.max(np.abs(shift)) <= 2 * step and np.max(np.abs(center + shift - vertex)) > step / 10:
+                    vertex = center + shift
+                    optimum = evaluate(*vertex)
+        else:
+            vertex = np.array(locations[int(np.argmax(objectives_meas))])
+            self._rotate_and_wait(r, theta0 + vertex[0], phi0 + vertex[1] * phi_scale, waiting_time)
+            optimum = max(objectives_meas)
+
+        self.theta = theta0 + vertex[0]
+        self.phi = phi0 + vertex[1] * phi_scale
+
+        print(
+            "Optimization finished after {} steps".format(len(objectives_meas)),
+            "\nTarget value from {0:.4f} GHz to ".format(objectives_meas[0] / 1e9)
+            + "{0:.4f} GHz".format(optimum / 1e9),
+            "\nFinal angles: theta = {0:.4f} deg, phi = {1:.4f} deg".format(self.theta, self.phi),
+        )
+
+        extra = {
+            "objectives": objectives_meas,
+            "angles": [(theta0 + u, phi0 + v * phi_scale) for u, v in locations],
+        }
+
+        if return_extra:
+            return optimum, extra
+        else:
+            return optimum
+
     def optimize_and_ramp_r(
         self,
         rs,
@@ -166,8 +421,12 @@ class FieldAligner(object):
         optimize_strategy=None,
         optimize_at=None,
         reoptimization_threshold=None,
+        prediction_tolerance=None,
+        prediction_points=3,
+        max_check_interval=16,
         waiting_time=3,
         max_field_strength=1.5,
+        optimizer="wiggle",
         return_extra=True,
         verbose=True,
         **kwargs,
@@ -183,12 +442,16 @@ class FieldAligner(object):
         axis (str): axis used to optimize field
         optimize_first (boolean): Whether to
         optimize the field after ramping to the first field value. 
-        optimize_strategy (str): four options are implemented:
+        optimize_strategy (str): five options are implemented:
         `objective_decrease` optimizes the alignment if the objective
         has decreased by more than `reoptimization_threshold` since the last
         call to `optimize_axis`. 
         `optimize_at_fields` aligns only if the field is in the array `optimize_at`.
         `always` aligns every time after the field has been ramped
+        `predictive` extrapolates the optimal angles linearly in r from the previous optima and ramps
+        directly to the predicted direction. The alignment is optimized to check the prediction at
+        intervals that double (up to `max_check_interval` fields) as long as the optimum is within
+        `prediction_tolerance` of the prediction, and shrink back to every field when it is not.
         And finally, if `None` is chosen, the alignment is never optimized.
 
         optimize_at (T): single value or array of values at which the alignment will be optimized if
@@ -196,8 +459,14 @@ class FieldAligner(object):
         reoptimization_threshold (GHz): Value against which the change in objective is
         compared in order to establish if the field has to be aligned if
         `optimize_strategy` = `objective_decrease`.
+        prediction_tolerance (deg): largest angle between the predicted and optimized field direction for
+        which the prediction is trusted if `optimize_strategy` = `predictive`.
+        prediction_points (int): number of previous optima used for the prediction.
+        max_check_interval (int): largest number of fields between two checks of the prediction.
         waiting_time (s): Amount of time waited after
         sweeping the field before continuing.
+        optimizer (str): `wiggle` uses `optimize_axis`, `parabola` uses `optimize_axis_parabola`,
+        `paraboloid` uses `optimize_angles`, which aligns both angles at once and ignores `axis`.
         return_extra (boolean): If `True`, this method will return additional
         data as a dictionary.
         verbose (boolean): toggles print statements during optimization and
@@ -226,10 +495,27 @@ class FieldAligner(object):
                     "You need to specify at which fields to optimize when using the `optimize_at_fields` option."
                 )
             optimize_at = np.atleast_1d(optimize_at) #if single number, make into array of single number
+        elif optimize_strategy == "predictive":
+            if prediction_tolerance is None:
+                raise Exception(
+                    "You need to specify a prediction_tolerance when using the `predictive` option."
+                )
+        optimizers = {
+            "wiggle": self.optimize_axis,
+            "parabola": self.optimize_axis_parabola,
+            # both angles at once; axis is not used
+            "paraboloid": lambda axis, **kwargs: self.optimize_angles(max_field_strength=max_field_strength, **kwargs),
+        }
+        if optimizer not in optimizers:
+            raise ValueError(f"Unknown optimizer {optimizer}, choose from {list(optimizers)}.")
+        optimize = optimizers[optimizer]
 
         extra = {}
         objective_history = []
         optima_history = []
+        fitted_optima = []  # (r, theta, phi) of every optimization, for the `predictive` strategy
+        residual_history = []
+        check_interval, since_check = 1, 0
 
         self.theta = initial_theta
         self.phi = initial_phi
@@ -244,6 +530,10 @@ class FieldAligner(object):
             objective_history.append(current_objective)
             optima_history.append([self.theta, self.phi])
 
+            if optimize_strategy == "predictive" and fitted_optima:
+                self.theta, self.phi = self._predict_angles(fitted_optima[-prediction_points:], r)
+            predicted = (self.theta, self.phi)
+
             new_x = r * np.sin(np.radians(self.theta)) * np.cos(np.radians(self.phi))
             new_y = r * np.sin(np.radians(self.theta)) * np.sin(np.radians(self.phi))
             new_z = r * np.cos(np.radians(self.theta))
@@ -260,14 +550,14 @@ class FieldAligner(object):
             self.magnet.y_target(new_y)
             self.magnet.z_target(new_z)
             self.magnet.ramp(mode='safe')
-            sleep(waiting_time)
+            self._wait(waiting_time)
             if verbose:
                 print(f"Sweep finished.")
-            new_objective = self.objective()
+            new_objective = self._measure()
 
             if optimize_first and ii == 0:
                 print("First iteration, optimizing.")
-                current_objective = self.optimize_axis(
+                current_objective = optimize(
                     axis=axis, 
                     verbose=verbose,
                     return_extra=False,
@@ -275,6 +565,7 @@ class FieldAligner(object):
                     **kwargs,
                 )
                 self.last_optimized = current_objective
+                fitted_optima.append((r, self.theta, self.phi))
 
             elif optimize_strategy == "objective_decrease":
                 distance = self.last_optimized - new_objective
@@ -287,7 +578,7 @@ class FieldAligner(object):
                     print(
                         f"Current and previous objectives differ by {distance}, thus re-optimizing."
                     )
-                    current_objective = self.optimize_axis(
+                    current_objective = optimize(
                         axis=axis, 
                         verbose=verbose,
                         return_extra=False,
@@ -299,7 +590,7 @@ class FieldAligner(object):
             elif optimize_strategy == "optimize_at_fields":
                 if np.any(np.isclose(r, optimize_at, atol=5e-4)):
                     print(f"Current field is in `optimize_at`, thus re-optimizing.")
-                    current_objective = self.optimize_axis(
+                    current_objective = optimize(
                         axis=axis, 
                         verbose=verbose,
                         return_extra=False,
@@ -309,9 +600,31 @@ class FieldAligner(object):
                 else:
                     current_objective = new_objective
 
+            elif optimize_strategy == "predictive":
+                since_check += 1
+                if len(fitted_optima) < 2 or since_check >= check_interval:
+                    current_objective = optimize(
+                        axis=axis,
+                        verbose=verbose,
+                        return_extra=False,
+                        waiting_time=waiting_time,
+                        **kwargs,
+                    )
+                    residual = self._angle_between(predicted, (self.theta, self.phi))
+                    residual_history.append([r, residual])
+                    fitted_optima.append((r, self.theta, self.phi))
+                    since_check = 0
+                    if residual <= prediction_tolerance:
+                        check_interval = min(2 * check_interval, max_check_interval)
+                    else:
+                        check_interval = 1
+                    print(f"Prediction off by {residual:.4f} deg, next check in {check_interval} field(s).")
+                else:
+                    current_objective = new_objective
+
             elif optimize_strategy == "always":
                 print("Optimizing.")
-                current_objective = self.optimize_axis(
+                current_objective = optimize(
                     axis=axis, 
                     verbose=verbose,
                     return_extra=False,
@@ -327,11 +640,94 @@ class FieldAligner(object):
                 "rs": rs,
                 "objectives": objective_history,
                 "optima": optima_history,
+                "prediction_residuals": residual_history,
             }
             return objective_history[-1], extra
         else:
             return objective_history[-1]
 
+    def _ramp_and_wait(self, axis, value, waiting_time):
+        """Ramps a single axis to value, waits and returns the measured field along the axis."""
+        getattr(self.magnet, f"{axis}_target")(value)
+        self.magnet.ramp(mode='safe')
+        self._wait(waiting_time)
+        return getattr(self.magnet, f"{axis}_measured")()
+
+    def _rotate_and_wait(self, r, theta, phi, waiting_time):
+        """Ramps the field to (r, theta, phi) and waits."""
+        self.magnet.x_target(r * np.sin(np.radians(theta)) * np.cos(np.radians(phi)))
+        self.magnet.y_target(r * np.sin(np.radians(theta)) * np.sin(np.radians(phi)))
+        self.magnet.z_target(r * np.cos(np.radians(theta)))
+        self.magnet.ramp(mode='safe')
+        self._wait(waiting_time)
+
+    def _approach_and_wait(self, axis, value, direction, backlash, waiting_time):
+        """As `_ramp_and_wait`, but first overshoots by backlash if needed such that value is approached in direction."""
+        if direction * (value - getattr(self.magnet, f"{axis}_measured")()) < 0:
+            self._ramp_and_wait(axis, value - direction * backlash, 0)
+        return self._ramp_and_wait(axis, value, waiting_time)
+
+    def _wait(self, waiting_time):
+        """Waits for the objective to settle after a ramp, for at most waiting_time. Without a
+        settle_tolerance this simply sleeps for waiting_time. The time waited is kept in self.settle_times.
+        If the settle objective is the objective, its last sample is kept for `_measure`.
+        """
+        self._settled_objective = None
+        if waiting_time <= 0:
+            return
+        if self.settle_tolerance is None:
+            sleep(waiting_time)
+            self.settle_times.append(waiting_time)
+            return
+
+        settle_objective = self.objective if self.settle_objective is None else self.settle_objective
+        start = monotonic()
+        previous = settle_objective()
+        nsettled = 0
+        while monotonic() - start < waiting_time:
+            sleep(min(self.settle_interval, max(0, waiting_time - (monotonic() - start))))
+            value = settle_objective()
+            nsettled = nsettled + 1 if abs(value - previous) <= self.settle_tolerance else 0
+            previous = value
+            if nsettled >= self.settle_samples:
+                break
+        self.settle_times.append(monotonic() - start)
+        if self.settle_objective is None:
+            self._settled_objective = previous
+
+    def _measure(self):
+        """Measures the objective at the present point, reusing the last sample taken while settling if any."""
+        value, self._settled_objective = self._settled_objective, None
+        return self.objective() if value is None else value
+
+    @staticmethod
+    def _predict_angles(optima, r):
+        """Extrapolates theta and phi linearly in r from a list of (r, theta, phi) optima."""
+        rs, thetas, phis = np.array(optima, dtype=float).T
+        phis = np.degrees(np.unwrap(np.radians(phis)))  # continuous through 0 = 360 degrees
+        if len(optima) < 2 or np.ptp(rs) == 0:
+            return thetas.mean(), phis.mean() % 360
+        theta = np.polyval(np.polyfit(rs, thetas, 1), r)
+        phi = np.polyval(np.polyfit(rs, phis, 1), r)
+        return float(np.clip(theta, 0, 180)), float(phi % 360)
+
+    @staticmethod
+    def _angle_between(angles_1, angles_2):
+        """Angle in degrees between the directions given by two (theta, phi) pairs."""
+        vectors = [
+            [np.sin(np.radians(theta)) * np.cos(np.radians(phi)),
+             np.sin(np.radians(theta)) * np.sin(np.radians(phi)),
+             np.cos(np.radians(theta))]
+            for theta, phi in [angles_1, angles_2]
+        ]
+        return np.degrees(np.arccos(np.clip(np.dot(*vectors), -1, 1)))
+
+    def _update_angles(self):
+        r_meas, theta_meas, phi_meas = self.magnet_components_sph()
+        if r_meas > 2e-3:  # at low fields the angles are poorly defined due to noise
+            self.theta = theta_meas
+            self.phi = phi_meas
+
     def magnet_components_sph(self):
         """Return the x, y, z component of the magnet, convert to spherical using the
         ISO 80000-2:2009 physics convention for the (r, theta, phi)
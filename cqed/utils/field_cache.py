@@ -0,0 +1,57 @@
+"""
+A cache for the measured magnetic field, such that the field is read back from the instruments once after every ramp
+instead of by every function that needs it.
+
+"""
+
+from threading import Lock
+from time import monotonic
+import numpy as np
+
+
+class FieldCache:
+    """
+    Keeps the last field read back by `read` and returns it until it is invalidated (by a ramp) or older than max_age.
+    Counts the readbacks, such that the number of instrument reads per sweep point can be monitored.
+
+    args:
+    read (callable): function without arguments returning the measured field (x, y, z)
+    max_age (s): time after which a cached field is read again. If None, it stays valid until invalidated.
+    """
+
+    def __init__(self, read, max_age=None):
+        self._read = read
+        self.max_age = max_age
+        self.readbacks = 0
+        self.hits = 0
+        self._field = None
+        self._time = None
+        self._lock = Lock()
+
+    def read(self):
+        """Reads the field from the instruments, stores it and returns it."""
+        field = np.array(self._read(), dtype=float)
+        with self._lock:
+            self._field, self._time = field, monotonic()
+            self.readbacks += 1
+        return field.copy()
+
+    def get(self):
+        """Returns the cached field if it is valid, otherwise reads it."""
+        with self._lock:
+            if self._field is not None and (self.max_age is None or monotonic() - self._time < self.max_age):
+                self.hits += 1
+                return self._field.copy()
+        return self.read()
+
+    def invalidate(self):
+        """Marks the cached field as outdated, e.g. when a ramp starts."""
+        with self._lock:
+            self._field = None
+
+    def reset_counts(self):
+        """Returns the number of readbacks since the last reset and resets the counters."""
+        with self._lock:
+            readbacks = self.readbacks
+            self.readbacks, self.hits = 0, 0
+        return readbacks
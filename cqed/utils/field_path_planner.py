@@ -0,0 +1,155 @@
+"""
+Planning of the path the magnetic field takes through the points of a sweep. Pure computation, such that the
+expected ramp time of a sweep can be known (and minimized) before it is run, without instruments.
+
+"""
+
+from itertools import permutations
+import numpy as np
+
+
+def spherical_to_cartesian(r, theta, phi):
+    """ Convert (r, theta, phi) to (x, y, z) using the ISO 80000-2:2009 physics convention, as in
+    cqed.custom_pysweep_functions.magnet. Angles are in degrees; inputs can be arrays.
+    Returns an array of shape (..., 3).
+    """
+    r, theta, phi = np.broadcast_arrays(r, np.radians(theta), np.radians(phi))
+    return np.stack([r * np.sin(theta) * np.cos(phi),
+                     r * np.sin(theta) * np.sin(phi),
+                     r * np.cos(theta)], axis=-1)
+
+
+def serpentine_order(n_outer, n_inner):
+    """ Indices (outer, inner) of a 2D map in serpentine order: the inner sweep is reversed on every other
+    outer point, such that the field never has to ramp back to the start of the inner sweep.
+    Returns two arrays of length n_outer * n_inner.
+    """
+    outer = np.repeat(np.arange(n_outer), n_inner)
+    inner = np.tile(np.arange(n_inner), (n_outer, 1))
+    inner[1::2] = inner[1::2, ::-1]
+    return outer, inner.ravel()
+
+
+def axis_order(start, stop, field_limits):
+    """ Order in which to ramp the axes from start to stop one by one, such that all intermediate fields
+    satisfy field_limits(Bx, By, Bz), which returns True for a safe field. Like the magnet drivers, the
+    smallest changes go first when possible. Used by the 'safe' ramp of cqed.utils.custom_magnet.CustomMagnet.
+    Returns a list of axis indices; raises a ValueError if no order is safe.
+    """
+    start, stop = np.asarray(start, dtype=float), np.asarray(stop, dtype=float)
+    preferred = tuple(np.argsort(np.abs(stop - start)))
+    for order in [preferred] + list(permutations(range(3))):
+        field = start.copy()
+        safe = True
+        for axis in order:
+            field[axis] = stop[axis]
+            safe = safe and bool(field_limits(*field))
+        if safe:
+            return [int(axis) for axis in order]
+    raise ValueError("No axis order from {} to {} stays within the field limits.".format(start, stop))
+
+
+class FieldPathPlanner:
+    """ Estimates and minimizes the time needed to ramp the field through a list of points.
+
+    args:
+    ramp_rates (T/s): ramp rate of the x, y and z axis
+    max_field_strength (T): radius of the sphere the field has to stay within
+    mode (str): ramp mode of the magnet, 'safe' (axis by axis) or 'simul_block' (all axes at once)
+    overhead (s): fixed time per move, e.g. for communication and settling
+    """
+
+    def __init__(self, ramp_rates, max_field_strength=1.5, mode="simul_block", overhead=0.0):
+        if mode not in ["safe", "simul_block"]:
+            raise ValueError('Invalid ramp mode. Please provide either "safe" or "simul_block".')
+        self.ramp_rates = np.broadcast_to(np.asarray(ramp_rates, dtype=float), (3,))
+        self.max_field_strength = max_field_strength
+        self.mode = mode
+        self.overhead = overhead
+
+    def move_times(self, starts, stops):
+        """ Time needed to ramp from every start to the corresponding stop; arrays of shape (..., 3).
+        """
+        axis_times = np.abs(np.asarray(stops) - np.asarray(starts)) / self.ramp_rates
+        if self.mode == "safe":
+            times = axis_times.sum(axis=-1)
+        else:
+            times = axis_times.max(axis=-1)
+        return np.where(times > 0, times + self.overhead, 0)
+
+    def path_time(self, points, start=None):
+        """ Total time needed to ramp through the points, shape (N, 3), in the given order,
+        starting from the field `start` if given.
+        """
+        points = np.atleast_2d(points)
+        if start is not None:
+            points = np.vstack([start, points])
+        return float(np.sum(self.move_times(points[:-1], points[1:])))
+
+    def axis_order(self, start, stop):
+        """ Order in which to ramp the axes from start to stop in 'safe' mode such that all intermediate
+        fields stay within max_field_strength. See the function axis_order.
+        """
+        return axis_order(start, stop,
+                          lambda Bx, By, Bz: np.sqrt(Bx ** 2 + By ** 2 + Bz ** 2) <= self.max_field_strength)
+
+    def check(self, points):
+        """ Raise a ValueError if any of the points lies outside max_field_strength.
+        """
+        norms = np.linalg.norm(np.atleast_2d(points), axis=-1)
+        if np.any(norms > self.max_field_strength):
+            raise ValueError("Field of {:.4f} T exceeds the maximum of {} T.".format(
+                norms.max(), self.max_field_strength))
+
+    def order_points(self, points, start=None, max_passes=10):
+        """ Order in which to visit the points, shape (N, 3), to minimize the total ramp time.
+        A nearest-neighbour path is improved by 2-opt moves (reversing sub-paths).
+
+        Returns an index array; points[order] is the planned path.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        n = len(points)
+        if n < 3:
+            return np.arange(n)
+        costs = self.move_times(points[:, None, :], points[None, :, :])
+
+        if start is None:
+            current = 0
+        else:
+            current = int(np.argmin(self.move_times(np.asarray(start)[None, :], points)))
+        order = [current]
+        unvisited = np.ones(n, dtype=bool)
+        unvisited[current] = False
+        for _ in range(n - 1):
+            candidates = np.where(unvisited, costs[current], np.inf)
+            current = int(np.argmin(candidates))
+            order.append(current)
+            unvisited[current] = False
+        order = np.array(order)
+
+        # 2-opt on the open path: reversing order[i:j+1] replaces edges (i-1, i) and (j, j+1)
+        for _ in range(max_passes):
+            improved = False
+            for i in range(1, n - 1):
+                a, b = order[i - 1], order[i]
+                c = order[i:]
+                d = np.append(order[i + 1:], -1)
+                gain = costs[a, b] - costs[a, c]
+                gain = gain + np.where(d >= 0, costs[c, d] - costs[b, d], 0)
+                j = int(np.argmax(gain))
+                if gain[j] > 1e-12:
+                    order[i:i + j + 1] = order[i:i + j + 1][::-1]
+                    improved = True
+            if not improved:
+                break
+        return order
+
+    def grid_path(self, grid, serpentine=True):
+        """ Flatten a 2D field map of shape (n_outer, n_inner, 3) into the list of points it visits,
+        in serpentine order if requested.
+        """
+        grid = np.asarray(grid)
+        outer, inner = serpentine_order(*grid.shape[:2])
+        if not serpentine:
+            inner = np.tile(np.arange(grid.shape[1]), grid.shape[0])
+        return grid[outer, inner]
@@ -9,7 +9,8 @@ Would be good to identify some other options, but ultimately it will depend on t
 """
 
 import numpy as np
-from scipy import signal
+
+# scipy.signal takes long to import, and is imported by the functions that use it
 
 def _dip_to_peak(ys):
     """ 
@@ -22,13 +23,78 @@ def _dip_to_peak(ys):
 def _round_up_to_odd(f):
     return int(np.ceil(f) // 2 * 2 + 1)
 
+def _savgol_window_length(fs, window):
+    """
+    Length in points of the savgol filter for a filter window in units of fs.
+    """
+    min_peakwidth = window / (fs[1] - fs[0])
+    return max(_round_up_to_odd(min_peakwidth * 3), 3) #window length must be odd and >= polyorder
+
 def _convert_to_dBm(ys):
     """ 
     Converts linear amplitude into dBm.
     """
     return 20 * np.log10(ys)
 
-def find_peak_literal(fs, ys, dip=False, dBm=False):
+def refine_peak(fs, ys, index, method="parabolic", half_width=None, noise=None):
+    """ 
+    Locates a peak between the points of a trace by fitting the points around its maximum.
+
+    `parabolic` fits a parabola to the points, which is exact for the top of any smooth peak when the
+    points are close enough. `lorentzian` uses that 1 / (y - baseline) of a Lorentzian peak is a parabola,
+    which stays exact also when only a few points cover the resonance. It requires a linear (not dB) peak
+    on the median of the trace as baseline; for dips, use `_dip_to_peak` first.
+
+    fs (any): array of x values
+    ys (any): array of y values
+    index (int): index of the maximum, e.g. from one of the peak finders
+    method (str): `parabolic` or `lorentzian`
+    half_width (int): number of points used on either side of index. Defaults to 1 for `parabolic`
+    and 2 for `lorentzian`.
+    noise (same unit as ys): noise of ys. If None, estimated from the point to point differences of ys.
+
+    returns:
+    the refined value of fs at the peak and its uncertainty (NaN if the fit fails)
+    """
+    fs, ys = np.asarray(fs, dtype=float), np.asarray(ys, dtype=float)
+    if half_width is None:
+        half_width = 1 if method == "parabolic" else 2
+    if noise is None:
+        noise = np.median(np.abs(np.diff(ys))) / (0.6745 * np.sqrt(2))  # robust std of the noise
+    noise = max(noise, np.finfo(float).tiny)
+
+    lo, hi = max(index - half_width, 0), min(index + half_width + 1, len(ys))
+    if hi - lo < 3:
+        return fs[index], np.nan
+    step = fs[1] - fs[0]
+    x = (fs[lo:hi] - fs[index]) / step  # in units of the step, for numerical stability
+    y = ys[lo:hi]
+
+    if method == "parabolic":
+        z, sigma, sign = y, np.full_like(y, noise), -1
+    elif method == "lorentzian":
+        height = y - np.median(ys)
+        if np.any(height <= 0):
+            return fs[index], np.nan
+        z, sigma, sign = 1 / height, noise / height ** 2, 1
+    else:
+        raise ValueError(f"Unknown method {method}, choose `parabolic` or `lorentzian`.")
+
+    # weighted least squares fit of z = a x^2 + b x + c
+    design = np.vander(x, 3) / sigma[:, None]
+    cov = np.linalg.pinv(design.T @ design)
+    a, b, _ = cov @ design.T @ (z / sigma)
+    if sign * a <= 0:  # no maximum of y
+        return fs[index], np.nan
+
+    x0 = -b / (2 * a)
+    gradient = np.array([b / (2 * a ** 2), -1 / (2 * a), 0])
+    uncertainty = np.sqrt(gradient @ cov @ gradient) * abs(step)
+    if not x[0] <= x0 <= x[-1]:
+        return fs[index], np.nan
+    return fs[index] + x0 * step, uncertainty
+
+def find_peak_literal(fs, ys, dip=False, dBm=False, refine=None, return_uncertainty=False):
     """ 
     Finds the frequency belonging to the literal maximal amplitude of a trace.
 
@@ -36,6 +102,9 @@ def find_peak_literal(fs, ys, dip=False, dBm=False):
     ys (any) array of y values
     dip (boolean): change dips into peaks
     dBm (boolean): convert linear amplitude to dBm
+    refine (str): if given, the maximum is located between the points with `refine_peak` using this method,
+    `parabolic` or `lorentzian`. This allows for coarser traces at the same precision.
+    return_uncertainty (boolean): also return the uncertainty of the refined value (NaN without refine)
     
     returns:
     value of fs that corresponds to the maximum of ys
@@ -46,10 +115,18 @@ def find_peak_literal(fs, ys, dip=False, dBm=False):
     if dBm==True:
         ys = _convert_to_dBm(ys)
 
-    return fs[np.argmax(ys)]
+    index = np.argmax(ys)
+    if refine is None:
+        resfreq, uncertainty = fs[index], np.nan
+    else:
+        resfreq, uncertainty = refine_peak(fs, ys, index, method=refine)
 
+    if return_uncertainty:
+        return resfreq, uncertainty
+    return resfreq
 
-def find_peak_filtered(fs, ys, window=1e6, prominence=4):
+
+def find_peak_filtered(fs, ys, window=1e6, prominence=4, refine=None, return_uncertainty=False):
 
     """ Taking the maximum of a trace to find a resonance is prone to noise. 
     We therefore filter the data based on a savgol filter with a window not 
@@ -61,16 +138,20 @@ def find_peak_filtered(fs, ys, window=1e6, prominence=4):
     ys (any) array of y values
     window (same unit as fs): window used to filter data. Should not be larger than resonance linewidth of interest.
     prominence (same unit as ys): the topographic prominense a peak needs to have to be considered a peak. 
+    refine (str): if given, the peak is located between the points with `refine_peak` on the unfiltered ys,
+    using this method, `parabolic` or `lorentzian`.
+    return_uncertainty (boolean): also return the uncertainty of the refined value (NaN without refine)
     
     returns:
     value of fs that corresponds to the identified maximum in ys
     Needs testing. 
     """
 
-    min_peakwidth = window / (fs[1] - fs[0])
-    yhat = signal.savgol_filter(ys, max(_round_up_to_odd(min_peakwidth * 3), 3), 2) #window length must be odd and >= polyorder
+    from scipy import signal
+    yhat = signal.savgol_filter(ys, _savgol_window_length(fs, window), 2)
     peaks, _ = signal.find_peaks(yhat, prominence=prominence)
 
+    uncertainty = np.nan
     if len(peaks) == 0:
         resfreq = None
     elif len(peaks) > 1:
@@ -79,4 +160,199 @@ def find_peak_filtered(fs, ys, window=1e6, prominence=4):
     else:
         resfreq = fs[peaks][0]
 
+    if refine is not None and resfreq is not None:
+        index = int(np.argmin(np.abs(fs - resfreq)))
+        resfreq, uncertainty = refine_peak(fs, ys, index, method=refine)
+
+    if return_uncertainty:
+        return resfreq, uncertainty
     return resfreq
+
+
+def find_multiple_peaks_filtered(fs, ys, window=1e6, prominence=4, npeaks=None, dip=False, refine=None):
+    """ 
+    Multi-peak version of `find_peak_filtered`, e.g. for the resonators of a multiplexed chip in one wide trace.
+    The trace is filtered with the same savgol filter, after which every peak with enough prominence is kept.
+
+    args:
+    fs (any): array of x values
+    ys (any) array of y values
+    window (same unit as fs): window used to filter data. Should not be larger than resonance linewidth of interest.
+    prominence (same unit as ys): the topographic prominense a peak needs to have to be considered a peak.
+    npeaks (int): if given, only the npeaks most prominent peaks are returned
+    dip (boolean): look for dips instead of peaks
+    refine (str): if given, every peak is located between the points with `refine_peak` on the unfiltered ys,
+    using this method, `parabolic` or `lorentzian`.
+
+    returns:
+    sorted array of the values of fs that correspond to the identified peaks; empty if none are found
+    """
+    fs, ys = np.asarray(fs), np.asarray(ys)
+    if dip==True:
+        ys = -ys
+    from scipy import signal
+    yhat = signal.savgol_filter(ys, _savgol_window_length(fs, window), 2)
+    peaks, properties = signal.find_peaks(yhat, prominence=prominence)
+
+    if npeaks is not None and len(peaks) > npeaks:
+        peaks = peaks[np.sort(np.argsort(properties["prominences"])[::-1][:npeaks])]
+
+    if refine is None:
+        return fs[peaks]
+    return np.array([refine_peak(fs, ys, index, method=refine)[0] for index in peaks])
+
+
+def find_peaks_literal_batch(fs, ys, dip=False, dBm=False):
+    """ 
+    Batch version of `find_peak_literal` for a set of traces measured on the same frequency grid,
+    e.g. a map of VNA traces versus field.
+
+    fs (array): array of x values, shared by all traces
+    ys (array): n_traces x len(fs) array of y values
+    dip (boolean): look for dips instead of peaks
+    dBm (boolean): convert linear amplitude to dBm
+
+    returns:
+    array with for every trace the value of fs that corresponds to the maximum of ys
+    """
+    fs, ys = np.asarray(fs), np.atleast_2d(ys)
+    if dBm==True:
+        ys = _convert_to_dBm(ys)
+    if dip==True:
+        return fs[np.argmin(ys, axis=-1)]
+    return fs[np.argmax(ys, axis=-1)]
+
+
+def find_peaks_filtered_batch(fs, ys, window=1e6, prominence=4, dip=False):
+    """ 
+    Batch version of `find_peak_filtered` for a set of traces measured on the same frequency grid,
+    e.g. a map of VNA traces versus field. All traces are filtered in a single savgol call, after which
+    the highest local maximum of every trace and its prominence are found at once. Only traces for which
+    that maximum is not prominent enough are passed through `signal.find_peaks` one by one, as a lower
+    peak might still qualify.
+
+    args:
+    fs (array): array of x values, shared by all traces
+    ys (array): n_traces x len(fs) array of y values
+    window (same unit as fs): window used to filter data. Should not be larger than resonance linewidth of interest.
+    prominence (same unit as ys): the topographic prominense a peak needs to have to be considered a peak.
+    dip (boolean): look for dips instead of peaks
+
+    returns:
+    array with for every trace the value of fs that corresponds to the identified maximum in ys,
+    NaN where no peak is found
+    """
+    fs, ys = np.asarray(fs), np.atleast_2d(ys)
+    from scipy import signal
+    yhat = signal.savgol_filter(-ys if dip else ys, _savgol_window_length(fs, window), 2, axis=-1)
+    ntraces, npoints = yhat.shape
+
+    # highest local maximum of every trace; the first point of a plateau, as signal.find_peaks for short plateaus
+    interior = np.full(yhat.shape, -np.inf)
+    is_max = (yhat[:, 1:-1] > yhat[:, :-2]) & (yhat[:, 1:-1] >= yhat[:, 2:])
+    interior[:, 1:-1] = np.where(is_max, yhat[:, 1:-1], -np.inf)
+    peaks = np.argmax(interior, axis=-1)
+    found = np.isfinite(interior[np.arange(ntraces), peaks])
+    heights = yhat[np.arange(ntraces), peaks][:, None]
+
+    # prominence: height above the higher of the minima between the peak and the nearest higher point on either side
+    index = np.arange(npoints)
+    higher = yhat > heights
+    left_edge = np.max(np.where(higher & (index < peaks[:, None]), index, -1), axis=-1)
+    right_edge = np.min(np.where(higher & (index > peaks[:, None]), index, npoints), axis=-1)
+    left_min = np.min(np.where((index > left_edge[:, None]) & (index <= peaks[:, None]), yhat, np.inf), axis=-1)
+    right_min = np.min(np.where((index >= peaks[:, None]) & (index < right_edge[:, None]), yhat, np.inf), axis=-1)
+    prominent = found & (heights[:, 0] - np.maximum(left_min, right_min) >= prominence)
+
+    resfreqs = np.full(ntraces, np.nan)
+    resfreqs[prominent] = fs[peaks[prominent]]
+    for ii in np.nonzero(found & ~prominent)[0]:
+        candidates, _ = signal.find_peaks(yhat[ii], prominence=prominence)
+        if len(candidates) > 0:
+            resfreqs[ii] = fs[candidates[np.argmax(yhat[ii, candidates])]]
+
+    return resfreqs
+
+
+class FilteredPeakFinder:
+    """ 
+    Reusable version of `find_peak_filtered` for tracking loops that find peaks in many traces on the same
+    frequency grid. The savgol filter (including its polynomial fits at the edges, mode 'interp') is planned
+    once for the grid and window and applied as a convolution into a preallocated buffer, and the peak search
+    checks only the highest local maximum before falling back to `signal.find_peaks`.
+
+    Instances are called as `peak_finder(fs, ys)`, so they can be passed as the peak_finder of
+    `measure_resonance_frequency` and `measure_qubit_frequency`. A different grid triggers a new plan.
+
+    args:
+    fs (array): the frequency grid of the traces
+    window (same unit as fs): window used to filter data. Should not be larger than resonance linewidth of interest.
+    prominence (same unit as ys): the topographic prominense a peak needs to have to be considered a peak.
+    refine (str): if given, the peak is located between the points with `refine_peak` using this method.
+    """
+
+    def __init__(self, fs, window=1e6, prominence=4, refine=None):
+        self.window = window
+        self.prominence = prominence
+        self.refine = refine
+        self._plan(fs)
+
+    def _plan(self, fs):
+        self.fs = np.array(fs, dtype=float)
+        npoints = len(self.fs)
+        window_length = _savgol_window_length(self.fs, self.window)
+        if window_length > npoints:
+            raise ValueError("The filter window is longer than the trace.")
+
+        self._half = window_length // 2
+        from scipy import signal
+        self._coeffs = signal.savgol_coeffs(window_length, 2)
+        # the edges are given by a polynomial fit to the first/last window_length points, a linear projection
+        vander = np.vander(np.arange(window_length), 3)
+        projection = vander @ np.linalg.pinv(vander)
+        self._left = projection[:self._half]
+        self._right = projection[window_length - self._half:]
+        self._window_length = window_length
+        self._yhat = np.empty(npoints)
+
+    def filter(self, ys):
+        """ 
+        Applies the planned savgol filter; returns an internal buffer that is overwritten by the next call.
+        """
+        half, window_length, yhat = self._half, self._window_length, self._yhat
+        npoints = len(yhat)
+        yhat[half:npoints - half] = np.convolve(ys, self._coeffs, mode="valid")
+        yhat[:half] = self._left @ ys[:window_length]
+        yhat[npoints - half:] = self._right @ ys[npoints - window_length:]
+        return yhat
+
+    def __call__(self, fs, ys):
+        if len(fs) != len(self.fs) or fs[0] != self.fs[0] or fs[-1] != self.fs[-1]:
+            self._plan(fs)
+        ys = np.asarray(ys, dtype=float)
+        yhat = self.filter(ys)
+
+        is_max = (yhat[1:-1] > yhat[:-2]) & (yhat[1:-1] >= yhat[2:])
+        candidates = np.flatnonzero(is_max) + 1
+        if len(candidates) == 0:
+            return None
+        peak = candidates[np.argmax(yhat[candidates])]
+
+        height = yhat[peak]
+        higher_left = np.flatnonzero(yhat[:peak] > height)
+        higher_right = np.flatnonzero(yhat[peak + 1:] > height)
+        left = higher_left[-1] + 1 if len(higher_left) else 0
+        right = peak + 1 + higher_right[0] if len(higher_right) else len(yhat)
+        base = max(yhat[left:peak + 1].min(), yhat[peak:right].min())
+
+        if height - base < self.prominence:
+            # a lower peak can still be prominent enough
+            from scipy import signal
+            peaks, _ = signal.find_peaks(yhat, prominence=self.prominence)
+            if len(peaks) == 0:
+                return None
+            peak = peaks[np.argmax(yhat[peaks])]
+
+        if self.refine is not None:
+            return refine_peak(self.fs, ys, peak, method=self.refine)[0]
+        return self.fs[peak]
@@ -0,0 +1,98 @@
+"""
+Linking of resonances found in successive traces of a sweep, such that every resonator keeps its label.
+
+The resonances found in a new trace are assigned to the tracked resonators by minimising the total
+distance to their predicted positions (Hungarian algorithm). The prediction extrapolates the last two
+positions of every resonator linearly, which keeps the labels right when resonances move towards each
+other or cross.
+
+"""
+
+import numpy as np
+
+
+def link_peaks(predicted, found, max_shift=np.inf):
+    """
+    Assigns found peaks to predicted positions, minimising the summed distance between them.
+
+    args:
+    predicted (array): predicted positions of the tracked peaks
+    found (array): positions of the peaks found in a new trace, in any order
+    max_shift (same unit as positions): largest allowed distance between a prediction and its peak.
+    Peaks further away from every prediction are left unassigned.
+
+    returns:
+    array with for every prediction the position of its peak, NaN where no peak is assigned
+    """
+    predicted, found = np.asarray(predicted, dtype=float), np.asarray(found, dtype=float)
+    linked = np.full(len(predicted), np.nan)
+    if len(predicted) == 0 or len(found) == 0:
+        return linked
+
+    from scipy.optimize import linear_sum_assignment
+
+    distance = np.abs(predicted[:, None] - found[None, :])
+    allowed = distance <= max_shift
+    # forbidden pairs get a cost above any allowed assignment, and are dropped afterwards
+    cost = np.where(allowed, distance, np.sum(distance[allowed]) + 1)
+    rows, cols = linear_sum_assignment(cost)
+    keep = allowed[rows, cols]
+    linked[rows[keep]] = found[cols[keep]]
+    return linked
+
+
+class PeakLinker:
+    """
+    Tracks a fixed number of resonances through a sweep. Call it with the peaks found in every new trace;
+    it returns them ordered by resonator, with NaN for resonators that were not found. A resonator that
+    is lost is predicted at its last known position until it is found again.
+
+    args:
+    initial (array): initial positions of the resonances. If None, the first call takes the peaks it is
+    given, sorted, and nresonances must be given.
+    nresonances (int): number of tracked resonances, when initial is None
+    max_shift (same unit as positions): largest distance between the prediction and the peak of a resonator
+    between two traces.
+    extrapolate (boolean): predict with a linear extrapolation of the last two positions, rather than
+    the last position.
+    """
+
+    def __init__(self, initial=None, nresonances=None, max_shift=np.inf, extrapolate=True):
+        if initial is None and nresonances is None:
+            raise ValueError("Provide either the initial positions or the number of resonances.")
+        self.nresonances = len(initial) if initial is not None else nresonances
+        self.max_shift = max_shift
+        self.extrapolate = extrapolate
+        self.reset(initial)
+
+    def reset(self, initial=None):
+        """ Forgets the history, optionally restarting from new initial positions. """
+        self.history = []
+        self._last = None if initial is None else np.array(initial, dtype=float)
+        self._previous = None
+
+    def predict(self):
+        """ Predicted positions of the resonances in the next trace. """
+        if self._last is None:
+            return None
+        if not self.extrapolate or self._previous is None:
+            return self._last.copy()
+        step = self._last - self._previous
+        return self._last + np.where(np.isfinite(step), step, 0)
+
+    def __call__(self, found):
+        found = np.sort(np.asarray(found, dtype=float))
+        if self._last is None:
+            if len(found) != self.nresonances:
+                raise ValueError(f"Found {len(found)} resonances to start tracking {self.nresonances}.")
+            linked = found
+        else:
+            linked = link_peaks(self.predict(), found, max_shift=self.max_shift)
+
+        # the last known positions, and the ones before if the resonance was found twice in a row
+        found_now = np.isfinite(linked)
+        if self.history:
+            self._previous = np.where(found_now & np.isfinite(self.history[-1]), self._last, np.nan)
+        self._last = linked.copy() if self._last is None else np.where(found_now, linked, self._last)
+        self.history.append(linked)
+        return linked
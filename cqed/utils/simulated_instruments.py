@@ -0,0 +1,765 @@
+"""
+Simulated versions of the instruments in station_init/LK1.station.yaml, to run and benchmark the measurement
+functions without hardware. Load them with station_init/simulated.station.yaml.
+
+The instruments behave as SCPI instruments: every parameter is read and written through ask_raw and write_raw,
+which take a configurable latency per call (plus the transfer time of the message if a transfer rate is given).
+The VNA and the Alazar controller return the response of a hanger resonator, and the magnet sources ramp
+at finite rates in real time, optionally scaled.
+
+"""
+
+import numpy as np
+from time import sleep, monotonic
+from qcodes.instrument.base import Instrument
+from qcodes.instrument.channel import InstrumentChannel, ChannelList
+from qcodes.utils import validators as vals
+
+
+class ResonatorModel:
+    """
+    Hanger resonator with S21 = 1 - (Q / Qc) / (1 + 2j Q (f - f0) / f0), with 1 / Q = 1 / Qi + 1 / Qc.
+
+    The resonance frequency can depend on the field of a simulated magnet: it drops as curvature * B_perp^2,
+    with B_perp the field perpendicular to the film normal, such that field alignment can be simulated too.
+
+    args:
+    f0 (Hz): resonance frequency at zero field
+    qi: internal quality factor
+    qc: coupling quality factor
+    curvature (Hz/T^2): decrease of the resonance frequency with the perpendicular field squared
+    normal (array): film normal in the coordinates of the magnet
+    magnet (str): name of a SimulatedMercuryIPS providing the field. If None, the field is zero.
+    """
+
+    def __init__(self, f0=6e9, qi=2e4, qc=2e4, curvature=0, normal=(1, 0, 0), magnet=None):
+        self.f0 = f0
+        self.qi = qi
+        self.qc = qc
+        self.curvature = curvature
+        self.normal = np.asarray(normal, dtype=float) / np.linalg.norm(normal)
+        self.magnet = magnet
+
+    def resonance_frequency(self):
+        if self.magnet is None or self.curvature == 0:
+            return self.f0
+        field = Instrument.find_instrument(self.magnet).field_vector()
+        perpendicular = field - np.dot(field, self.normal) * self.normal
+        return self.f0 - self.curvature * np.dot(perpendicular, perpendicular)
+
+    def s21(self, freqs):
+        f0 = self.resonance_frequency()
+        q = 1 / (1 / self.qi + 1 / self.qc)
+        return 1 - (q / self.qc) / (1 + 2j * q * (np.asarray(freqs) - f0) / f0)
+
+
+class _Profile:
+    """
+    Output of a source as a function of time: a list of linear segments (start time, start value, stop value,
+    duration), the last of which holds its stop value afterwards.
+    """
+
+    def __init__(self, value=0.0):
+        self.segments = [(monotonic(), value, value, 0.0)]
+
+    def value(self, t=None):
+        t = monotonic() if t is None else t
+        for t0, start, stop, duration in reversed(self.segments):
+            if t >= t0:
+                if duration <= 0 or t >= t0 + duration:
+                    return stop
+                return start + (t - t0) / duration * (stop - start)
+        return self.segments[0][1]
+
+    def is_ramping(self, t=None):
+        t = monotonic() if t is None else t
+        t0, _, _, duration = self.segments[-1]
+        return t < t0 + duration
+
+    def ramp(self, stop, duration=0.0):
+        """ Ramps linearly from the present value to stop, replacing everything that was scheduled. """
+        now = monotonic()
+        start = self.value(now)
+        self.segments = [seg for seg in self.segments if seg[0] <= now][-1:]
+        self.segments.append((now, start, stop, duration))
+
+    def schedule(self, steps, interval, slope):
+        """ Ramps through the steps, starting one every interval and taking slope to reach it. """
+        now = monotonic()
+        start = self.value(now)
+        self.segments = [seg for seg in self.segments if seg[0] <= now][-1:]
+        for ii, stop in enumerate(steps):
+            self.segments.append((now + ii * interval, start, stop, slope))
+            start = stop
+
+
+def _count_samples(waveforms):
+    """ Total number of samples in a (nested) list of waveforms. """
+    if isinstance(waveforms, (list, tuple)):
+        return sum(_count_samples(waveform) for waveform in waveforms)
+    return np.size(waveforms)
+
+
+def _add_setting(module, name, command, initial_value, **kwargs):
+    """
+    Adds a parameter to a simulated instrument or channel that is written with `command value` and read with
+    `command?`, and stores its initial (raw) value.
+    """
+    module.root_instrument._state[command.upper()] = str(initial_value)
+    module.add_parameter(name, get_cmd=command + "?", set_cmd=command + " {}", **kwargs)
+
+
+class SimulatedInstrument(Instrument):
+    """
+    Base class of the simulated instruments. Written values are stored per SCPI header and returned when queried.
+    Queries of measured values are answered by the handlers in `_queries`, and commands with side effects call
+    the handlers in `_commands`; both are keyed by the upper case header and get the argument string.
+
+    args:
+    latency (s): time taken by every write_raw and ask_raw call
+    transfer_rate (bytes/s): if given, every call additionally takes the length of the messages divided by this rate
+    """
+
+    def __init__(self, name, latency=0, transfer_rate=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self._state = {}
+        self._queries = {}
+        self._commands = {}
+        self.ncalls = 0
+
+        self.add_parameter(
+            "latency", unit="s", label="time taken per call", get_cmd=None, set_cmd=None,
+            initial_value=latency, vals=vals.Numbers(min_value=0),
+        )
+
+        self.add_parameter(
+            "transfer_rate", unit="B/s", label="transfer rate of messages", get_cmd=None, set_cmd=None,
+            initial_value=transfer_rate,
+        )
+
+    def _communicate(self, nbytes):
+        self.ncalls += 1
+        duration = self.latency()
+        if self.transfer_rate() is not None:
+            duration += nbytes / self.transfer_rate()
+        if duration > 0:
+            sleep(duration)
+
+    @staticmethod
+    def _parse(cmd):
+        header, _, argument = cmd.strip().partition(" ")
+        return header.lstrip(":").upper(), argument.strip()
+
+    def write_raw(self, cmd):
+        header, argument = self._parse(cmd)
+        self._communicate(len(cmd))
+        if header in self._commands:
+            self._commands[header](argument)
+        else:
+            self._state[header] = argument
+
+    def ask_raw(self, cmd):
+        header, argument = self._parse(cmd)
+        if header in self._queries:
+            response = str(self._queries[header](argument))
+        else:
+            response = self._state.get(header.rstrip("?"), "")
+        self._communicate(len(cmd) + len(response))
+        return response
+
+    def get_idn(self):
+        return {"vendor": "cqed", "model": type(self).__name__, "serial": None, "firmware": None}
+
+
+# ---------------------------------- VNA ------------------------------------------
+
+
+class SimulatedZNBChannel(InstrumentChannel):
+    """ Trace of the simulated VNA, with the parameters and data methods of a qcodes ZNB channel. """
+
+    def __init__(self, parent, name, channel, noise, rng):
+        super().__init__(parent, name)
+        self._prefix = f"SENS{channel}"
+        self._channel = channel
+        self._data_command = f"CALC{channel}:DATA?"
+        self.noise = noise
+        self._rng = rng
+
+        _add_setting(self, "start", f"{self._prefix}:FREQ:STAR", 5.9e9, unit="Hz", get_parser=float)
+        _add_setting(self, "stop", f"{self._prefix}:FREQ:STOP", 6.1e9, unit="Hz", get_parser=float)
+        _add_setting(self, "npts", f"{self._prefix}:SWE:POIN", 201, get_parser=int, vals=vals.Ints(1, 100001))
+        _add_setting(self, "bandwidth", f"{self._prefix}:BAND", 1e3, unit="Hz", get_parser=float)
+        _add_setting(self, "power", f"SOUR{channel}:POW", -30, unit="dBm", get_parser=float)
+        _add_setting(self, "avg", f"{self._prefix}:AVER:COUN", 1, get_parser=int, vals=vals.Ints(1, 5000))
+        _add_setting(self, "electrical_delay", f"{self._prefix}:CORR:EDEL", 0, unit="s", get_parser=float)
+        _add_setting(self, "cw_frequency", f"{self._prefix}:FREQ:CW", 6e9, unit="Hz", get_parser=float)
+        _add_setting(self, "sweep_type", f"{self._prefix}:SWE:TYPE", "LIN", vals=vals.Enum("LIN", "CW"))
+
+        parent._queries[f"{self._prefix}:SWE:TIME?"] = lambda argument: self._sweep_time()
+        parent._queries[self._data_command] = self._data
+
+        self.add_parameter("sweep_time", unit="s", get_cmd=f"{self._prefix}:SWE:TIME?", get_parser=float)
+        # measurements are not part of the snapshot
+        self.add_parameter("trace_mag_phase", get_cmd=self._get_trace_mag_phase, snapshot_get=False,
+                           snapshot_value=False)
+        self.add_parameter("trace_fixed_frequency", get_cmd=self._get_trace_fixed_frequency, snapshot_get=False,
+                           snapshot_value=False)
+        self.add_parameter("point_fixed_frequency_mag_phase", get_cmd=self._get_point_fixed_frequency_mag_phase,
+                           snapshot_get=False, snapshot_value=False)
+
+    def _setting(self, command, parser=float):
+        return parser(self.root_instrument._state[f"{self._prefix}:{command}"])
+
+    def _sweep_time(self):
+        return self._setting("SWE:POIN", int) * self._setting("AVER:COUN", int) / self._setting("BAND")
+
+    def _data(self, argument):
+        """ Measures the trace, returned as comma separated real and imaginary parts as the ZNB does. """
+        vna = self.root_instrument
+        npts = self._setting("SWE:POIN", int)
+        if self._setting("SWE:TYPE", str) == "CW":
+            freqs = np.full(npts, self._setting("FREQ:CW"))
+        else:
+            freqs = np.linspace(self._setting("FREQ:STAR"), self._setting("FREQ:STOP"), npts)
+
+        rf_on = vna._state["OUTP1"] == "1"
+        s21 = vna.resonator.s21(freqs) * np.exp(2j * np.pi * freqs * self._setting("CORR:EDEL")) * rf_on
+        # noise relative to the signal at -30 dBm, 1 kHz bandwidth and no averaging
+        power = float(vna._state[f"SOUR{self._channel}:POW"])
+        sigma = self.noise * np.sqrt(self._setting("BAND") / 1e3 / self._setting("AVER:COUN", int)) \
+            * 10 ** (-(power + 30) / 20)
+        s21 = s21 + sigma * (self._rng.standard_normal(npts) + 1j * self._rng.standard_normal(npts)) / np.sqrt(2)
+
+        if vna.sweep_time_scale > 0:
+            sleep(vna.sweep_time_scale * self._sweep_time())
+        return ",".join(map(repr, np.column_stack([s21.real, s21.imag]).ravel().tolist()))
+
+    def _get_data(self):
+        values = np.array(self.ask(self._data_command + " SDAT").split(","), dtype=float)
+        return values[::2] + 1j * values[1::2]
+
+    def _get_trace_mag_phase(self):
+        data = self._get_data()
+        return np.abs(data), np.angle(data)
+
+    def _get_trace_fixed_frequency(self):
+        data = self._get_data()
+        return data.real, data.imag
+
+    def _get_point_fixed_frequency_mag_phase(self):
+        data = np.mean(self._get_data())
+        return np.abs(data), np.angle(data)
+
+    def setup_lin_sweep(self):
+        self.sweep_type("LIN")
+
+    def setup_cw_sweep(self):
+        self.sweep_type("CW")
+
+
+class SimulatedZNB(SimulatedInstrument):
+    """
+    Simulated R&S ZNB VNA with a single channel S21, measuring a hanger resonator.
+
+    args:
+    resonator (dict): arguments of the ResonatorModel
+    noise: noise of S21 at -30 dBm, 1 kHz bandwidth and a single average
+    sweep_time_scale: measuring a trace takes this fraction of the sweep time of a real VNA
+    seed (int): seed of the noise
+    Other args: see SimulatedInstrument
+    """
+
+    def __init__(self, name, resonator=None, noise=1e-3, sweep_time_scale=0, seed=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.resonator = ResonatorModel(**(resonator or {}))
+        self.sweep_time_scale = sweep_time_scale
+
+        _add_setting(self, "rf_power", "OUTP1", 0, val_mapping={True: "1", False: "0"})
+
+        channels = ChannelList(self, "VNAChannels", SimulatedZNBChannel)
+        channel = SimulatedZNBChannel(self, "S21", 1, noise, np.random.default_rng(seed))
+        channels.append(channel)
+        self.add_submodule("S21", channel)
+        self.add_submodule("channels", channels.to_channel_tuple())
+
+    def rf_on(self):
+        self.write("OUTP1 1")
+
+    def rf_off(self):
+        self.write("OUTP1 0")
+
+
+# ---------------------------------- Alazar ------------------------------------------
+
+
+class SimulatedAlazar(SimulatedInstrument):
+    """ Simulated AlazarTech digitizer card, holding the sample rate used by the simulated controller. """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        _add_setting(self, "sample_rate", "SAMP:RATE", 250_000_000, unit="S/s", get_parser=int)
+        self.nclears = 0
+        self._commands["BUFF:CLE"] = self._clear
+
+    def _clear(self, argument):
+        self.nclears += 1
+
+    def clear_buffers(self):
+        self.write("BUFF:CLE")
+
+
+class SimulatedAlazarController(SimulatedInstrument):
+    """
+    Simulated acquisition controller of the Alazar (as in pytopo), returning demodulated IQ data of the resonator
+    at the frequency and power of the readout source.
+
+    With samples given to setup_acquisition, the demodulated data is a time trace with one point per period of the
+    demodulation frequency (see demod_tvals); with acq_time instead, every record is integrated into a single point.
+    The data has shape buffers x records x time points x 2 channels, without the buffer axis when the buffers are
+    averaged. The first channel holds the signal, the second only noise.
+
+    `record_response` can be set to a function of the number of records returning a (complex) factor for every
+    record, to simulate for example Rabi oscillations versus the records of a sequence.
+
+    args:
+    alazar (str): name of the SimulatedAlazar
+    readout_source (str): name of the source of the readout tone, a SimulatedHeterodyneSource or SimulatedMWSource.
+    If no such instrument exists, the resonator is read out at f0 with full amplitude.
+    resonator (dict): arguments of the ResonatorModel
+    noise: noise of a single sample
+    acquisition_time_scale: an acquisition takes this fraction of the time of a real acquisition
+    seed (int): seed of the noise
+    Other args: see SimulatedInstrument
+    """
+
+    def __init__(self, name, alazar="alazar", readout_source="hetsrc", resonator=None, noise=1e-1,
+                 acquisition_time_scale=0, seed=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.alazar_name = alazar
+        self.readout_source = readout_source
+        self.resonator = ResonatorModel(**(resonator or {}))
+        self.noise = noise
+        self.acquisition_time_scale = acquisition_time_scale
+        self.record_response = None
+        self.demod_tvals = np.zeros(1)
+        self.verbose = False
+        self._rng = np.random.default_rng(seed)
+        self._acquisition = None
+
+        on_off = {True: "1", False: "0"}
+        _add_setting(self, "average_buffers", "ACQ:AVER:BUFF", 0, val_mapping=on_off)
+        _add_setting(self, "average_buffers_postdemod", "ACQ:AVER:DEM", 1, val_mapping=on_off)
+        _add_setting(self, "demod_frq", "ACQ:DEM:FREQ", 20e6, unit="Hz", get_parser=float)
+        _add_setting(self, "buffers_per_block", "ACQ:BPB", None,
+                     get_parser=lambda value: None if value == "None" else int(value))
+
+    def setup_acquisition(self, samples=None, records=1, buffers=1, acq_time=None, allocated_buffers=None,
+                          verbose=False):
+        sample_rate = Instrument.find_instrument(self.alazar_name).sample_rate()
+        if samples is None:
+            if acq_time is None:
+                raise ValueError("Provide either samples or acq_time.")
+            samples = int(acq_time * sample_rate // 128 * 128)
+            ntvals = 1
+        else:
+            ntvals = max(int(samples / sample_rate * self.demod_frq()), 1)
+        self.write(f"ACQ:CONF {samples},{records},{buffers}")
+        self._acquisition = {"samples": samples, "records": records, "buffers": buffers, "sample_rate": sample_rate}
+        self.demod_tvals = np.arange(ntvals) / self.demod_frq()
+        if verbose:
+            print(f"{self.name}: {buffers} buffers of {records} records of {samples} samples")
+
+    def _readout(self):
+        try:
+            source = Instrument.find_instrument(self.readout_source)
+        except KeyError:
+            return self.resonator.f0, 1.0
+        frequency, power, on = source.output_state()
+        return frequency, 10 ** (power / 20) * on
+
+    def acquisition(self):
+        if self._acquisition is None:
+            raise Exception("The acquisition is not set up, call setup_acquisition first.")
+        samples, records, buffers = (self._acquisition[key] for key in ["samples", "records", "buffers"])
+        ntvals = len(self.demod_tvals)
+
+        frequency, amplitude = self._readout()
+        signal = amplitude * self.resonator.s21(frequency) * np.ones(records, dtype=complex)
+        if self.record_response is not None:
+            signal = signal * np.asarray(self.record_response(records))
+
+        averaged = self.average_buffers() or self.average_buffers_postdemod()
+        shape = (records, ntvals, 2) if averaged else (buffers, records, ntvals, 2)
+        sigma = self.noise / np.sqrt(samples / ntvals * (buffers if averaged else 1))
+        data = sigma * (self._rng.standard_normal(shape) + 1j * self._rng.standard_normal(shape)) / np.sqrt(2)
+        data[..., 0] += signal[:, None]
+
+        if self.acquisition_time_scale > 0:
+            sleep(self.acquisition_time_scale * buffers * records * samples / self._acquisition["sample_rate"])
+        self._communicate(data.nbytes)
+        return data
+
+
+# ---------------------------------- AWG ------------------------------------------
+
+
+class SimulatedAWG5014(SimulatedInstrument):
+    """
+    Simulated Tektronix AWG5014 with the run control, channel settings and sequence methods of the qcodes driver.
+    Uploads take the transfer time of their waveforms (float32 plus two markers per sample) if a transfer rate is given.
+    """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self.nuploads = 0
+        self.nelements = 0
+
+        _add_setting(self, "clock_freq", "SOUR1:FREQ", 1.2e9, unit="Hz", get_parser=float)
+        _add_setting(self, "run_state", "AWGC:RST", 0, val_mapping={"Idle": "0", "Waiting for trigger": "1",
+                                                                    "Running": "2"})
+        for n in range(1, 5):
+            _add_setting(self, f"ch{n}_amp", f"SOUR{n}:VOLT", 1.0, unit="V", get_parser=float)
+            _add_setting(self, f"ch{n}_offset", f"SOUR{n}:VOLT:OFFS", 0.0, unit="V", get_parser=float)
+            _add_setting(self, f"ch{n}_state", f"OUTP{n}", 0, val_mapping={1: "1", 0: "0"})
+
+        self._commands["AWGC:RUN"] = lambda argument: self._state.update({"AWGC:RST": "2"})
+        self._commands["AWGC:STOP"] = lambda argument: self._state.update({"AWGC:RST": "0"})
+
+    def start(self):
+        self.write("AWGC:RUN")
+        return self.run_state()
+
+    def run(self):
+        return self.start()
+
+    def stop(self):
+        self.write("AWGC:STOP")
+
+    def all_channels_on(self):
+        for n in range(1, 5):
+            self.parameters[f"ch{n}_state"](1)
+
+    def all_channels_off(self):
+        for n in range(1, 5):
+            self.parameters[f"ch{n}_state"](0)
+
+    def make_send_and_load_awg_file(self, waveforms, m1s, m2s, nreps, trig_waits, goto_states, jump_tos,
+                                    channels=None, filename="customawgfile.awg", preservechannelsettings=True):
+        nsamples = _count_samples(waveforms)
+        self.nuploads += 1
+        self.nelements = len(nreps)
+        self._communicate(6 * nsamples)
+
+    def set_sqel_loopcnt(self, loopcount, element_no=1):
+        self.write(f"SEQ:ELEM{element_no}:LOOP:COUN {loopcount}")
+
+    def set_sqel_trigger_wait(self, element_no, state=1):
+        self.write(f"SEQ:ELEM{element_no}:TWA {state}")
+
+    def set_sqel_goto_state(self, element_no, state):
+        self.write(f"SEQ:ELEM{element_no}:GOTO:STAT {state}")
+
+    def set_sqel_event_jump_type(self, element_no, jtype):
+        self.write(f"SEQ:ELEM{element_no}:JTAR:TYPE {jtype}")
+
+    def set_sqel_event_target_index(self, element_no, index):
+        self.write(f"SEQ:ELEM{element_no}:JTAR:INDEX {index}")
+
+
+# ---------------------------------- microwave sources ------------------------------------------
+
+
+class SimulatedMWSource(SimulatedInstrument):
+    """
+    Simulated microwave source with the parameters of both the R&S SGS100A driver (status, on/off, pulse modulation,
+    reference/LO output) and the Keysight E8267D driver (output_rf, modulation_rf).
+    """
+
+    def __init__(self, name, frequency=6e9, power=-30, **kwargs):
+        super().__init__(name, **kwargs)
+        _add_setting(self, "frequency", "SOUR:FREQ", frequency, unit="Hz", get_parser=float)
+        _add_setting(self, "power", "SOUR:POW", power, unit="dBm", get_parser=float)
+        _add_setting(self, "status", "OUTP:STAT", 0, val_mapping={"on": "1", "off": "0"})
+        self.add_parameter("output_rf", get_cmd="OUTP:STAT?", set_cmd="OUTP:STAT {}",
+                           val_mapping={"ON": "1", "OFF": "0"})
+        _add_setting(self, "modulation_rf", "OUTP:MOD", 0, val_mapping={"ON": "1", "OFF": "0"})
+        _add_setting(self, "pulsemod_state", "SOUR:PULM:STAT", 0, val_mapping={"ON": "1", "OFF": "0"})
+        _add_setting(self, "pulsemod_source", "SOUR:PULM:SOUR", "INT", vals=vals.Enum("INT", "EXT"))
+        _add_setting(self, "ref_LO_out", "CONN:REFL:OUTP", "OFF", vals=vals.Enum("REF", "LO", "OFF"))
+
+    def on(self):
+        self.status("on")
+
+    def off(self):
+        self.status("off")
+
+    def output_state(self):
+        """ Frequency, power and output state, as seen by the simulated devices (without communication). """
+        return float(self._state["SOUR:FREQ"]), float(self._state["SOUR:POW"]), self._state["OUTP:STAT"] == "1"
+
+
+class SimulatedHeterodyneSource(Instrument):
+    """
+    Simulated heterodyne source (as in pytopo) combining an RF and an LO source, with the LO at frequency + IF.
+
+    args:
+    RF (str): name of the SimulatedMWSource of the readout tone
+    LO (str): name of the SimulatedMWSource of the local oscillator
+    IF (Hz): intermediate frequency
+    """
+
+    def __init__(self, name, RF="RF", LO="LO", IF=20e6, **kwargs):
+        super().__init__(name, **kwargs)
+        self._sources = {"RF": RF, "LO": LO}
+
+        self.add_parameter("IF", unit="Hz", get_cmd=None, set_cmd=None, initial_value=IF)
+        # not read for snapshots, since the RF source may be loaded after this instrument
+        self.add_parameter("frequency", unit="Hz", get_cmd=lambda: self.RF.frequency(), set_cmd=self._set_frequency,
+                           snapshot_get=False)
+
+    @property
+    def RF(self):
+        return Instrument.find_instrument(self._sources["RF"])
+
+    @property
+    def LO(self):
+        return Instrument.find_instrument(self._sources["LO"])
+
+    def _set_frequency(self, frequency):
+        self.RF.frequency(frequency)
+        self.LO.frequency(frequency + self.IF())
+
+    def on(self):
+        self.RF.on()
+        self.LO.on()
+
+    def off(self):
+        self.RF.off()
+        self.LO.off()
+
+    def output_state(self):
+        return self.RF.output_state()
+
+    def get_idn(self):
+        return {"vendor": "cqed", "model": type(self).__name__, "serial": None, "firmware": None}
+
+
+class SimulatedFunctionGeneratorChannel(InstrumentChannel):
+    """ Output channel of the simulated function generator. """
+
+    def __init__(self, parent, name, channel):
+        super().__init__(parent, name)
+        _add_setting(self, "state", f"OUTP{channel}", "OFF", vals=vals.Enum("ON", "OFF"))
+        _add_setting(self, "frequency", f"SOUR{channel}:FREQ", 1e3, unit="Hz", get_parser=float)
+        _add_setting(self, "amplitude", f"SOUR{channel}:VOLT", 0.1, unit="V", get_parser=float)
+
+
+class SimulatedFunctionGenerator(SimulatedInstrument):
+    """ Simulated two channel function generator. """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        for channel in [1, 2]:
+            self.add_submodule(f"ch{channel}", SimulatedFunctionGeneratorChannel(self, f"ch{channel}", channel))
+
+
+# ---------------------------------- magnet sources ------------------------------------------
+
+
+class SimulatedGS200Program(InstrumentChannel):
+    """ Program submodule of the simulated GS200: the levels written between start and end are run as steps. """
+
+    def __init__(self, parent, name):
+        super().__init__(parent, name)
+        _add_setting(self, "interval", "PROG:INT", 1.0, unit="s", get_parser=float, vals=vals.Numbers(0.1, 3600))
+        _add_setting(self, "slope", "PROG:SLOP", 0.0, unit="s", get_parser=float, vals=vals.Numbers(0, 3600))
+        _add_setting(self, "repeat", "PROG:REP", 1, val_mapping={"ON": "1", "OFF": "0"})
+
+    def start(self):
+        self.write("PROG:EDIT:STAR")
+
+    def end(self):
+        self.write("PROG:EDIT:END")
+
+    def run(self):
+        self.write("PROG:RUN")
+
+
+class SimulatedGS200(SimulatedInstrument):
+    """
+    Simulated Yokogawa GS200 current source with the interface of the qcodes driver used by CustomGS210,
+    including the program submodule. The output follows a new level at `ramp_rate`.
+
+    args:
+    ramp_rate (A/s): rate at which the output changes after setting a level. If None, it changes instantly.
+    Other args: see SimulatedInstrument
+    """
+
+    def __init__(self, name, ramp_rate=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.ramp_rate = ramp_rate
+        self._profile = _Profile(0.0)
+        self._program = None  # levels written while editing a program
+
+        _add_setting(self, "output", "OUTP", 0, val_mapping={"on": "1", "off": "0"})
+        _add_setting(self, "source_mode", "SOUR:FUNC", "CURR", vals=vals.Enum("CURR", "VOLT"))
+        self.add_parameter("current", unit="A", get_cmd="SOUR:LEV?", set_cmd="SOUR:LEV {:.6e}", get_parser=float)
+        self.add_submodule("program", SimulatedGS200Program(self, "program"))
+
+        self._queries["SOUR:LEV?"] = lambda argument: self._profile.value()
+        self._commands["SOUR:LEV"] = self._set_level
+        self._commands["PROG:EDIT:STAR"] = lambda argument: setattr(self, "_program", [])
+        self._commands["PROG:EDIT:END"] = lambda argument: None
+        self._commands["PROG:RUN"] = self._run_program
+
+    def _set_level(self, argument):
+        level = float(argument)
+        if self._program is not None:
+            self._program.append(level)
+            return
+        present = self._profile.value()
+        duration = 0 if self.ramp_rate is None else abs(level - present) / self.ramp_rate
+        self._profile.ramp(level, duration)
+
+    def _run_program(self, argument):
+        steps, self._program = self._program or [], None
+        self._profile.schedule(steps, float(self._state["PROG:INT"]), float(self._state["PROG:SLOP"]))
+
+    def ramp_current(self, ramp_to, step, delay):
+        """ Ramps in steps of step with a delay after every step, as the driver does. """
+        start = self.current()
+        nsteps = int(np.ceil(abs(ramp_to - start) / step))
+        for current in np.linspace(start, ramp_to, nsteps + 1)[1:]:
+            self.current(current)
+            sleep(delay)
+
+
+class SimulatedE36313AChannel(InstrumentChannel):
+    """ Output channel of the simulated E36313A, whose current follows a new setpoint at the ramp rate. """
+
+    def __init__(self, parent, name, channel):
+        super().__init__(parent, name)
+        self._profile = _Profile(0.0)
+        _add_setting(self, "enable", f"OUTP{channel}", 0, val_mapping={"on": "1", "off": "0"})
+        _add_setting(self, "source_voltage", f"SOUR{channel}:VOLT", 0.0, unit="V", get_parser=float)
+        self.add_parameter("source_current", unit="A", get_cmd=f"SOUR{channel}:CURR?",
+                           set_cmd=f"SOUR{channel}:CURR {{:.6e}}", get_parser=float)
+
+        parent._queries[f"SOUR{channel}:CURR?"] = lambda argument: self._profile.value()
+        parent._commands[f"SOUR{channel}:CURR"] = self._set_current
+
+    def _set_current(self, argument):
+        current = float(argument)
+        ramp_rate = self.root_instrument.ramp_rate
+        duration = 0 if ramp_rate is None else abs(current - self._profile.value()) / ramp_rate
+        self._profile.ramp(current, duration)
+
+
+class SimulatedE36313A(SimulatedInstrument):
+    """
+    Simulated Keysight E36313A power supply with three channels, as used by CustomE36313A.
+
+    args:
+    ramp_rate (A/s): rate at which the output changes after setting a current. If None, it changes instantly.
+    Other args: see SimulatedInstrument
+    """
+
+    def __init__(self, name, ramp_rate=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.ramp_rate = ramp_rate
+        for channel in [1, 2, 3]:
+            self.add_submodule(f"ch{channel}", SimulatedE36313AChannel(self, f"ch{channel}", channel))
+
+
+class SimulatedMercuryIPSAxis(InstrumentChannel):
+    """ Axis (GRPX, GRPY or GRPZ) of the simulated Mercury iPS. """
+
+    def __init__(self, parent, name, ramp_rate):
+        super().__init__(parent, name)
+        self._profile = _Profile(0.0)
+        self._prefix = f"DEV:{name}"
+
+        _add_setting(self, "field_ramp_rate", f"{self._prefix}:RATE", ramp_rate, unit="T/s", get_parser=float,
+                     vals=vals.Numbers(min_value=0))
+        _add_setting(self, "field_target", f"{self._prefix}:TSET", 0.0, unit="T", get_parser=float)
+        self.add_parameter("field_measured", unit="T", get_cmd=f"{self._prefix}:FLD?", get_parser=float)
+        self.add_parameter("ramp_status", get_cmd=f"{self._prefix}:ACTN?")
+
+        parent._queries[f"{self._prefix}:FLD?"] = lambda argument: self._profile.value()
+        parent._queries[f"{self._prefix}:ACTN?"] = \
+            lambda argument: "TO SET" if self._profile.is_ramping() else "HOLD"
+        parent._commands[f"{self._prefix}:ACTN"] = self._action
+
+    def _action(self, argument):
+        if argument == "RTOS":
+            state = self.root_instrument._state
+            target = float(state[f"{self._prefix}:TSET"])
+            rate = float(state[f"{self._prefix}:RATE"])
+            distance = abs(target - self._profile.value())
+            duration = distance / rate * self.root_instrument.time_scale if distance > 0 else 0
+            self._profile.ramp(target, duration)
+        elif argument == "HOLD":
+            self._profile.ramp(self._profile.value())
+
+    def ramp_to_target(self):
+        self.write(f"{self._prefix}:ACTN RTOS")
+
+    def duration(self):
+        """ Remaining time of the present ramp. """
+        t0, _, _, duration = self._profile.segments[-1]
+        return max(t0 + duration - monotonic(), 0)
+
+
+class SimulatedMercuryIPS(SimulatedInstrument):
+    """
+    Simulated Oxford Mercury iPS vector magnet with the x/y/z target and measured parameters and the ramp modes
+    of the qcodes driver: 'simul' starts all axes and returns, 'simul_block' also waits until they are done,
+    and 'safe' first ramps the axes whose field decreases in magnitude and then the others, waiting for both.
+
+    args:
+    ramp_rates (T/s): ramp rates of the x, y and z axis
+    time_scale: ramps take this fraction of their real duration, to speed up simulations
+    Other args: see SimulatedInstrument
+    """
+
+    def __init__(self, name, ramp_rates=(1e-3, 1e-3, 1e-3), time_scale=1, **kwargs):
+        super().__init__(name, **kwargs)
+        self.time_scale = time_scale
+
+        for axis, ramp_rate in zip("XYZ", np.broadcast_to(ramp_rates, (3,))):
+            group = SimulatedMercuryIPSAxis(self, f"GRP{axis}", float(ramp_rate))
+            self.add_submodule(f"GRP{axis}", group)
+            self.add_parameter(f"{axis.lower()}_target", unit="T", get_cmd=group.field_target,
+                               set_cmd=group.field_target)
+            self.add_parameter(f"{axis.lower()}_measured", unit="T", get_cmd=group.field_measured)
+            self.add_parameter(f"{axis.lower()}_ramp_rate", unit="T/s", get_cmd=group.field_ramp_rate,
+                               set_cmd=group.field_ramp_rate)
+
+    @property
+    def _groups(self):
+        return [self.GRPX, self.GRPY, self.GRPZ]
+
+    def field_vector(self):
+        """ Present field, as seen by the simulated devices (without communication). """
+        return np.array([group._profile.value() for group in self._groups])
+
+    def is_ramping(self):
+        return any(group.ramp_status() == "TO SET" for group in self._groups)
+
+    def _ramp_and_wait(self, groups):
+        for group in groups:
+            group.ramp_to_target()
+        sleep(max([group.duration() for group in groups], default=0))
+
+    def ramp(self, mode="safe"):
+        if mode not in ["safe", "simul", "simul_block"]:
+            raise ValueError(f"Unknown ramp mode {mode}, choose 'safe', 'simul' or 'simul_block'.")
+        if mode == "simul":
+            for group in self._groups:
+                group.ramp_to_target()
+        elif mode == "simul_block":
+            self._ramp_and_wait(self._groups)
+        else:
+            down = [group for group in self._groups if abs(group.field_target()) < abs(group.field_measured())]
+            self._ramp_and_wait(down)
+            self._ramp_and_wait([group for group in self._groups if group not in down])
@@ -0,0 +1,167 @@
+"""
+Loading of a station from a configuration in station_init, connecting the instruments concurrently and only when
+they are needed.
+
+Connecting an instrument mostly waits for its interface, so connecting a dozen instruments in threads takes about
+as long as the slowest one. Instruments that an experiment does not use are not connected at all: a `LazyStation`
+connects an instrument of its configuration at the first access, e.g. `station.vna` or `station['vna']`.
+
+Example:
+    station = load_station("LK1.station.yaml", instruments=["vna", "mgnt"])
+    pysweep.STATION = station
+    print(station.report())
+
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, RLock
+from time import perf_counter
+import qcodes as qc
+
+log = logging.getLogger(__name__)
+
+STATION_INIT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                   "station_init")
+
+
+class LazyStation(qc.Station):
+    """
+    QCoDeS station that connects the instruments of its configuration at their first access, and can connect
+    several of them concurrently with `load_instruments`. The time taken to connect every instrument is kept in
+    `connect_times`.
+
+    Note that only connected instruments are part of the snapshot, and that `hasattr(station, name)` connects the
+    instrument `name`.
+    """
+
+    def __init__(self, *components, config_file=None, **kwargs):
+        self._station_lock = RLock()
+        self._instrument_locks = {}
+        self.connect_times = {}
+        self.load_time = None
+        super().__init__(*components, config_file=config_file, **kwargs)
+
+    def __getattr__(self, key):
+        try:
+            return super().__getattr__(key)
+        except AttributeError:
+            if key.startswith("_") or key not in self.__dict__.get("_instrument_config", {}):
+                raise
+        return self.load_instrument(key, revive_instance=True)
+
+    def __getitem__(self, key):
+        if key not in self.components and key in self._instrument_config:
+            return self.load_instrument(key, revive_instance=True)
+        return super().__getitem__(key)
+
+    @property
+    def configured_instruments(self):
+        """ Names of all instruments in the configuration, connected or not. """
+        return list(self._instrument_config)
+
+    @property
+    def pending_instruments(self):
+        """ Names of the instruments in the configuration that are not connected yet. """
+        return [name for name in self._instrument_config if name not in self.components]
+
+    def load_config_files(self, *filenames):
+        # reloaded by every load_instrument call, which can run in several threads
+        with self._station_lock:
+            super().load_config_files(*filenames)
+
+    def add_component(self, component, name=None, update_snapshot=True):
+        with self._station_lock:
+            return super().add_component(component, name=name, update_snapshot=update_snapshot)
+
+    def remove_component(self, name):
+        with self._station_lock:
+            return super().remove_component(name)
+
+    def load_instrument(self, identifier, revive_instance=False, **kwargs):
+        with self._station_lock:
+            lock = self._instrument_locks.setdefault(identifier, Lock())
+        # a second thread asking for the same instrument waits for the first, and then revives its instance
+        with lock:
+            if revive_instance and identifier in self.components:
+                return self.components[identifier]
+            if revive_instance and qc.Instrument.exist(identifier):
+                instrument = qc.Instrument.find_instrument(identifier)
+                self.add_component(instrument)
+                return instrument
+            start = perf_counter()
+            instrument = super().load_instrument(identifier, **kwargs)
+            self.connect_times[identifier] = perf_counter() - start
+            log.info(f"Connected {identifier} in {self.connect_times[identifier]:.2f} s")
+            return instrument
+
+    def load_instruments(self, names=None, max_workers=None):
+        """
+        Connects instruments of the configuration concurrently. Instruments that are connected already are kept.
+
+        args:
+        names (list of str): names of the instruments, by default all instruments that are not connected yet
+        max_workers (int): largest number of instruments connected at the same time, by default all of them
+
+        returns:
+        dict of the connected instruments by name
+        """
+        names = self.pending_instruments if names is None else list(names)
+        if len(names) == 0:
+            return {}
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers or len(names), thread_name_prefix="station") as executor:
+            futures = {name: executor.submit(self.load_instrument, name, revive_instance=True) for name in names}
+        self.load_time = perf_counter() - start
+
+        instruments, errors = {}, {}
+        for name, future in futures.items():
+            if future.exception() is None:
+                instruments[name] = future.result()
+            else:
+                errors[name] = future.exception()
+                log.error(f"Could not connect {name}: {errors[name]!r}")
+        if errors:
+            raise Exception(f"Could not connect {', '.join(errors)}: "
+                            + "; ".join(f"{name}: {error!r}" for name, error in errors.items())) \
+                from next(iter(errors.values()))
+        return instruments
+
+    def report(self):
+        """ Table of the connect time per instrument, and the instruments that are not connected yet. """
+        lines = [f"{'instrument':15s} {'connect (s)':>11s}"]
+        for name, duration in sorted(self.connect_times.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:15s} {duration:11.2f}")
+        lines.append(f"{'sum':15s} {sum(self.connect_times.values()):11.2f}")
+        if self.load_time is not None:
+            lines.append(f"{'last parallel':15s} {self.load_time:11.2f}")
+        if self.pending_instruments:
+            lines.append("not connected: " + ", ".join(self.pending_instruments))
+        return "\n".join(lines)
+
+
+def load_station(config_file, instruments=None, lazy=True, max_workers=None):
+    """
+    Creates a LazyStation from a configuration file and connects instruments concurrently.
+
+    args:
+    config_file (str): path of the yaml configuration, or its name in station_init, e.g. "LK1.station.yaml"
+    instruments (list of str): instruments to connect right away. The other instruments are connected at their first
+    access if lazy, or else right away as well.
+    lazy (boolean): connect the instruments that are not listed only when they are accessed
+    max_workers (int): largest number of instruments connected at the same time
+
+    returns:
+    LazyStation, which is the default station
+    """
+    if not os.path.exists(config_file) and os.path.exists(os.path.join(STATION_INIT_FOLDER, config_file)):
+        config_file = os.path.join(STATION_INIT_FOLDER, config_file)
+    station = LazyStation(config_file=config_file)
+
+    names = list(instruments or [])
+    if not lazy:
+        names += [name for name in station.configured_instruments if name not in names]
+    station.load_instruments(names, max_workers=max_workers)
+    return station
@@ -0,0 +1,264 @@
+"""
+Timing of the phases of measurements (setup, RF toggle, acquisition, transfer, analysis, ramp, ...), to find out
+where the time of a slow sweep goes.
+
+The measurement functions in cqed.custom_pysweep_functions mark their phases with `phase`. Timing is disabled by
+default, in which case a phase costs a single check of a module flag. When enabled, the durations are collected in
+`timings`, which gives statistics and histograms per phase, and can store them in a side table of the QCoDeS
+database keyed by run_id. The durations of every point can also be added to the dataset with `measure_phase_times`.
+
+Phases of the same name that are nested are counted once, by the outermost one. Phases of different names can be
+nested, e.g. 'transfer' (see `timed_instrument`) is part of 'acquisition'.
+
+Example:
+    timing.enable()
+    timing.timings.reset()
+    pysweep.sweep(init, end, cvna.measure_linear_sweep() + timing.measure_phase_times(["setup", "acquisition"]), ...)
+    print(timing.timings.report())
+    timing.timings.save(run_id)
+
+"""
+
+import sqlite3
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+import numpy as np
+from pysweep.core.measurementfunctions import MakeMeasurementFunction
+from pysweep.databackends.base import DataParameter
+
+_enabled = False
+_local = local()  # per thread, such that a phase in one thread does not hide the same phase in another
+
+
+def _active():
+    """ Names of the phases that are being timed in the present thread. """
+    try:
+        return _local.active
+    except AttributeError:
+        _local.active = set()
+        return _local.active
+
+
+def enable():
+    """ Starts recording the durations of phases. """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """ Stops recording the durations of phases. """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class Timings:
+    """
+    Collects the durations of the phases of a run.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forgets all durations, e.g. at the start of a run. """
+        with self._lock:
+            self.durations = {}
+            self._point = {}
+
+    def add(self, name, duration):
+        with self._lock:
+            self.durations.setdefault(name, []).append(duration)
+            self._point[name] = self._point.get(name, 0.0) + duration
+
+    def pop_point(self):
+        """ Returns the total duration per phase since the previous call, i.e. of the present point of a sweep. """
+        with self._lock:
+            point, self._point = self._point, {}
+        return point
+
+    def summary(self):
+        """ Number of calls, and total, mean, median and maximum duration (s) per phase. """
+        with self._lock:
+            durations = {name: np.array(values) for name, values in self.durations.items()}
+        return {name: {"count": len(values), "total": values.sum(), "mean": values.mean(),
+                       "median": np.median(values), "max": values.max()}
+                for name, values in durations.items()}
+
+    def histogram(self, name, bins=20):
+        """ Histogram of the durations of a phase, as returned by np.histogram. """
+        with self._lock:
+            values = np.array(self.durations.get(name, []))
+        return np.histogram(values, bins=bins)
+
+    def report(self):
+        """ Table of the summary, sorted by total duration. """
+        lines = [f"{'phase':20s} {'count':>7s} {'total (s)':>10s} {'mean (ms)':>10s} {'median (ms)':>12s} "
+                 f"{'max (ms)':>10s}"]
+        for name, stats in sorted(self.summary().items(), key=lambda item: -item[1]["total"]):
+            lines.append(f"{name:20s} {stats['count']:7d} {stats['total']:10.3f} {stats['mean'] * 1e3:10.3f} "
+                         f"{stats['median'] * 1e3:12.3f} {stats['max'] * 1e3:10.3f}")
+        return "\n".join(lines)
+
+    def save(self, run_id, db_location=None):
+        """
+        Stores all durations in the table `cqed_timings` of the QCoDeS database, keyed by run_id.
+
+        args:
+        run_id (int): run id of the dataset measured while timing
+        db_location (str): path of the database, by default the one in the QCoDeS config
+        """
+        with self._lock:
+            rows = [(run_id, name, duration) for name, values in self.durations.items() for duration in values]
+        with sqlite3.connect(_db_location(db_location)) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cqed_timings (run_id INTEGER, phase TEXT, duration REAL)")
+            connection.execute("DELETE FROM cqed_timings WHERE run_id = ?", (run_id,))
+            connection.executemany("INSERT INTO cqed_timings VALUES (?, ?, ?)", rows)
+
+
+def _db_location(db_location):
+    # qcodes is imported here only, such that importing this module stays fast
+    if db_location is not None:
+        return db_location
+    from qcodes import config
+    return config["core"]["db_location"]
+
+
+def load_timings(run_id, db_location=None):
+    """
+    Loads the durations stored with `Timings.save` for run_id, as a dictionary of arrays per phase.
+    """
+    with sqlite3.connect(_db_location(db_location)) as connection:
+        rows = connection.execute("SELECT phase, duration FROM cqed_timings WHERE run_id = ? ORDER BY rowid",
+                                  (run_id,)).fetchall()
+    durations = {}
+    for name, duration in rows:
+        durations.setdefault(name, []).append(duration)
+    return {name: np.array(values) for name, values in durations.items()}
+
+
+timings = Timings()
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        active = _active()
+        if self.name not in active:
+            active.add(self.name)
+            self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            timings.add(self.name, perf_counter() - self.start)
+            _active().discard(self.name)
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """
+    Context manager recording the duration of its block as phase `name`, if timing is enabled.
+    """
+    if not _enabled:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+def timed(name):
+    """
+    Decorator recording the duration of every call of a function as phase `name`, if timing is enabled.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _class_method(instrument, method):
+    """ Calls method of the class of instrument, looked up per call such that later patches of the class are used. """
+    def call(cmd):
+        return getattr(type(instrument), method)(instrument, cmd)
+    return call
+
+
+def timed_instrument(instrument, name="transfer"):
+    """
+    Records the duration of the write_raw and ask_raw calls of a QCoDeS instrument as phase `name`,
+    which separates the communication from the rest of, for example, an acquisition. Undo with `untimed_instrument`.
+    The methods in place are wrapped, such that other wrappers of them (as those of the VisaProfiler) keep working.
+    """
+    for method in ["write_raw", "ask_raw"]:
+        previous = instrument.__dict__.get(method)
+        wrapper = timed(name)(previous if previous is not None else _class_method(instrument, method))
+        wrapper.untimed = instrument.__dict__.get(method)  # restored by untimed_instrument
+        setattr(instrument, method, wrapper)
+
+
+def untimed_instrument(instrument):
+    """ Restores the methods in place before timed_instrument, if they were not wrapped again since. """
+    for method in ["write_raw", "ask_raw"]:
+        wrapper = instrument.__dict__.get(method)
+        if not hasattr(wrapper, "untimed"):
+            continue
+        if wrapper.untimed is None:
+            del instrument.__dict__[method]
+        else:
+            setattr(instrument, method, wrapper.untimed)
+
+
+def measure_phase_times(phases, suffix=''):
+    """Pysweep measurement function that returns the time spent per phase since its previous call. Add it after the
+    measurement functions of a sweep to store the phase times of every point in the dataset.
+
+    Args:
+        phases (list of str): names of the phases to store, e.g. ["setup", "RF toggle", "acquisition", "analysis"]
+        suffix (int): suffix added to the DataParameters.
+
+    Returns:
+    Pysweep measurement function
+    """
+
+    @MakeMeasurementFunction(
+        [
+            DataParameter(
+                name="time_" + name.replace(" ", "_") + str(suffix),
+                unit="s",
+                paramtype="numeric",
+            )
+            for name in phases
+        ]
+    )
+    def measurement_function(d):
+        point = timings.pop_point()
+        return [point.get(name, 0.0) for name in phases]
+
+    return measurement_function
@@ -0,0 +1,140 @@
+"""
+A set of functions to store large sets of time traces (e.g. QPP measurements) next to the QCoDeS database,
+writing them chunk by chunk while the acquisition continues, and to open them lazily for analysis.
+
+Traces are stored as memory-mappable .npy files in a folder named after the database,
+as ID_{run_id}_IQ_{timestamp}.npy with the time values in ID_{run_id}_IQ_{timestamp}_tvals.npy.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+
+def data_folder(db_location=None):
+    """
+    Folder in which the traces belonging to a database are stored: the database path without the .db extension.
+
+    db_location (str): path of the database. If None, the current QCoDeS db_location is used.
+    """
+    if db_location is None:
+        from qcodes import config
+        db_location = config.core.db_location
+    return Path(str(db_location)).with_suffix('')
+
+
+def trace_path(folder, run_id, timestamp):
+    """
+    Path of the file containing the traces of run `run_id` taken at `timestamp`.
+    """
+    return Path(folder, f"ID_{run_id}_IQ_{timestamp:d}.npy")
+
+
+def _tvals_path(path):
+    path = Path(path)
+    return path.with_name(path.stem + '_tvals.npy')
+
+
+class TraceWriter:
+    """
+    Writes a stack of `ntraces` traces of `npoints` points each into a preallocated, memory-mapped .npy file.
+    Traces are appended chunk by chunk; copying a chunk to disk happens in a background thread,
+    such that it overlaps with acquiring the next chunk. At most max_pending chunks wait to be written: if the disk
+    is slower than the acquisition, append blocks until the oldest one is written, which bounds the memory used.
+    Use as a context manager, or call close() when done.
+
+    args:
+    path (str or Path): file to write to. Its folder is created if it does not exist.
+    ntraces (int): total number of traces that will be written
+    npoints (int): number of points per trace
+    tvals (array): time values of a trace, stored next to the data
+    dtype: data type of the stored traces
+    max_pending (int): largest number of chunks waiting to be written
+    """
+
+    def __init__(self, path, ntraces, npoints, tvals=None, dtype=np.complex128, max_pending=2):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        if tvals is not None:
+            np.save(_tvals_path(self.path), np.asarray(tvals))
+
+        self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=(ntraces, npoints))
+        self.ntraces = ntraces
+        self.nwritten = 0
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def _write(self, start, traces):
+        self.data[start:start + len(traces)] = traces
+
+    def append(self, traces):
+        """
+        Appends one trace (1D) or a chunk of traces (2D, traces x points) to the file.
+        """
+        traces = np.atleast_2d(traces)
+        if self.nwritten + len(traces) > self.ntraces:
+            raise ValueError(
+                f"Cannot write {len(traces)} more traces, only {self.ntraces - self.nwritten} left in {self.path}.")
+
+        # result() raises any exception that occurred while writing
+        pending = []
+        for future in self._pending:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self._pending = pending
+        while len(self._pending) >= self.max_pending:
+            self._pending.pop(0).result()
+        self._pending.append(self._executor.submit(self._write, self.nwritten, traces))
+        self.nwritten += len(traces)
+
+    def close(self):
+        """
+        Waits until all chunks are written and flushes the file to disk.
+        """
+        for future in self._pending:
+            future.result()  # raises any exception that occurred while writing
+        self._executor.shutdown()
+        self.data.flush()
+        del self.data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_traces(run_id, timestamp=None, folder=None):
+    """
+    Opens the traces belonging to a run lazily, as read-only memory maps, so that
+    files larger than the available memory can be analysed chunk by chunk.
+    Also reads the files written by older versions of measure_QPP, which contain [tvals, data].
+
+    run_id (int): run id of the dataset the traces belong to
+    timestamp (int): timestamp of the trace file. If None, all trace files of the run are opened.
+    folder (str or Path): folder containing the traces, by default the one belonging to the current database.
+
+    returns:
+    (tvals, data) for a single timestamp, with data an array of traces x points.
+    Otherwise a dict {timestamp: (tvals, data)}, sorted by timestamp.
+    """
+    if folder is None:
+        folder = data_folder()
+
+    if timestamp is not None:
+        path = trace_path(folder, run_id, timestamp)
+        if _tvals_path(path).exists():
+            return np.load(_tvals_path(path)), np.load(path, mmap_mode='r')
+        # legacy files are saved as np.save(path, [tvals, data]) and cannot be memory-mapped
+        legacy = np.load(path, allow_pickle=True)
+        return np.real(legacy[0]), legacy[1]
+
+    timestamps = sorted(int(path.stem.split('_')[-1])
+                        for path in Path(folder).glob(f"ID_{run_id}_IQ_*.npy")
+                        if not path.stem.endswith('_tvals'))
+    return {timestamp: load_traces(run_id, timestamp, folder) for timestamp in timestamps}
@@ -0,0 +1,199 @@
+"""
+Profiler of the communication with the instruments, to find out which functions send many small commands.
+
+The profiler replaces the write_raw and ask_raw methods of QCoDeS instruments by ones that log every command
+with its duration and call site: the innermost function of cqed that caused it, e.g. `setup_linear_sweep` or
+`measure_linear_sweep.<locals>.measurement_function`. Works the same for the simulated instruments in
+cqed.utils.simulated_instruments, such that improvements can be measured without hardware.
+
+A write is counted as redundant when it sets a value that the previous write with the same header already set,
+e.g. a second 'SENS1:SWE:POIN 201' without another 'SENS1:SWE:POIN' in between. Writes without argument are
+commands like '*TRG' and are never redundant.
+
+Example:
+    with VisaProfiler(station) as profiler:
+        pysweep.sweep(...)
+    print(profiler.report())
+
+"""
+
+import os
+import sys
+from collections import namedtuple
+from threading import Lock
+from time import perf_counter
+import numpy as np
+from qcodes import Instrument
+
+Command = namedtuple("Command", ["instrument", "kind", "command", "duration", "site", "redundant"])
+
+_CQED_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules between the call site and the instrument, which are never reported as call site
+_SKIPPED_FILES = {os.path.abspath(__file__), os.path.join(_CQED_FOLDER, "utils", "simulated_instruments.py")}
+
+
+def _call_site(frame):
+    """ Qualified name and line of the innermost cqed function in the stack of frame, or the outermost frame. """
+    last = frame
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_CQED_FOLDER) and filename not in _SKIPPED_FILES:
+            module = frame.f_globals.get("__name__", "")
+            return f"{module}.{_qualname(frame.f_code)}", frame.f_lineno
+        last = frame
+        frame = frame.f_back
+    return f"{last.f_globals.get('__name__', '')}.{_qualname(last.f_code)}", last.f_lineno
+
+
+def _qualname(code):
+    # co_qualname exists from Python 3.11 on
+    return getattr(code, "co_qualname", code.co_name)
+
+
+class VisaProfiler:
+    """
+    Logs every write_raw and ask_raw call of the attached instruments.
+
+    args:
+    instruments: QCoDeS instruments or stations to attach to; for a station, all its instruments are attached.
+    The instruments can also be attached later, with `attach`.
+    """
+
+    def __init__(self, *instruments):
+        self._lock = Lock()
+        self._attached = {}  # per attached instrument, the methods it had before attaching
+        self.reset()
+        for instrument in instruments:
+            self.attach(instrument)
+
+    def reset(self):
+        """ Forgets all logged commands. """
+        with self._lock:
+            self.commands = []
+            self._last_writes = {}
+
+    def attach(self, instrument):
+        """ Starts logging the commands of an instrument, or of all instruments of a station. """
+        if not isinstance(instrument, Instrument):
+            for component in instrument.components.values():
+                if isinstance(component, Instrument):
+                    self.attach(component)
+            return
+        if instrument in self._attached:
+            return
+        # the methods in place are wrapped, such that other wrappers (as timing.timed_instrument) keep working
+        previous = {}
+        for kind, method in [("write", "write_raw"), ("ask", "ask_raw")]:
+            previous[method] = instrument.__dict__.get(method)
+            setattr(instrument, method, self._logged(instrument, kind, method, previous[method]))
+        self._attached[instrument] = previous
+
+    def detach(self):
+        """
+        Restores the communication methods of all attached instruments. Methods that were wrapped again after
+        attaching are kept; their logging wrapper then only passes the commands on.
+        """
+        for instrument, previous in self._attached.items():
+            for method, method_before in previous.items():
+                if getattr(instrument.__dict__.get(method), "visa_profiler", None) is not self:
+                    continue
+                if method_before is None:
+                    del instrument.__dict__[method]
+                else:
+                    setattr(instrument, method, method_before)
+        self._attached = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+        return False
+
+    def _logged(self, instrument, kind, method, previous):
+        name = instrument.name
+
+        def call(cmd):
+            # the method of the class is looked up per call, such that patches of the class made later are used
+            if previous is not None:
+                return previous(cmd)
+            return getattr(type(instrument), method)(instrument, cmd)
+
+        def logged(cmd):
+            if instrument not in self._attached:
+                return call(cmd)
+            start = perf_counter()
+            try:
+                return call(cmd)
+            finally:
+                duration = perf_counter() - start
+                self._log(name, kind, cmd, duration, _call_site(sys._getframe(1)))
+
+        logged.visa_profiler = self
+        return logged
+
+    def _log(self, name, kind, cmd, duration, site):
+        redundant = False
+        with self._lock:
+            if kind == "write":
+                header, _, argument = cmd.strip().partition(" ")
+                if argument:
+                    key = (name, header.lstrip(":").upper())
+                    redundant = self._last_writes.get(key) == argument.strip()
+                    self._last_writes[key] = argument.strip()
+            self.commands.append(Command(name, kind, cmd, duration, site, redundant))
+
+    def summary(self, by="function"):
+        """
+        Number of writes, asks and redundant writes, and the total time (s) per call site.
+
+        args:
+        by (str): 'function' to group by the function of the call site, 'line' by function and line,
+        'instrument' by instrument.
+        """
+        with self._lock:
+            commands = list(self.commands)
+        groups = {}
+        for command in commands:
+            if by == "function":
+                key = command.site[0]
+            elif by == "line":
+                key = f"{command.site[0]}:{command.site[1]}"
+            elif by == "instrument":
+                key = command.instrument
+            else:
+                raise ValueError(f"Cannot group by {by}, use 'function', 'line' or 'instrument'.")
+            group = groups.setdefault(key, {"writes": 0, "asks": 0, "redundant": 0, "durations": []})
+            group["writes" if command.kind == "write" else "asks"] += 1
+            group["redundant"] += command.redundant
+            group["durations"].append(command.duration)
+        return {key: {"writes": group["writes"], "asks": group["asks"], "redundant": group["redundant"],
+                      "total": np.sum(group["durations"]), "mean": np.mean(group["durations"])}
+                for key, group in groups.items()}
+
+    def redundant_writes(self):
+        """ The redundant writes, with the number of times they were sent, per instrument and call site. """
+        counts = {}
+        with self._lock:
+            for command in self.commands:
+                if command.redundant:
+                    key = (command.instrument, command.command.strip(), command.site[0])
+                    counts[key] = counts.get(key, 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+    def report(self, by="function", nredundant=10):
+        """ Table of the summary, sorted by total time, followed by the most frequent redundant writes. """
+        summary = self.summary(by)
+        width = max([len(key) for key in summary] + [len(by)])
+        lines = [f"{by:{width}s} {'writes':>7s} {'asks':>7s} {'redundant':>9s} {'total (s)':>10s} "
+                 f"{'mean (ms)':>10s}"]
+        for key, stats in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+            lines.append(f"{key:{width}s} {stats['writes']:7d} {stats['asks']:7d} {stats['redundant']:9d} "
+                         f"{stats['total']:10.3f} {stats['mean'] * 1e3:10.3f}")
+        redundant = list(self.redundant_writes().items())[:nredundant]
+        if redundant:
+            lines.append("")
+            lines.append("most frequent redundant writes:")
+            for (instrument, command, function), count in redundant:
+                lines.append(f"{count:7d} x {instrument}: '{command}' from {function}")
+        return "\n".join(lines)